@@ -0,0 +1,301 @@
+"""
+Local benchmark for the pure-Python decoders in resizeLambda's vendored Pillow.
+
+Generates each case's file in memory, then times Image.open() plus load() on
+it and reports the best and median time and megapixels per second. To
+compare a decoder change with the previous revision, run the same cases on
+both (the compiled Pillow modules are not tracked, so they stay in place):
+
+    git checkout HEAD~1 -- lambdas/resizeLambda/PIL
+    python benchmarks/decode_benchmark.py --json before.json
+    git checkout HEAD -- lambdas/resizeLambda/PIL
+    python benchmarks/decode_benchmark.py --json after.json
+
+    python benchmarks/decode_benchmark.py --cases ppm-plain-rgb --sizes 0.25,1
+"""
+import argparse
+import gzip
+import io
+import json
+import os
+import statistics
+import struct
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESIZE_LAMBDA_DIR = os.path.join(REPO_ROOT, 'lambdas', 'resizeLambda')
+
+DEFAULT_SIZES = '0.25,1' # Megapixels
+VALUES_PER_LINE = 17 # Plain PNM lines must stay under 70 characters
+
+
+def source_image(mode, megapixels):
+    """Deterministic photo-like content of the given mode and size."""
+    from PIL import Image
+
+    width = max(1, round((megapixels * 1e6 * 4 / 3) ** 0.5))
+    height = max(1, round(width * 3 / 4))
+    bands = [
+        Image.effect_mandelbrot((width, height), (-2.0, -1.2, 1.0, 1.2), 100),
+        Image.linear_gradient('L').resize((width, height)),
+        Image.radial_gradient('L').resize((width, height)),
+    ]
+    return Image.merge('RGB', bands).convert(mode)
+
+
+def plain_pnm(magic, maxval=None):
+    """
+    Returns a case generating an ASCII (P1-P3) PBM/PGM/PPM file. Pillow only
+    writes the binary forms, so the raster is written as text here.
+    """
+    mode = {b'P1': '1', b'P2': 'L', b'P3': 'RGB'}[magic]
+
+    def generate(megapixels):
+        im = source_image(mode, megapixels)
+        if magic == b'P1':
+            # 1 is black in PBM
+            values = [0 if value else 1 for value in im.convert('L').tobytes()]
+            header = b'P1\n%d %d\n' % im.size
+        else:
+            scale = [round(value * (maxval or 255) / 255) for value in range(256)]
+            values = [scale[value] for value in im.tobytes()]
+            header = b'%s\n%d %d\n%d\n' % (magic, *im.size, maxval or 255)
+        lines = [header, b'# generated by decode_benchmark\n']
+        for start in range(0, len(values), VALUES_PER_LINE):
+            lines.append(b' '.join(b'%d' % value for value in values[start:start + VALUES_PER_LINE]) + b'\n')
+        return b''.join(lines)
+
+    return generate
+
+
+def rle_rows(rows, rle4):
+    """
+    Run-length encodes rows of palette indices the way BMP RLE8/RLE4 encoders
+    do: runs of 3 or more pixels as encoded runs, the rest as absolute runs.
+    """
+    out = bytearray()
+    for row in rows:
+        x = 0
+        while x < len(row):
+            run = 1
+            while x + run < len(row) and run < 255 and row[x + run] == row[x]:
+                run += 1
+            if run >= 3 or len(row) - x < 3:
+                out += bytes((run, row[x] * 17 if rle4 else row[x]))
+                x += run
+                continue
+            # Absolute run up to the next run of 3
+            end = x
+            while end < len(row) and end - x < 254 and not (
+                end + 2 < len(row) and row[end] == row[end + 1] == row[end + 2]
+            ):
+                end += 1
+            if end - x < 3:
+                end = min(len(row), x + 3)
+            literal = row[x:end]
+            if rle4:
+                packed = bytes(
+                    (literal[i] << 4) | (literal[i + 1] if i + 1 < len(literal) else 0)
+                    for i in range(0, len(literal), 2)
+                )
+            else:
+                packed = bytes(literal)
+            out += bytes((0, len(literal))) + packed + b'\0' * (len(packed) & 1)
+            x = end
+        out += b'\0\0' # End of line
+    out += b'\0\1' # End of bitmap
+    return bytes(out)
+
+
+def bmp_rle(bits):
+    """Returns a case generating an RLE8 (bits=8) or RLE4 (bits=4) BMP file."""
+
+    def generate(megapixels):
+        colors = 1 << bits
+        # Quantized, so large areas are flat like the screenshots RLE is used for
+        im = source_image('RGB', megapixels).quantize(colors)
+        width, height = im.size
+        indices = im.tobytes()
+        rows = [indices[y * width:(y + 1) * width] for y in reversed(range(height))] # Bottom-up
+        data = rle_rows(rows, bits == 4)
+        palette = im.getpalette()[:colors * 3]
+        palette += [0] * (colors * 3 - len(palette))
+        bgrx = b''.join(bytes((palette[i + 2], palette[i + 1], palette[i], 0)) for i in range(0, len(palette), 3))
+        offset = 14 + 40 + len(bgrx)
+        compression = 2 if bits == 4 else 1
+        header = struct.pack('<2sIHHI', b'BM', offset + len(data), 0, 0, offset)
+        info = struct.pack('<IiiHHIIiiII', 40, width, height, 1, bits, compression, len(data), 2835, 2835, colors, 0)
+        return header + info + bgrx + data
+
+    return generate
+
+
+def sgi_16bit(mode):
+    """Returns a case generating an uncompressed 16-bit SGI file."""
+
+    def generate(megapixels):
+        out = io.BytesIO()
+        source_image(mode, megapixels).save(out, format='SGI', bpc=2)
+        return out.getvalue()
+
+    return generate
+
+
+def msp_rle(megapixels):
+    """Generates a Windows Paint 2.0 (LinS) file with run-length encoded rows."""
+    im = source_image('1', megapixels)
+    width, height = im.size
+    rowbytes = (width + 7) // 8
+    pixels = im.tobytes()
+    rows = []
+    for y in range(height):
+        row = pixels[y * rowbytes:(y + 1) * rowbytes]
+        out = bytearray()
+        x = 0
+        while x < len(row):
+            run = 1
+            while x + run < len(row) and run < 255 and row[x + run] == row[x]:
+                run += 1
+            if run >= 3:
+                out += bytes((0, run, row[x]))
+            else:
+                # Literal bytes up to the next run of 3
+                end = x
+                while end < len(row) and end - x < 255 and not (
+                    end + 2 < len(row) and row[end] == row[end + 1] == row[end + 2]
+                ):
+                    end += 1
+                run = max(end - x, 1)
+                out += bytes((run,)) + row[x:x + run]
+            x += run
+        rows.append(bytes(out))
+    # Same header as PIL.MspImagePlugin writes, apart from the version
+    header = [0] * 16
+    header[0], header[1] = struct.unpack('<2H', b'LinS')
+    header[2], header[3] = width, height
+    header[4:8] = 1, 1, 1, 1
+    header[8], header[9] = width, height
+    for word in header[:12]:
+        header[12] ^= word # Checksum
+    rowmap = struct.pack(f"<{height}H", *(len(row) for row in rows))
+    return struct.pack('<16H', *header) + rowmap + b''.join(rows)
+
+
+def fits_cards(*cards):
+    """A FITS header unit from (keyword, value) cards, padded to 2880 bytes."""
+    header = b''.join(f"{keyword:<8}= {value:>20}".encode().ljust(80) for keyword, value in cards)
+    header += b'END'.ljust(80)
+    return header.ljust(-(-len(header) // 2880) * 2880)
+
+
+def fits_gzip(bits):
+    """
+    Returns a case generating a tile compressed (GZIP_1) FITS image with one
+    tile per row, each a separate gzip member of 4 byte big endian values.
+    """
+
+    def generate(megapixels):
+        im = source_image('L', megapixels)
+        width, height = im.size
+        values = im.tobytes()
+        scale = 1 << (min(bits, 31) - 8) # Fill the signed range
+        tiles = []
+        for y in range(height):
+            row = values[y * width:(y + 1) * width]
+            tiles.append(gzip.compress(struct.pack(f">{width}i", *(value * scale for value in row)), compresslevel=6))
+        primary = fits_cards(('SIMPLE', 'T'), ('BITPIX', 8), ('NAXIS', 0))
+        table = fits_cards(
+            ('XTENSION', "'BINTABLE'"), ('BITPIX', 8), ('NAXIS', 2), ('NAXIS1', 8), ('NAXIS2', height),
+            ('ZIMAGE', 'T'), ('ZBITPIX', bits), ('ZNAXIS', 2), ('ZNAXIS1', width), ('ZNAXIS2', height),
+            ('ZCMPTYPE', "'GZIP_1  '"),
+        )
+        # Table rows of (size, heap offset) descriptors, then the heap
+        descriptors = b''
+        heap_offset = 0
+        for tile in tiles:
+            descriptors += struct.pack('>2i', len(tile), heap_offset)
+            heap_offset += len(tile)
+        data = descriptors + b''.join(tiles)
+        return primary + table + data.ljust(-(-len(data) // 2880) * 2880, b'\0')
+
+    return generate
+
+
+# name -> function(megapixels) returning the encoded file
+CASES = {
+    'ppm-plain-bitonal': plain_pnm(b'P1'),
+    'ppm-plain-gray': plain_pnm(b'P2'),
+    'ppm-plain-gray-maxval1000': plain_pnm(b'P2', 1000),
+    'ppm-plain-rgb': plain_pnm(b'P3'),
+    'bmp-rle8': bmp_rle(8),
+    'bmp-rle4': bmp_rle(4),
+    'sgi-16bit-gray': sgi_16bit('L'),
+    'sgi-16bit-rgb': sgi_16bit('RGB'),
+    'msp-rle': msp_rle,
+    'fits-gzip-8bit': fits_gzip(8),
+    'fits-gzip-16bit': fits_gzip(16),
+}
+
+
+def run_case(name, megapixels, iterations):
+    from PIL import Image
+
+    data = CASES[name](megapixels)
+    times = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        with Image.open(io.BytesIO(data)) as im:
+            im.load()
+        times.append(time.perf_counter() - start)
+    pixels = im.width * im.height / 1e6
+    return {
+        'case': name,
+        'megapixels': megapixels,
+        'size': im.size,
+        'mode': im.mode,
+        'bytes_in': len(data),
+        'best_ms': min(times) * 1000,
+        'median_ms': statistics.median(times) * 1000,
+        'megapixels_per_second': pixels / min(times),
+    }
+
+
+def print_results(results):
+    header = f"{'case':<28} {'MP':>6} {'size':>11} {'mode':<4} {'best ms':>9} {'median ms':>10} {'MP/s':>8}"
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        size = 'x'.join(str(n) for n in r['size'])
+        print(
+            f"{r['case']:<28} {r['megapixels']:>6} {size:>11} {r['mode']:<4} "
+            f"{r['best_ms']:>9.1f} {r['median_ms']:>10.1f} {r['megapixels_per_second']:>8.2f}"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cases', default=','.join(CASES), help="comma-separated cases (default all)")
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help=f"comma-separated image sizes in megapixels (default {DEFAULT_SIZES})")
+    parser.add_argument('--iterations', type=int, default=5, help="timed runs per case (default 5)")
+    parser.add_argument('--lambda-dir', default=RESIZE_LAMBDA_DIR, help="resizeLambda directory whose Pillow is benchmarked")
+    parser.add_argument('--json', help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, args.lambda_dir)
+
+    results = []
+    for name in args.cases.split(','):
+        if name not in CASES:
+            parser.error(f"unknown case {name!r}, expected one of {', '.join(CASES)}")
+        for megapixels in (float(size) for size in args.sizes.split(',')):
+            results.append(run_case(name, megapixels, args.iterations))
+
+    print_results(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,270 @@
+"""
+Local benchmark for the resize pipeline.
+
+Runs resizeLambda's lambda_handler against a file-backed stand-in for S3 over
+a generated image corpus and reports throughput, p50/p99 latency, the median
+of each stage timed by the handler's EMF metrics and peak RSS, per format,
+source size and target size.
+
+Each case runs in a fresh process so peak RSS is measured per case. Generated
+images are cached in the corpus directory, so repeated runs compare the same
+inputs.
+
+    python benchmarks/resize_benchmark.py --sizes 0.1,1,12 --targets 256,1024
+    python benchmarks/resize_benchmark.py --json results.json
+"""
+import argparse
+import concurrent.futures
+import contextlib
+import io
+import json
+import math
+import multiprocessing
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import types
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESIZE_LAMBDA_DIR = os.path.join(REPO_ROOT, 'lambdas', 'resizeLambda')
+
+DEFAULT_FORMATS = 'JPEG,PNG,WEBP,GIF'
+DEFAULT_SIZES = '0.1,1,12,24,100' # Megapixels
+DEFAULT_TARGETS = '256,1024'
+SOURCE_BUCKET = 'benchmark-uploads'
+STAGES = ('Download', 'Open', 'Decode', 'Resize', 'Encode', 'Upload')
+ALPHA_FORMATS = ('PNG', 'WEBP', 'GIF') # Formats also benchmarked with transparency
+CONTENT_TYPES = {'JPEG': 'image/jpeg', 'PNG': 'image/png', 'WEBP': 'image/webp', 'GIF': 'image/gif'}
+
+
+class FileS3Client:
+    """
+    Minimal stand-in for the boto3 S3 client, storing objects as files under
+    root/<bucket>/<key> with a JSON sidecar for ContentType and Metadata.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, bucket, key):
+        return os.path.join(self.root, bucket, key)
+
+    def get_object(self, Bucket, Key):
+        path = self._path(Bucket, Key)
+        with open(path + '.meta.json') as f:
+            meta = json.load(f)
+        with open(path, 'rb') as f:
+            body = io.BytesIO(f.read())
+        return {
+            'Body': body,
+            'ContentLength': body.getbuffer().nbytes,
+            'ContentType': meta.get('ContentType'),
+            'Metadata': meta.get('Metadata', {}),
+        }
+
+    def put_object(self, Bucket, Key, Body, ContentType=None, Metadata=None, **kwargs):
+        path = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = Body.read() if hasattr(Body, 'read') else Body
+        with open(path, 'wb') as f:
+            f.write(data)
+        with open(path + '.meta.json', 'w') as f:
+            json.dump({'ContentType': ContentType, 'Metadata': Metadata or {}}, f)
+        return {}
+
+
+def import_handler(s3_root, originals_dir):
+    """
+    Imports resizeLambda with its S3 client replaced by a FileS3Client, caching
+    downloaded originals in originals_dir instead of the system temp directory.
+    """
+    os.environ['ORIGINALS_CACHE_DIR'] = originals_dir
+    sys.path.insert(0, RESIZE_LAMBDA_DIR)
+    try:
+        import boto3 # noqa: F401
+    except ImportError:
+        # The harness never talks to AWS, so boto3 is only needed for the import
+        sys.modules['boto3'] = types.SimpleNamespace(client=lambda *args, **kwargs: None)
+    import lambda_function
+    lambda_function.s3_client = FileS3Client(s3_root)
+    return lambda_function
+
+
+def generate_image(image_format, megapixels, alpha):
+    """Deterministic synthetic photo-like content of the given size."""
+    from PIL import Image
+
+    width = max(1, round(math.sqrt(megapixels * 1e6 * 4 / 3)))
+    height = max(1, round(width * 3 / 4))
+    base_size = (640, 480)
+    bands = [
+        Image.effect_mandelbrot(base_size, (-2.0, -1.2, 1.0, 1.2), 100),
+        Image.linear_gradient('L').resize(base_size),
+        Image.radial_gradient('L').resize(base_size),
+    ]
+    mode = 'RGB'
+    if alpha:
+        bands.append(Image.linear_gradient('L').rotate(90).resize(base_size))
+        mode = 'RGBA'
+    im = Image.merge(mode, bands).resize((width, height), Image.Resampling.BICUBIC)
+    if image_format == 'GIF':
+        im = im.convert('RGB').quantize(255 if alpha else 256)
+        if alpha:
+            # Use the last palette entry for the fully transparent area
+            mask = bands[3].resize((width, height)).point(lambda a: 255 if a < 32 else 0)
+            im.paste(255, mask=mask)
+            im.info['transparency'] = 255
+    return im
+
+
+def corpus_file(corpus_dir, image_format, megapixels, alpha):
+    suffix = 'alpha' if alpha else 'opaque'
+    path = os.path.join(corpus_dir, f"{megapixels}mp-{suffix}.{image_format.lower()}")
+    if not os.path.exists(path):
+        os.makedirs(corpus_dir, exist_ok=True)
+        im = generate_image(image_format, megapixels, alpha)
+        im.save(path, format=image_format)
+    return path
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def peak_rss_mb():
+    # VmHWM belongs to the current address space, whereas ru_maxrss on Linux
+    # also covers the parent's memory up to the fork that started this process
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def run_case(case):
+    """Runs one (format, size, alpha, target) case. Executed in a fresh process."""
+    with tempfile.TemporaryDirectory(prefix='resize-benchmark-') as originals_dir:
+        return measure_case(case, import_handler(case['s3_root'], originals_dir))
+
+
+def measure_case(case, handler):
+    s3 = handler.s3_client
+
+    with open(case['path'], 'rb') as f:
+        data = f.read()
+    key = os.path.basename(case['path'])
+    s3.put_object(
+        Bucket=SOURCE_BUCKET,
+        Key=key,
+        Body=data,
+        ContentType=CONTENT_TYPES[case['format']],
+        Metadata={'max-dimension': str(case['target'])},
+    )
+    event = {'Records': [{'s3': {'bucket': {'name': SOURCE_BUCKET}, 'object': {'key': key}}}]}
+
+    latencies = []
+    stage_times = {stage: [] for stage in STAGES}
+    for iteration in range(case['warmup'] + case['iterations']):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            start = time.perf_counter()
+            result = handler.lambda_handler(event, None)
+            elapsed = time.perf_counter() - start
+        if result['statusCode'] != 200:
+            return {**case, 'error': result['body']}
+        if iteration < case['warmup']:
+            continue
+        latencies.append(elapsed)
+        for line in output.getvalue().splitlines():
+            if line.startswith('{') and '"_aws"' in line:
+                record = json.loads(line)
+                for stage in STAGES:
+                    if f"{stage}Time" in record:
+                        stage_times[stage].append(record[f"{stage}Time"])
+
+    total = sum(latencies)
+    return {
+        **case,
+        'bytes_in': len(data),
+        'images_per_second': len(latencies) / total,
+        'megapixels_per_second': len(latencies) * case['megapixels'] / total,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'stages_p50_ms': {stage: statistics.median(times) for stage, times in stage_times.items() if times},
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def print_results(results):
+    header = f"{'format':<6} {'alpha':<5} {'MP':>6} {'target':>6} {'img/s':>8} {'MP/s':>8} {'p50 ms':>9} {'p99 ms':>9} {'RSS MB':>8}  stages p50 ms"
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        if 'error' in r:
+            print(f"{r['format']:<6} {str(r['alpha']):<5} {r['megapixels']:>6} {r['target']:>6}  error: {r['error']}")
+            continue
+        stages = ' '.join(f"{stage}={ms:.1f}" for stage, ms in r['stages_p50_ms'].items())
+        print(
+            f"{r['format']:<6} {str(r['alpha']):<5} {r['megapixels']:>6} {r['target']:>6} "
+            f"{r['images_per_second']:>8.2f} {r['megapixels_per_second']:>8.1f} "
+            f"{r['p50_ms']:>9.1f} {r['p99_ms']:>9.1f} {r['peak_rss_mb']:>8.1f}  {stages}"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--formats', default=DEFAULT_FORMATS, help=f"comma-separated formats (default {DEFAULT_FORMATS})")
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help=f"comma-separated source sizes in megapixels (default {DEFAULT_SIZES})")
+    parser.add_argument('--targets', default=DEFAULT_TARGETS, help=f"comma-separated max-dimension values (default {DEFAULT_TARGETS})")
+    parser.add_argument('--iterations', type=int, default=5, help="timed runs per case (default 5)")
+    parser.add_argument('--warmup', type=int, default=1, help="untimed runs per case (default 1)")
+    parser.add_argument('--no-alpha', action='store_true', help="skip the transparent variants")
+    parser.add_argument('--corpus-dir', default=os.path.join(REPO_ROOT, 'benchmarks', '.corpus'), help="where generated images are cached")
+    parser.add_argument('--s3-dir', default=os.path.join(REPO_ROOT, 'benchmarks', '.s3'), help="root of the file-backed S3 stand-in")
+    parser.add_argument('--json', help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, RESIZE_LAMBDA_DIR) # Generate the corpus with the same Pillow the Lambda uses
+
+    cases = []
+    for image_format in args.formats.upper().split(','):
+        for megapixels in (float(size) for size in args.sizes.split(',')):
+            alphas = (False, True) if image_format in ALPHA_FORMATS and not args.no_alpha else (False,)
+            for alpha in alphas:
+                path = corpus_file(args.corpus_dir, image_format, megapixels, alpha)
+                for target in (int(target) for target in args.targets.split(',')):
+                    cases.append({
+                        'format': image_format,
+                        'megapixels': megapixels,
+                        'alpha': alpha,
+                        'target': target,
+                        'path': path,
+                        's3_root': args.s3_dir,
+                        'iterations': args.iterations,
+                        'warmup': args.warmup,
+                    })
+
+    # One process per case, so that peak RSS is not inherited from earlier cases
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for case in cases:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            results.append(executor.submit(run_case, case).result())
+
+    print_results(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,18 +5,22 @@ import axios from 'axios';
 const API_GATEWAY_URL = process.env.REACT_APP_API_GATEWAY_URL;
 const DESTINATION_BUCKET_BASE_URL = process.env.REACT_APP_DESTINATION_BUCKET_BASE_URL;
 
-// Polling Configuration
-const POLL_INTERVAL_MS = 3000; // Check every 3 seconds
-const MAX_POLL_ATTEMPTS = 15; // Try up to 15 times (e.g., 45 seconds total)
+// Status Configuration
+const STATUS_WAIT_SECONDS = 20; // The status endpoint answers as soon as processing completes, or after this long
+const MAX_STATUS_REQUESTS = 3; // Try up to 3 times (e.g., 60 seconds total)
 
 // Type for API response
 interface PresignedUrlResponse {
     uploadUrl: string;
     key: string;
+    fields?: { [key: string]: string }; // Present for presigned POST uploads
 }
 
-interface GetProcessedUrlResponse {
-    processedUrl: string;
+interface ProcessingStatusResponse {
+    key: string;
+    status: 'pending' | 'succeeded' | 'failed';
+    processedUrl?: string;
+    error?: string;
 }
 
 const ImageUploader: React.FC = () => {
@@ -29,55 +33,61 @@ const ImageUploader: React.FC = () => {
     const [customDimension, setCustomDimension] = useState<string>(''); // Store as string from input
 
 
-    // Ref to store the polling interval ID to clear it later
-    const pollIntervalRef = useRef<NodeJS.Timeout | null>(null);
+    // Ref to cancel the pending status request
+    const pollAbortRef = useRef<AbortController | null>(null);
 
     // Cleanup polling on component unmount
     useEffect(() => {
         return () => {
-            if (pollIntervalRef.current) {
-                clearInterval(pollIntervalRef.current);
-            }
+            pollAbortRef.current?.abort();
         };
     }, []);
 
     const stopPolling = () => {
-        if (pollIntervalRef.current) {
-            clearInterval(pollIntervalRef.current);
-            pollIntervalRef.current = null;
-        }
+        pollAbortRef.current?.abort();
+        pollAbortRef.current = null;
     };
 
-    const pollForProcessedImage = (key: string, attempt: number) => {
-        console.log(`Polling for key ${key}, attempt ${attempt}`);
-        setStatusMessage(`Processing... (Attempt ${attempt}/${MAX_POLL_ATTEMPTS})`);
-
-        const getUrlEndpoint = `${API_GATEWAY_URL}/get-processed-url?key=${encodeURIComponent(key)}`;
-
-        axios.get<GetProcessedUrlResponse>(getUrlEndpoint)
-            .then(response => {
-                const secureProcessedUrl = response.data.processedUrl;
-                console.log("Polling successful. Received presigned GET URL:", secureProcessedUrl);
-                setErrorMessage(null)
-                setProcessedImageUrl(secureProcessedUrl);
-                setStatusMessage('Processing complete.');
-                stopPolling(); // Stop polling on success
-            })
-            .catch(error => {
-                console.warn(`Polling attempt ${attempt} failed:`, error.response?.status, error.message);
-                if (attempt >= MAX_POLL_ATTEMPTS) {
-                    console.error("Max polling attempts reached.");
-                    setErrorMessage("Processing timed out or failed. Please try again.");
-                    setStatusMessage('');
-                    stopPolling(); // Stop polling on max attempts
-                } else if (axios.isAxiosError(error) && error.response?.status !== 404) {
-                    // If it's an error other than 404 (Not Found), stop polling and show error
-                    setErrorMessage(`Error retrieving processed image: ${error.response?.data?.message || error.message}`);
+    const waitForProcessedImage = async (key: string) => {
+        const controller = new AbortController();
+        pollAbortRef.current = controller;
+        const statusEndpoint = `${API_GATEWAY_URL}/processing-status?key=${encodeURIComponent(key)}&wait=${STATUS_WAIT_SECONDS}`;
+
+        try {
+            for (let attempt = 1; attempt <= MAX_STATUS_REQUESTS; attempt++) {
+                console.log(`Waiting for key ${key}, request ${attempt}`);
+                setStatusMessage('Processing...');
+
+                // Answered with 200 once the completion record exists, 202 while still pending
+                const response = await axios.get<ProcessingStatusResponse>(statusEndpoint, { signal: controller.signal });
+                if (response.status !== 200) {
+                    continue;
+                }
+                if (response.data.status === 'succeeded' && response.data.processedUrl) {
+                    console.log("Processing complete. Received presigned GET URL:", response.data.processedUrl);
+                    setErrorMessage(null);
+                    setProcessedImageUrl(response.data.processedUrl);
+                    setStatusMessage('Processing complete.');
+                } else {
+                    setErrorMessage(`Processing failed: ${response.data.error || 'unknown error'}`);
                     setStatusMessage('');
-                    stopPolling();
                 }
-                // If it's 404, we just let the interval run for the next attempt
-            });
+                return;
+            }
+            console.error("Max status requests reached.");
+            setErrorMessage("Processing timed out or failed. Please try again.");
+            setStatusMessage('');
+        } catch (error: any) {
+            if (axios.isCancel(error)) {
+                return; // Stopped because a new file was selected or uploaded
+            }
+            setErrorMessage(`Error retrieving processed image: ${error.response?.data?.message || error.message}`);
+            setStatusMessage('');
+        } finally {
+            if (pollAbortRef.current === controller) {
+                pollAbortRef.current = null;
+            }
+        }
     };
 
     const handleFileChange = (event: ChangeEvent<HTMLInputElement>) => {
@@ -121,10 +131,12 @@ const ImageUploader: React.FC = () => {
             const requestData: {
                 filename: string;
                 contentType: string;
+                uploadMethod: string;
                 maxDimension?: number; // Make it optional
             } = {
                 filename: selectedFile!.name, // Use non-null assertion if check done above
-                contentType: selectedFile!.type
+                contentType: selectedFile!.type,
+                uploadMethod: 'POST' // S3 enforces size and type limits on presigned POST uploads
             };
 
             console.log("Custom Dimension State:", customDimension);
@@ -146,7 +158,7 @@ const ImageUploader: React.FC = () => {
             const response = await axios.post<PresignedUrlResponse>(apiEndpoint, requestData);
 
 
-            const { uploadUrl, key } = response.data;
+            const { uploadUrl, key, fields } = response.data;
             console.log("Received presigned URL:", uploadUrl);
             console.log("Object key:", key);
 
@@ -171,63 +183,32 @@ const ImageUploader: React.FC = () => {
             console.log("Final headers being sent:", uploadHeaders); // Log the complete headers object
 
 
+            const onUploadProgress = (progressEvent: { loaded: number; total?: number }) => {
+                const percentCompleted = Math.round(
+                    (progressEvent.loaded * 100) / (progressEvent.total ?? 1) // Handle potential null total
+                );
+                setUploadProgress(percentCompleted);
+            };
+
             // 2. Upload the file directly to S3 using the presigned URL
-            await axios.put(uploadUrl, selectedFile, {
-                headers: uploadHeaders, // Pass the constructed headers
-                onUploadProgress: (progressEvent) => {
-                    const percentCompleted = Math.round(
-                        (progressEvent.loaded * 100) / (progressEvent.total ?? 1) // Handle potential null total
-                    );
-                    setUploadProgress(percentCompleted);
-                },
-            });
+            if (fields) {
+                // Presigned POST: policy fields first, the file must be the last form field
+                const formData = new FormData();
+                Object.entries(fields).forEach(([name, value]) => formData.append(name, value));
+                formData.append('file', selectedFile);
+                await axios.post(uploadUrl, formData, { onUploadProgress });
+            } else {
+                await axios.put(uploadUrl, selectedFile, {
+                    headers: uploadHeaders, // Pass the constructed headers
+                    onUploadProgress,
+                });
+            }
 
             setStatusMessage('Upload successful! Getting processed image URL...');
             console.log("File uploaded successfully to S3. Starting polling for key:", key);
 
-            // **** START POLLING ****
-            // 3. Poll for the processed image URL
-            let attempt = 0;
-            // Immediately try once
-             pollForProcessedImage(key, ++attempt);
-            // Then set interval for subsequent attempts
-            pollIntervalRef.current = setInterval(() => {
-                pollForProcessedImage(key, ++attempt);
-            }, POLL_INTERVAL_MS);
-            // **** END POLLING ****
-
-
-                // 3. Get the Presigned GET URL for the processed image
-            try {
-                // Construct the URL for the new GET endpoint, passing the key
-                const getUrlEndpoint = `<span class="math-inline">\{API\_GATEWAY\_URL\}/get\-processed\-url?key\=</span>{encodeURIComponent(key)}`;
-                console.log("Requesting GET URL from:", getUrlEndpoint);
-
-                // Make the GET request
-                const getUrlResponse = await axios.get<{ processedUrl: string }>(getUrlEndpoint);
-                const secureProcessedUrl = getUrlResponse.data.processedUrl;
-
-                console.log("Received presigned GET URL:", secureProcessedUrl);
-                setProcessedImageUrl(secureProcessedUrl); // Use the presigned GET URL
-                setStatusMessage('Processing complete.');
-
-            } catch (getUrlError: any) {
-                console.error("Failed to get processed image URL:", getUrlError);
-                let getMessage = "Could not retrieve processed image URL.";
-                if (axios.isAxiosError(getUrlError)) {
-                    // Handle 404 specifically if object not found yet
-                    if (getUrlError.response?.status === 404) {
-                        getMessage = "Processed image not found yet. Try refreshing shortly.";
-                    } else {
-                        getMessage = getUrlError.response?.data?.message || getUrlError.message || getMessage;
-                    }
-                } else if (getUrlError instanceof Error) {
-                    getMessage = getUrlError.message;
-                }
-                setErrorMessage(getMessage);
-                setStatusMessage('');
-            }
-
+            // 3. Wait for the processed image URL
+            await waitForProcessedImage(key);
 
         } catch (error: any) {
             console.error("Upload failed:", error);
@@ -4,6 +4,7 @@ import json
 import logging
 import uuid
 import re
+import math
 from botocore.config import Config
 
 # Configure logger
@@ -22,14 +23,46 @@ s3_client = boto3.client('s3', region_name=REGION, config=Config(signature_versi
 MIN_DIMENSION = 64
 MAX_DIMENSION = 4096 # (adjust as needed)
 
+# Content types the resize Lambda can process; anything else is rejected here
+# instead of being uploaded and failing later in the resize Lambda
+ALLOWED_CONTENT_TYPES = (
+    'image/jpeg',
+    'image/png',
+    'image/webp',
+    'image/gif',
+    'image/bmp',
+    'image/tiff',
+    'image/jp2',
+)
+# Enforced by S3 through the presigned POST policy, or the content length signed into
+# PUT and upload part URLs
+MAX_UPLOAD_BYTES = 256 * 1024 * 1024
 
-def lambda_handler(event, context):
+URL_EXPIRATION_SECONDS = 300  # URL expiration time in seconds (e.g., 5 minutes)
+MAX_BATCH_SIZE = 500 # Maximum number of files signed in one batch request
+
+# --- Multipart uploads ---
+# Files of at least this size (sent as 'fileSize' in the request) get one presigned
+# URL per part, so clients can upload parts in parallel and retry them individually.
+# The upload bucket's CORS configuration must expose the ETag header to the browser,
+# and a lifecycle rule should abort incomplete multipart uploads (see README), as
+# clients that never complete or abort one leave its parts stored and billed.
+MULTIPART_THRESHOLD_BYTES = int(os.environ.get('MULTIPART_THRESHOLD_BYTES', 100 * 1024 * 1024))
+MULTIPART_PART_SIZE = int(os.environ.get('MULTIPART_PART_SIZE', 16 * 1024 * 1024))
+MIN_PART_SIZE = 5 * 1024 * 1024 # S3 minimum for all but the last part
+MAX_PARTS = 10000 # S3 maximum number of parts
+MULTIPART_URL_EXPIRATION_SECONDS = 3600 # Large uploads need longer-lived part URLs
+
+
+class InvalidUploadRequest(Exception):
+    """Raised for upload requests that must be rejected with a 400 response."""
+
+
+def build_upload_params(entry):
     """
-    Generates an S3 presigned URL for uploading a file.
-    Expects filename and contentType in the event body for POST requests.
+    Builds the object key and presigned put_object parameters for one upload
+    request entry with optional filename, contentType and maxDimension.
     """
-    logger.info(f"Received event: {json.dumps(event)}")
-
     # Default values
     # Generate a unique key to prevent collisions and add basic structure
     object_key = f"{uuid.uuid4()}"
@@ -37,41 +70,35 @@ def lambda_handler(event, context):
 
     custom_dimension = None # Variable to hold validated custom dimension
 
-    # Try to get filename and content type from the request body (for POST)
-    # Assumes API Gateway HTTP API payload format v2.0
-    if 'body' in event and event.get('requestContext', {}).get('http', {}).get('method') == 'POST':
+    filename = entry.get('filename')
+    req_content_type = entry.get('contentType')
+    req_max_dimension = entry.get('maxDimension') # Get custom dimension from request
+
+    if filename:
+         # Sanitize filename: remove potentially unsafe characters, limit length
+         safe_filename = re.sub(r'[^\w\.\-]', '', filename) # Allow word chars, dots, hyphens
+         safe_filename = safe_filename[:100] # Limit length
+         object_key = f"{uuid.uuid4()}-{safe_filename}" # Combine UUID and safe filename
+         logger.info(f"Using filename from body: {safe_filename}")
+
+    if req_content_type:
+        if req_content_type not in ALLOWED_CONTENT_TYPES:
+            raise InvalidUploadRequest(f"Unsupported contentType '{req_content_type}'. Allowed: {', '.join(ALLOWED_CONTENT_TYPES)}")
+        content_type = req_content_type
+        logger.info(f"Using contentType from body: {content_type}")
+
+    # --- Validate Custom Dimension ---
+    if req_max_dimension is not None:
         try:
-            body = json.loads(event['body'])
-            filename = body.get('filename')
-            req_content_type = body.get('contentType')
-            req_max_dimension = body.get('maxDimension') # Get custom dimension from request
-
-
-            if filename:
-                 # Sanitize filename: remove potentially unsafe characters, limit length
-                 safe_filename = re.sub(r'[^\w\.\-]', '', filename) # Allow word chars, dots, hyphens
-                 safe_filename = safe_filename[:100] # Limit length
-                 object_key = f"{uuid.uuid4()}-{safe_filename}" # Combine UUID and safe filename
-                 logger.info(f"Using filename from body: {safe_filename}")
-
-            if req_content_type:
-                content_type = req_content_type
-                logger.info(f"Using contentType from body: {content_type}")
-
-            # --- Validate Custom Dimension ---
-            if req_max_dimension is not None:
-                try:
-                    parsed_dimension = int(req_max_dimension)
-                    if MIN_DIMENSION <= parsed_dimension <= MAX_DIMENSION:
-                        custom_dimension = parsed_dimension # Store validated dimension
-                        logger.info(f"Using custom max dimension from request: {custom_dimension}")
-                    else:
-                        logger.warning(f"Requested dimension {parsed_dimension} out of range ({MIN_DIMENSION}-{MAX_DIMENSION}). Ignoring.")
-                except (ValueError, TypeError):
-                     logger.warning(f"Invalid non-integer dimension '{req_max_dimension}' received. Ignoring.")
-            # ---------------------------------
-        except Exception as e:
-            logger.warning(f"Error processing event body: {e}")
+            parsed_dimension = int(req_max_dimension)
+            if MIN_DIMENSION <= parsed_dimension <= MAX_DIMENSION:
+                custom_dimension = parsed_dimension # Store validated dimension
+                logger.info(f"Using custom max dimension from request: {custom_dimension}")
+            else:
+                logger.warning(f"Requested dimension {parsed_dimension} out of range ({MIN_DIMENSION}-{MAX_DIMENSION}). Ignoring.")
+        except (ValueError, TypeError):
+             logger.warning(f"Invalid non-integer dimension '{req_max_dimension}' received. Ignoring.")
+    # ---------------------------------
 
     # Parameters for the presigned URL
     presigned_params = {
@@ -79,7 +106,6 @@ def lambda_handler(event, context):
         'Key': object_key,
         'ContentType': content_type,
     }
-    expires_in = 300  # URL expiration time in seconds (e.g., 5 minutes)
 
     # --- Add Metadata if custom dimension is valid ---
     if custom_dimension is not None:
@@ -89,22 +115,292 @@ def lambda_handler(event, context):
         logger.info(f"Adding metadata: {{'max-dimension': '{custom_dimension}'}}")
     # -----------------------------------------------
 
+    return object_key, presigned_params
+
+
+def generate_multipart_upload(object_key, presigned_params, file_size):
+    """
+    Starts a multipart upload and signs one upload_part URL per part.
+    The client completes it through the /complete-upload endpoint.
+    """
+    response = s3_client.create_multipart_upload(**presigned_params)
+    upload_id = response['UploadId']
+
+    part_size = max(MULTIPART_PART_SIZE, MIN_PART_SIZE, math.ceil(file_size / MAX_PARTS))
+    part_count = max(1, math.ceil(file_size / part_size))
+    parts = []
     try:
-        # Generate the presigned URL for PUT operation
-        presigned_url = s3_client.generate_presigned_url(
-            ClientMethod='put_object',
-            Params=presigned_params,
-            ExpiresIn=expires_in,
-            HttpMethod='PUT' # Specify the HTTP method the URL is valid for
-        )
-
-        logger.info(f"Generated presigned URL: {presigned_url}")
-        logger.info(f"Object Key: {object_key}")
-
-        response_body = {
-            'uploadUrl': presigned_url,
-            'key': object_key # Send the key back to the frontend
-        }
+        for part_number in range(1, part_count + 1):
+            part_url = s3_client.generate_presigned_url(
+                ClientMethod='upload_part',
+                Params={
+                    'Bucket': UPLOAD_BUCKET,
+                    'Key': object_key,
+                    'UploadId': upload_id,
+                    'PartNumber': part_number,
+                    # Signed, so the parts add up to exactly file_size
+                    'ContentLength': min(part_size, file_size - (part_number - 1) * part_size),
+                },
+                ExpiresIn=MULTIPART_URL_EXPIRATION_SECONDS,
+                HttpMethod='PUT'
+            )
+            parts.append({'partNumber': part_number, 'uploadUrl': part_url})
+    except Exception:
+        # The client never gets the upload ID, so nobody else could abort it
+        abort_started_uploads([{'key': object_key, 'uploadId': upload_id}])
+        raise
+
+    logger.info(f"Started multipart upload {upload_id} for {object_key} with {part_count} parts of {part_size} bytes")
+
+    return {
+        'key': object_key,
+        'uploadId': upload_id,
+        'partSize': part_size,
+        'parts': parts
+    }
+
+
+def parse_parts(parts):
+    """
+    Validates the client's list of {partNumber, eTag} and returns it as the
+    S3 Parts list, sorted by part number.
+    """
+    if not parts:
+        raise InvalidUploadRequest("'parts' must list at least one uploaded part")
+    etags = {}
+    for part in parts:
+        if not isinstance(part, dict):
+            raise InvalidUploadRequest("Each entry of 'parts' must be an object with 'partNumber' and 'eTag'")
+        part_number = part.get('partNumber')
+        if isinstance(part_number, str) and part_number.isdigit():
+            part_number = int(part_number)
+        if isinstance(part_number, bool) or not isinstance(part_number, int) or not 1 <= part_number <= MAX_PARTS:
+            raise InvalidUploadRequest(f"Invalid partNumber {part_number!r}, expected an integer from 1 to {MAX_PARTS}")
+        etag = part.get('eTag')
+        if not isinstance(etag, str) or not etag:
+            raise InvalidUploadRequest(f"Missing eTag for part {part_number}")
+        if part_number in etags:
+            raise InvalidUploadRequest(f"Part {part_number} is listed more than once")
+        etags[part_number] = etag
+    return [{'PartNumber': part_number, 'ETag': etags[part_number]} for part_number in sorted(etags)]
+
+
+def complete_multipart_upload(body):
+    """Completes a multipart upload from the client's list of {partNumber, eTag}."""
+    parts = parse_parts(body['parts'])
+    s3_client.complete_multipart_upload(
+        Bucket=UPLOAD_BUCKET,
+        Key=body['key'],
+        UploadId=body['uploadId'],
+        MultipartUpload={'Parts': parts}
+    )
+    logger.info(f"Completed multipart upload {body['uploadId']} for {body['key']}")
+    return {'key': body['key']}
+
+
+def abort_multipart_upload(body):
+    """Aborts a multipart upload so S3 discards the parts uploaded so far."""
+    s3_client.abort_multipart_upload(
+        Bucket=UPLOAD_BUCKET,
+        Key=body['key'],
+        UploadId=body['uploadId']
+    )
+    logger.info(f"Aborted multipart upload {body['uploadId']} for {body['key']}")
+    return {'key': body['key']}
+
+
+def abort_started_uploads(uploads):
+    """
+    Aborts the multipart uploads among signed upload entries, after a request
+    failed before returning them to the client. Errors are only logged, so the
+    original failure is the one reported.
+    """
+    for upload in uploads:
+        if 'uploadId' not in upload:
+            continue
+        try:
+            abort_multipart_upload(upload)
+        except Exception as e:
+            logger.error(f"Error aborting multipart upload {upload['uploadId']} for {upload['key']}: {e}", exc_info=True)
+
+
+def generate_presigned_post(object_key, presigned_params):
+    """
+    Signs a presigned POST policy that makes S3 itself reject uploads over
+    MAX_UPLOAD_BYTES or with a different content type or metadata.
+    """
+    fields = {'Content-Type': presigned_params['ContentType']}
+    for name, value in presigned_params.get('Metadata', {}).items():
+        fields[f"x-amz-meta-{name}"] = value
+    conditions = [['content-length-range', 1, MAX_UPLOAD_BYTES]]
+    conditions.extend({name: value} for name, value in fields.items())
+
+    presigned_post = s3_client.generate_presigned_post(
+        Bucket=UPLOAD_BUCKET,
+        Key=object_key,
+        Fields=fields,
+        Conditions=conditions,
+        ExpiresIn=URL_EXPIRATION_SECONDS
+    )
+
+    logger.info(f"Generated presigned POST for Object Key: {object_key}")
+
+    return {
+        'uploadUrl': presigned_post['url'],
+        'fields': presigned_post['fields'], # Form fields to send before the file
+        'key': object_key
+    }
+
+
+def parse_file_size(entry):
+    """Returns the validated 'fileSize' of an upload entry, or None if it has none."""
+    file_size = entry.get('fileSize')
+    if file_size is None:
+        return None
+    if isinstance(file_size, bool) or not isinstance(file_size, int) or file_size < 1:
+        raise InvalidUploadRequest(f"Invalid fileSize {file_size!r}, expected a positive integer number of bytes")
+    if file_size > MAX_UPLOAD_BYTES:
+        raise InvalidUploadRequest(f"fileSize {file_size} exceeds the {MAX_UPLOAD_BYTES} byte limit")
+    return file_size
+
+
+def generate_upload(entry):
+    """
+    Signs the upload of one entry, so that S3 rejects files over MAX_UPLOAD_BYTES:
+    - with a 'fileSize' of at least MULTIPART_THRESHOLD_BYTES, a multipart upload
+      with one URL per part, each signed for the length of its part;
+    - with 'uploadMethod': 'PUT', a PUT URL signed for exactly 'fileSize' bytes,
+      which is then required;
+    - otherwise ('uploadMethod': 'POST', the default without a 'fileSize'), a size
+      and type limited POST policy.
+    Only starting a multipart upload calls S3; signing is local.
+    """
+    object_key, presigned_params = build_upload_params(entry)
+
+    file_size = parse_file_size(entry)
+    upload_method = entry.get('uploadMethod') or ('PUT' if file_size is not None else 'POST')
+    if upload_method not in ('PUT', 'POST'):
+        raise InvalidUploadRequest(f"Unsupported uploadMethod '{upload_method}'. Allowed: PUT, POST")
+    if file_size is not None and file_size >= MULTIPART_THRESHOLD_BYTES:
+        return generate_multipart_upload(object_key, presigned_params, file_size)
+    if upload_method == 'POST':
+        return generate_presigned_post(object_key, presigned_params)
+    if file_size is None:
+        # Without a signed length a PUT URL would accept an upload of any size
+        raise InvalidUploadRequest("PUT uploads require 'fileSize'")
+    presigned_params['ContentLength'] = file_size
+
+    # Generate the presigned URL for PUT operation
+    presigned_url = s3_client.generate_presigned_url(
+        ClientMethod='put_object',
+        Params=presigned_params,
+        ExpiresIn=URL_EXPIRATION_SECONDS,
+        HttpMethod='PUT' # Specify the HTTP method the URL is valid for
+    )
+
+    logger.info(f"Generated presigned URL: {presigned_url}")
+    logger.info(f"Object Key: {object_key}")
+
+    return {
+        'uploadUrl': presigned_url,
+        'key': object_key # Send the key back to the frontend
+    }
+
+
+def generate_uploads(files):
+    """
+    Signs one upload per batch entry. If an entry fails, the multipart uploads
+    already started for earlier entries are aborted before the error is raised.
+    """
+    uploads = []
+    try:
+        for entry in files:
+            uploads.append(generate_upload(entry if isinstance(entry, dict) else {}))
+    except Exception:
+        abort_started_uploads(uploads)
+        raise
+    return uploads
+
+
+def lambda_handler(event, context):
+    """
+    Generates S3 presigned URLs for uploading files.
+    Expects filename and contentType in the event body for POST requests, or a
+    'files' list of such entries to sign a whole batch in one call.
+    POST /complete-upload and /abort-upload finish multipart uploads.
+    """
+    logger.info(f"Received event: {json.dumps(event)}")
+
+    body = {}
+    # Try to get filename and content type from the request body (for POST)
+    # Assumes API Gateway HTTP API payload format v2.0
+    if 'body' in event and event.get('requestContext', {}).get('http', {}).get('method') == 'POST':
+        try:
+            body = json.loads(event['body'])
+            if not isinstance(body, dict):
+                raise ValueError("Request body must be a JSON object")
+        except Exception as e:
+            logger.warning(f"Error processing event body: {e}")
+            body = {}
+
+    # --- Multipart completion endpoints ---
+    path = event.get('rawPath', '')
+    if path.endswith('/complete-upload') or path.endswith('/abort-upload'):
+        if not body.get('key') or not body.get('uploadId') or (path.endswith('/complete-upload') and not isinstance(body.get('parts'), list)):
+            logger.error("Missing key, uploadId or parts in multipart request.")
+            return {
+                'statusCode': 400,
+                'headers': {'Access-Control-Allow-Origin': '*'}, # Include CORS
+                'body': json.dumps({'message': "'key', 'uploadId' and 'parts' are required"})
+            }
+        try:
+            if path.endswith('/complete-upload'):
+                response_body = complete_multipart_upload(body)
+            else:
+                response_body = abort_multipart_upload(body)
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Access-Control-Allow-Origin': '*',
+                    'Access-Control-Allow-Headers': 'Content-Type',
+                    'Access-Control-Allow-Methods': 'POST, OPTIONS'
+                },
+                'body': json.dumps(response_body)
+            }
+        except InvalidUploadRequest as e:
+            logger.warning(f"Rejected multipart request: {e}")
+            return {
+                'statusCode': 400,
+                'headers': {'Access-Control-Allow-Origin': '*'}, # Include CORS
+                'body': json.dumps({'message': str(e)})
+            }
+        except Exception as e:
+            logger.error(f"Error finishing multipart upload: {e}", exc_info=True)
+            return {
+                'statusCode': 500,
+                'headers': {'Access-Control-Allow-Origin': '*'}, # Include CORS
+                'body': json.dumps({'message': 'Error finishing multipart upload', 'error': str(e)})
+            }
+    # --------------------------------------
+
+    # --- Batch mode: one URL per entry in 'files' ---
+    files = body.get('files')
+    if files is not None:
+        if not isinstance(files, list) or not files or len(files) > MAX_BATCH_SIZE:
+            logger.error("Invalid 'files' list in batch request.")
+            return {
+                'statusCode': 400,
+                'headers': {'Access-Control-Allow-Origin': '*'}, # Include CORS
+                'body': json.dumps({'message': f"'files' must be a list of 1 to {MAX_BATCH_SIZE} entries"})
+            }
+    # ------------------------------------------------
+
+    try:
+        if files is not None:
+            response_body = {'uploads': generate_uploads(files)}
+            logger.info(f"Generated {len(files)} presigned URLs in batch")
+        else:
+            response_body = generate_upload(body)
 
         return {
             'statusCode': 200,
@@ -118,6 +414,13 @@ def lambda_handler(event, context):
             'body': json.dumps(response_body)
         }
 
+    except InvalidUploadRequest as e:
+        logger.warning(f"Rejected upload request: {e}")
+        return {
+            'statusCode': 400,
+            'headers': {'Access-Control-Allow-Origin': '*'}, # Include CORS
+            'body': json.dumps({'message': str(e)})
+        }
     except Exception as e:
         logger.error(f"Error generating presigned URL: {e}", exc_info=True)
         return {
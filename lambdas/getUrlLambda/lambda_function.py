@@ -2,6 +2,10 @@ import boto3
 import os
 import json
 import logging
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from botocore.config import Config
 from botocore.exceptions import ClientError
 
@@ -16,14 +20,216 @@ s3_client = boto3.client('s3',
                          region_name=REGION,
                          config=Config(signature_version='s3v4'))
 
+URL_EXPIRATION_SECONDS = 300 # 5 minutes validity
+# Presigned GET URLs of objects known to exist are reused from module memory
+# across warm invocations until this many seconds before they expire
+URL_CACHE_MARGIN_SECONDS = 60
+URL_CACHE_MAX_ENTRIES = 4096
+url_cache = OrderedDict() # (bucket, key) -> (url, reuse_until), least recently used first
+url_cache_lock = threading.Lock() # Batch lookups use the cache from several threads
+
+# Batch lookups (gallery views): keys per request and concurrent head_object calls
+MAX_BATCH_KEYS = 100
+BATCH_CONCURRENCY = 16
+
+
+def cache_url(cache_key, entry):
+    """Adds a (url, reuse_until) entry to the URL cache. Call with url_cache_lock held."""
+    url_cache[cache_key] = entry
+    url_cache.move_to_end(cache_key)
+    if len(url_cache) > URL_CACHE_MAX_ENTRIES:
+        url_cache.popitem(last=False)
+
+
+def get_existing_object_url(bucket, object_key, alias=None):
+    """
+    Returns a presigned GET URL for an object after checking it exists with a
+    head_object call, or None if it doesn't. Positive results are cached, so
+    repeated requests for the same key cost no S3 calls and no re-signing.
+    With an alias (bucket, key), the URL is also cached under that key until
+    the same time, e.g. for the upload key a rendition was found through.
+    """
+    cache_key = (bucket, object_key)
+    with url_cache_lock:
+        cached = url_cache.get(cache_key)
+        if cached is not None:
+            url, reuse_until = cached
+            if time.monotonic() < reuse_until:
+                url_cache.move_to_end(cache_key)
+                if alias is not None:
+                    cache_url(alias, cached)
+                return url
+            del url_cache[cache_key]
+
+    try:
+        s3_client.head_object(Bucket=bucket, Key=object_key)
+    except ClientError as e:
+        # head_object has no body, so a missing key is reported as a bare 404
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+            return None
+        raise
+
+    url = s3_client.generate_presigned_url(
+        ClientMethod='get_object',
+        Params={'Bucket': bucket, 'Key': object_key},
+        ExpiresIn=URL_EXPIRATION_SECONDS,
+        HttpMethod='GET'
+    )
+    entry = (url, time.monotonic() + URL_EXPIRATION_SECONDS - URL_CACHE_MARGIN_SECONDS)
+    with url_cache_lock:
+        cache_url(cache_key, entry)
+        if alias is not None:
+            cache_url(alias, entry)
+    return url
+
+
+def lookup_processed_url(object_key):
+    """Result entry of a batch lookup for one key."""
+    try:
+        url = resolve_processed_url(object_key)
+    except Exception as e:
+        logger.error(f"Error looking up {object_key}: {e}")
+        return {'key': object_key, 'status': 'error', 'error': str(e)}
+    if url is None:
+        return {'key': object_key, 'status': 'missing'}
+    return {'key': object_key, 'status': 'found', 'processedUrl': url}
+
+
+def batch_response(object_keys):
+    """
+    Returns presigned GET URLs for many keys in one response, checking their
+    existence concurrently. Results keep the order of the requested keys.
+    """
+    unique_keys = list(dict.fromkeys(object_keys))
+    with ThreadPoolExecutor(max_workers=min(BATCH_CONCURRENCY, len(unique_keys))) as executor:
+        results = dict(zip(unique_keys, executor.map(lookup_processed_url, unique_keys)))
+    logger.info(f"Looked up {len(unique_keys)} keys in batch")
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Access-Control-Allow-Origin': '*', # Restrict in production
+            'Access-Control-Allow-Headers': 'Content-Type',
+            'Access-Control-Allow-Methods': 'GET, POST, OPTIONS'
+        },
+        'body': json.dumps({'results': [results[key] for key in object_keys]})
+    }
+
+
+# Completion records written by the resize Lambda. Needs s3:ListBucket on the
+# status bucket so a missing record is reported as NoSuchKey, not AccessDenied
+STATUS_BUCKET = os.environ.get('STATUS_BUCKET_NAME', PROCESSED_BUCKET)
+STATUS_PREFIX = os.environ.get('STATUS_PREFIX', 'status/')
+MAX_STATUS_WAIT_SECONDS = 20 # Stay below the API Gateway integration timeout
+STATUS_POLL_INTERVAL_SECONDS = 0.25
+
+
+def read_status(object_key):
+    """Returns the completion record for an uploaded key, or None if there is none yet."""
+    try:
+        response = s3_client.get_object(Bucket=STATUS_BUCKET, Key=f"{STATUS_PREFIX}{object_key}.json")
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return None
+        raise
+    return json.loads(response['Body'].read())
+
+
+def resolve_processed_url(object_key):
+    """
+    Presigned GET URL for the rendition of an uploaded key, or None if there is none yet.
+    Renditions stored under content-addressed keys are found through the completion record,
+    and their URL is cached under the uploaded key, so repeated requests cost no S3 calls.
+    """
+    url = get_existing_object_url(PROCESSED_BUCKET, object_key)
+    if url is None:
+        record = read_status(object_key)
+        if record is not None and record.get('status') == 'succeeded' and record.get('renditions'):
+            rendition = record['renditions'][0]
+            url = get_existing_object_url(rendition.get('bucket', PROCESSED_BUCKET), rendition['key'],
+                                          alias=(PROCESSED_BUCKET, object_key))
+    return url
+
+
+def wait_for_status(object_key, wait_seconds, context):
+    """
+    Long-polls the status store: returns the completion record as soon as it
+    appears, or None once wait_seconds have passed.
+    """
+    deadline = time.monotonic() + wait_seconds
+    if context is not None:
+        # Leave a second to build the response before the Lambda times out
+        deadline = min(deadline, time.monotonic() + context.get_remaining_time_in_millis() / 1000 - 1)
+    while True:
+        record = read_status(object_key)
+        if record is not None or time.monotonic() + STATUS_POLL_INTERVAL_SECONDS > deadline:
+            return record
+        time.sleep(STATUS_POLL_INTERVAL_SECONDS)
+
+
+def status_response(object_key, query_params, context):
+    """
+    Handles /processing-status?key=...&wait=N. Responds 200 with the completion
+    record (plus a presigned GET URL on success), or 202 if still pending. A
+    succeeded record whose rendition can't be found (yet) is reported as pending.
+    """
+    try:
+        wait_seconds = min(max(float(query_params.get('wait', MAX_STATUS_WAIT_SECONDS)), 0), MAX_STATUS_WAIT_SECONDS)
+    except ValueError:
+        wait_seconds = MAX_STATUS_WAIT_SECONDS
+
+    record = wait_for_status(object_key, wait_seconds, context)
+    if record is not None and record.get('status') == 'succeeded' and record.get('renditions'):
+        rendition = record['renditions'][0]
+        record['processedUrl'] = get_existing_object_url(rendition.get('bucket', PROCESSED_BUCKET), rendition['key'])
+        if record['processedUrl'] is None:
+            logger.warning(f"Rendition {rendition['key']} of {object_key} not found")
+            record = None
+    if record is None:
+        return {
+            'statusCode': 202,
+            'headers': {'Access-Control-Allow-Origin': '*'}, # Include CORS
+            'body': json.dumps({'key': object_key, 'status': 'pending'})
+        }
+
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Access-Control-Allow-Origin': '*', # Restrict in production
+            'Access-Control-Allow-Headers': 'Content-Type',
+            'Access-Control-Allow-Methods': 'GET, OPTIONS'
+        },
+        'body': json.dumps(record)
+    }
+
 def lambda_handler(event, context):
     logger.info(f"Received event: {json.dumps(event)}")
 
     # Expecting the object key as a query string parameter
     # e.g., /get-processed-url?key=uploads/some-uuid-image.jpg
-    query_params = event.get('queryStringParameters', {})
+    query_params = event.get('queryStringParameters') or {}
     object_key = query_params.get('key')
 
+    # --- Batch lookup: ?keys=a,b,c or a POST body {"keys": [...]} ---
+    object_keys = None
+    if query_params.get('keys'):
+        object_keys = [key for key in query_params['keys'].split(',') if key]
+    elif event.get('body'):
+        try:
+            object_keys = json.loads(event['body']).get('keys')
+        except Exception as e:
+            logger.warning(f"Error processing event body: {e}")
+    if object_keys is not None:
+        if not isinstance(object_keys, list) or not object_keys or len(object_keys) > MAX_BATCH_KEYS \
+                or not all(isinstance(key, str) and key for key in object_keys):
+            logger.error("Invalid 'keys' in batch request.")
+            return {
+                'statusCode': 400,
+                'headers': {'Access-Control-Allow-Origin': '*'}, # Include CORS
+                'body': json.dumps({'message': f"'keys' must be a list of 1 to {MAX_BATCH_KEYS} keys"})
+            }
+        return batch_response(object_keys)
+    # ------------------------------------------------------------------
+
     if not object_key:
         logger.error("Missing 'key' query string parameter.")
         return {
@@ -32,22 +238,30 @@ def lambda_handler(event, context):
             'body': json.dumps({'message': "Missing 'key' query string parameter"})
         }
 
-    logger.info(f"Requesting presigned GET URL for key: {object_key} in bucket: {PROCESSED_BUCKET}")
+    # Long-poll for the completion record instead of signing a URL right away
+    if event.get('rawPath', '').endswith('/processing-status'):
+        try:
+            return status_response(object_key, query_params, context)
+        except Exception as e:
+            logger.error(f"Error reading processing status: {e}", exc_info=True)
+            return {
+                'statusCode': 500,
+                'headers': {'Access-Control-Allow-Origin': '*'}, # Include CORS
+                'body': json.dumps({'message': 'Error reading processing status', 'error': str(e)})
+            }
 
-    presigned_params = {
-        'Bucket': PROCESSED_BUCKET,
-        'Key': object_key
-    }
-    expires_in = 300 # 5 minutes validity
+    logger.info(f"Requesting presigned GET URL for key: {object_key} in bucket: {PROCESSED_BUCKET}")
 
     try:
-        # Generate presigned URL for GET operation
-        get_url = s3_client.generate_presigned_url(
-            ClientMethod='get_object',
-            Params=presigned_params,
-            ExpiresIn=expires_in,
-            HttpMethod='GET'
-        )
+        # Check the object exists, then generate (or reuse) the presigned URL for GET operation
+        get_url = resolve_processed_url(object_key)
+        if get_url is None:
+            logger.warning(f"Object not found: {object_key} in bucket {PROCESSED_BUCKET}")
+            return {
+                'statusCode': 404,
+                'headers': {'Access-Control-Allow-Origin': '*'}, # Include CORS
+                'body': json.dumps({'message': 'Processed object not found yet.'})
+            }
 
         logger.info(f"Generated GET URL: {get_url}")
 
@@ -60,22 +274,6 @@ def lambda_handler(event, context):
             },
             'body': json.dumps({'processedUrl': get_url})
         }
-    # Handle case where the object doesn't exist (yet or bad key)
-    except ClientError as e:
-         if e.response['Error']['Code'] == 'NoSuchKey':
-             logger.warning(f"Object not found: {object_key} in bucket {PROCESSED_BUCKET}")
-             return {
-                 'statusCode': 404,
-                 'headers': {'Access-Control-Allow-Origin': '*'}, # Include CORS
-                 'body': json.dumps({'message': 'Processed object not found yet.'})
-                 }
-         else:
-             logger.error(f"Error generating GET URL: {e}", exc_info=True)
-             return {
-                 'statusCode': 500,
-                 'headers': {'Access-Control-Allow-Origin': '*'}, # Include CORS
-                 'body': json.dumps({'message': 'Error generating processed URL', 'error': str(e)})
-             }
     except Exception as e:
         logger.error(f"Error generating GET URL: {e}", exc_info=True)
         return {
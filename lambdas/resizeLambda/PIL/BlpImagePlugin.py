@@ -354,7 +354,7 @@ class BLP1Decoder(_BLPBaseDecoder):
             if self._encoding in (4, 5):
                 palette = self._read_palette()
                 data = self._read_bgra(palette, alpha)
-                self.set_as_raw(data)
+                self.set_as_buffer(data)
             else:
                 msg = f"Unsupported BLP encoding {repr(self._encoding)}"
                 raise BLPFormatError(msg)
@@ -396,27 +396,16 @@ class BLP2Decoder(_BLPBaseDecoder):
                 data = self._read_bgra(palette, alpha)
 
             elif self._encoding == Encoding.DXT:
-                data = bytearray()
                 if self._alpha_encoding == AlphaEncoding.DXT1:
-                    linesize = (self.state.xsize + 3) // 4 * 8
-                    for yb in range((self.state.ysize + 3) // 4):
-                        for d in decode_dxt1(self._safe_read(linesize), alpha):
-                            data += d
-
+                    self._decode_bcn(1, 8)
                 elif self._alpha_encoding == AlphaEncoding.DXT3:
-                    linesize = (self.state.xsize + 3) // 4 * 16
-                    for yb in range((self.state.ysize + 3) // 4):
-                        for d in decode_dxt3(self._safe_read(linesize)):
-                            data += d
-
+                    self._decode_bcn(2, 16)
                 elif self._alpha_encoding == AlphaEncoding.DXT5:
-                    linesize = (self.state.xsize + 3) // 4 * 16
-                    for yb in range((self.state.ysize + 3) // 4):
-                        for d in decode_dxt5(self._safe_read(linesize)):
-                            data += d
+                    self._decode_bcn(3, 16)
                 else:
                     msg = f"Unsupported alpha encoding {repr(self._alpha_encoding)}"
                     raise BLPFormatError(msg)
+                return
             else:
                 msg = f"Unknown BLP encoding {repr(self._encoding)}"
                 raise BLPFormatError(msg)
@@ -425,7 +414,33 @@ class BLP2Decoder(_BLPBaseDecoder):
             msg = f"Unknown BLP compression {repr(self._compression)}"
             raise BLPFormatError(msg)
 
-        self.set_as_raw(data)
+        self.set_as_buffer(data)
+
+    def _decode_bcn(self, n: int, block_size: int) -> None:
+        # DXT1/3/5 are BC1/2/3, decoded by the C decoder also used for DDS. It
+        # writes RGBA, straight into the image unless the image is RGB
+        xblocks = (self.state.xsize + 3) // 4
+        yblocks = (self.state.ysize + 3) // 4
+        data = self._safe_read(xblocks * yblocks * block_size)
+
+        assert self.im is not None
+        if self.mode == "RGBA":
+            im = self.im
+            extents = self.state.extents()
+        else:
+            im = Image.core.new("RGBA", (self.state.xsize, self.state.ysize))
+            extents = (0, 0, self.state.xsize, self.state.ysize)
+        decoder = Image._getdecoder("RGBA", "bcn", (n,))
+        decoder.setimage(im, extents)
+        s = decoder.decode(data)
+        if s[0] >= 0:
+            msg = "not enough image data"
+            raise ValueError(msg)
+        if s[1] != 0:
+            msg = "cannot decode image data"
+            raise ValueError(msg)
+        if im is not self.im:
+            self.im.paste(im.convert(self.mode), self.state.extents())
 
 
 class BLPEncoder(ImageFile.PyEncoder):
@@ -24,7 +24,6 @@
 #
 from __future__ import annotations
 
-import os
 from typing import IO, Any
 
 from . import Image, ImageFile, ImagePalette
@@ -50,6 +49,14 @@ BIT2MODE = {
 
 USE_RAW_ALPHA = False
 
+_READ_SIZE = 1 << 16
+
+# The two 4-bit pixels packed into each byte of RLE4 data
+_NIBBLE_PAIRS = [bytes((byte >> 4, byte & 0x0F)) for byte in range(256)]
+# The longest encoded run of each byte, sliced to the length of shorter runs
+_RLE8_RUNS = [bytes((byte,)) * 255 for byte in range(256)]
+_RLE4_RUNS = [pair * 128 for pair in _NIBBLE_PAIRS]
+
 
 def _accept(prefix: bytes) -> bool:
     return prefix.startswith(b"BM")
@@ -328,73 +335,96 @@ class BmpRleDecoder(ImageFile.PyDecoder):
     def decode(self, buffer: bytes | Image.SupportsArrayInterface) -> tuple[int, int]:
         assert self.fd is not None
         rle4 = self.args[1]
-        data = bytearray()
-        x = 0
         dest_length = self.state.xsize * self.state.ysize
-        while len(data) < dest_length:
-            pixels = self.fd.read(1)
-            byte = self.fd.read(1)
-            if not pixels or not byte:
+        # Appending runs is faster in Python than assigning them to slices of
+        # a preallocated buffer
+        pixels = bytearray()
+        data = b""
+        pos = 0
+        finished = False
+        while len(pixels) < dest_length:
+            chunk = self.fd.read(_READ_SIZE)
+            if not chunk:
                 break
-            num_pixels = pixels[0]
-            if num_pixels:
-                # encoded mode
-                if x + num_pixels > self.state.xsize:
-                    # Too much data for row
-                    num_pixels = max(0, self.state.xsize - x)
-                if rle4:
-                    first_pixel = o8(byte[0] >> 4)
-                    second_pixel = o8(byte[0] & 0x0F)
-                    for index in range(num_pixels):
-                        if index % 2 == 0:
-                            data += first_pixel
-                        else:
-                            data += second_pixel
-                else:
-                    data += byte * num_pixels
-                x += num_pixels
-            else:
-                if byte[0] == 0:
-                    # end of line
-                    while len(data) % self.state.xsize != 0:
-                        data += b"\x00"
-                    x = 0
-                elif byte[0] == 1:
-                    # end of bitmap
-                    break
-                elif byte[0] == 2:
-                    # delta
-                    bytes_read = self.fd.read(2)
-                    if len(bytes_read) < 2:
-                        break
-                    right, up = self.fd.read(2)
-                    data += b"\x00" * (right + up * self.state.xsize)
-                    x = len(data) % self.state.xsize
-                else:
-                    # absolute mode
-                    if rle4:
-                        # 2 pixels per byte
-                        byte_count = byte[0] // 2
-                        bytes_read = self.fd.read(byte_count)
-                        for byte_read in bytes_read:
-                            data += o8(byte_read >> 4)
-                            data += o8(byte_read & 0x0F)
-                    else:
-                        byte_count = byte[0]
-                        bytes_read = self.fd.read(byte_count)
-                        data += bytes_read
-                    if len(bytes_read) < byte_count:
-                        break
-                    x += byte[0]
-
-                    # align to 16-bit word boundary
-                    if self.fd.tell() % 2 != 0:
-                        self.fd.seek(1, os.SEEK_CUR)
+            data = data[pos:] + chunk
+            pos, finished = _decode_rle(
+                data, 0, pixels, self.state.xsize, dest_length, rle4
+            )
+            if finished:
+                break
+        if len(pixels) < dest_length:
+            if not finished and not ImageFile.LOAD_TRUNCATED_IMAGES:
+                msg = "image file is truncated"
+                raise OSError(msg)
+            # Pixels after the end of bitmap are 0
+            pixels += bytes(dest_length - len(pixels))
         rawmode = "L" if self.mode == "L" else "P"
-        self.set_as_raw(bytes(data), rawmode, (0, self.args[-1]))
+        self.set_as_buffer(pixels, rawmode, self.args[-1])
         return -1, 0
 
 
+def _decode_rle(
+    data: bytes,
+    pos: int,
+    pixels: bytearray,
+    xsize: int,
+    dest_length: int,
+    rle4: bool,
+) -> tuple[int, bool]:
+    # Decodes the complete ops in data[pos:], appending to pixels until it
+    # holds dest_length pixels. Returns the position of the first op that is
+    # cut off by the end of data and whether the end of bitmap was reached
+    length = len(data)
+    runs = _RLE4_RUNS if rle4 else _RLE8_RUNS
+    dest = len(pixels)
+    row_end = dest - dest % xsize + xsize
+    while pos + 1 < length and dest < dest_length:
+        count = data[pos]
+        byte = data[pos + 1]
+        if count:
+            # encoded mode, clipped to the end of the row
+            if count > row_end - dest:
+                count = row_end - dest
+            pixels += runs[byte][:count]
+            dest += count
+            pos += 2
+        elif byte == 0:
+            # end of line
+            if dest != row_end - xsize:
+                pixels += bytes(row_end - dest)
+                dest = row_end
+            pos += 2
+        elif byte == 1:
+            # end of bitmap
+            return pos + 2, True
+        elif byte == 2:
+            # delta
+            if pos + 3 >= length:
+                break
+            skip = min(data[pos + 2] + data[pos + 3] * xsize, dest_length - dest)
+            pixels += bytes(skip)
+            dest += skip
+            row_end = dest - dest % xsize + xsize
+            pos += 4
+            continue
+        else:
+            # absolute mode, padded to a 16-bit word boundary
+            byte_count = (byte + 1) // 2 if rle4 else byte
+            end = pos + 2 + byte_count
+            if end + (byte_count & 1) > length:
+                break
+            run = data[pos + 2 : end]
+            if rle4:
+                run = b"".join(map(_NIBBLE_PAIRS.__getitem__, run))
+            count = min(byte, row_end - dest)
+            pixels += run[:count]
+            dest += count
+            pos = end + (byte_count & 1)
+        if dest == row_end:
+            row_end += xsize
+    return pos, False
+
+
 # =============================================================================
 # Image plugin for the DIB format (BMP alias)
 # =============================================================================
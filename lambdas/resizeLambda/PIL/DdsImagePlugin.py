@@ -12,6 +12,7 @@ https://creativecommons.org/publicdomain/zero/1.0/
 
 from __future__ import annotations
 
+import array
 import io
 import struct
 import sys
@@ -20,7 +21,6 @@ from typing import IO
 
 from . import Image, ImageFile, ImagePalette
 from ._binary import i32le as i32
-from ._binary import o8
 from ._binary import o32le as o32
 
 # Magic ("DDS ")
@@ -486,6 +486,63 @@ class DdsImageFile(ImageFile.ImageFile):
         pass
 
 
+def _masks_rawmode(bytecount: int, masks: tuple[int, ...]) -> str | None:
+    # Rawmode for masks that each select a whole byte, such as "BGRA" for
+    # 0xFF0000, 0xFF00, 0xFF, 0xFF000000, or None if the masks aren't like that
+    byte_masks = [0xFF << (8 * i) for i in range(bytecount)]
+    if len(set(masks)) != len(masks) or not all(mask in byte_masks for mask in masks):
+        return None
+    channels = ["X"] * bytecount
+    for band, mask in zip("RGBA", masks):
+        channels[byte_masks.index(mask)] = band
+    return "".join(channels)
+
+
+def _unpack_masked(data: bytes, bytecount: int, masks: tuple[int, ...]) -> bytes:
+    # Extracts each masked channel from little-endian pixel values, scales it to
+    # 8 bits and interleaves the channels. Some masks are padded with zeros,
+    # e.g. R 0b11 G 0b1100, so each channel is shifted down before scaling
+    shifts = [(mask & -mask).bit_length() - 1 if mask else 0 for mask in masks]
+    maxima = [mask >> shift for mask, shift in zip(masks, shifts)]
+    bands = len(masks)
+
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+
+    if numpy is not None:
+        if bytecount == 3:
+            pixels = numpy.frombuffer(data, numpy.uint8).reshape(-1, 3)
+            values = pixels.astype(numpy.uint64) @ numpy.array([1, 1 << 8, 1 << 16], numpy.uint64)
+        else:
+            values = numpy.frombuffer(data, f"<u{bytecount}").astype(numpy.uint64)
+        channels = numpy.zeros((len(values), bands), numpy.uint8)
+        for i, (shift, maximum) in enumerate(zip(shifts, maxima)):
+            if maximum:
+                channels[:, i] = (values >> shift & maximum) * 255 // maximum
+        return channels.tobytes()
+
+    if bytecount == 3:
+        values = [int.from_bytes(data[i : i + 3], "little") for i in range(0, len(data), 3)]
+    else:
+        values = array.array({1: "B", 2: "H", 4: "I"}[bytecount], data)
+        if sys.byteorder == "big":
+            values.byteswap()
+    channels = bytearray(len(values) * bands)
+    for i, (shift, maximum) in enumerate(zip(shifts, maxima)):
+        if not maximum:
+            continue
+        if maximum < 1 << 16:
+            scale = bytes(value * 255 // maximum for value in range(maximum + 1))
+            channels[i::bands] = bytes([scale[value >> shift & maximum] for value in values])
+        else:
+            channels[i::bands] = bytes(
+                [(value >> shift & maximum) * 255 // maximum for value in values]
+            )
+    return bytes(channels)
+
+
 class DdsRgbDecoder(ImageFile.PyDecoder):
     _pulls_fd = True
 
@@ -493,31 +550,26 @@ class DdsRgbDecoder(ImageFile.PyDecoder):
         assert self.fd is not None
         bitcount, masks = self.args
 
-        # Some masks will be padded with zeros, e.g. R 0b11 G 0b1100
-        # Calculate how many zeros each mask is padded with
-        mask_offsets = []
-        # And the maximum value of each channel without the padding
-        mask_totals = []
-        for mask in masks:
-            offset = 0
-            if mask != 0:
-                while mask >> (offset + 1) << (offset + 1) == mask:
-                    offset += 1
-            mask_offsets.append(offset)
-            mask_totals.append(mask >> offset)
-
-        data = bytearray()
         bytecount = bitcount // 8
-        dest_length = self.state.xsize * self.state.ysize * len(masks)
-        while len(data) < dest_length:
-            value = int.from_bytes(self.fd.read(bytecount), "little")
-            for i, mask in enumerate(masks):
-                masked_value = value & mask
-                # Remove the zero padding, and scale it to 8 bits
-                data += o8(
-                    int(((masked_value >> mask_offsets[i]) / mask_totals[i]) * 255)
-                )
-        self.set_as_raw(data)
+        length = self.state.xsize * self.state.ysize * bytecount
+        data = self.fd.read(length)
+        if len(data) < length:
+            if not ImageFile.LOAD_TRUNCATED_IMAGES:
+                msg = "image file is truncated"
+                raise OSError(msg)
+            data += bytes(length - len(data))
+
+        # Whole-byte channels are handled by the C unpackers
+        rawmode = _masks_rawmode(bytecount, masks)
+        if rawmode is not None:
+            try:
+                Image._getdecoder(self.mode, "raw", rawmode)
+            except ValueError:
+                rawmode = None
+        if rawmode is not None:
+            self.set_as_raw(data, rawmode)
+        else:
+            self.set_as_raw(_unpack_masked(data, bytecount, masks))
         return -1, 0
 
 
@@ -10,11 +10,13 @@
 #
 from __future__ import annotations
 
-import gzip
 import math
+import zlib
 
 from . import Image, ImageFile
 
+_READ_SIZE = 1 << 16
+
 
 def _accept(prefix: bytes) -> bool:
     return prefix.startswith(b"SIMPLE")
@@ -128,20 +130,78 @@ class FitsGzipDecoder(ImageFile.PyDecoder):
 
     def decode(self, buffer: bytes | Image.SupportsArrayInterface) -> tuple[int, int]:
         assert self.fd is not None
-        value = gzip.decompress(self.fd.read())
 
-        rows = []
-        offset = 0
-        number_of_bits = min(self.args[0] // 8, 4)
-        for y in range(self.state.ysize):
-            row = bytearray()
-            for x in range(self.state.xsize):
-                row += value[offset + (4 - number_of_bits) : offset + 4]
-                offset += 4
-            rows.append(row)
-        self.set_as_raw(bytes([pixel for row in rows[::-1] for pixel in row]))
+        number_of_bits = self.args[0]
+        if number_of_bits not in (8, 16, 32):
+            msg = f"Unsupported BITPIX for gzip compressed FITS: {number_of_bits}"
+            raise ValueError(msg)
+
+        # Decompress a band of rows at a time and set it in the image, so that
+        # neither the compressed nor the decompressed data is held in full
+        row_size = self.state.xsize * 4
+        band_size = max(1, ImageFile.SAFEBLOCK // row_size) * row_size
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        data = b""
+        pixels = b""
+        y = 0
+        while y < self.state.ysize:
+            if decompressor.eof:
+                # Each tile is a separate gzip member, and the members may be
+                # followed by padding
+                data = decompressor.unused_data.lstrip(b"\x00")
+                while not data:
+                    chunk = self.fd.read(_READ_SIZE)
+                    if not chunk:
+                        break
+                    data = chunk.lstrip(b"\x00")
+                if not data:
+                    break
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            elif not data:
+                data = self.fd.read(_READ_SIZE)
+                if not data:
+                    break
+            pixels += decompressor.decompress(data, band_size)
+            data = decompressor.unconsumed_tail
+
+            rows = min(len(pixels) // row_size, self.state.ysize - y)
+            if rows:
+                self._set_rows(pixels[: rows * row_size], y, rows)
+                pixels = pixels[rows * row_size :]
+                y += rows
+
+        if y < self.state.ysize and not ImageFile.LOAD_TRUNCATED_IMAGES:
+            msg = "image file is truncated"
+            raise OSError(msg)
         return -1, 0
 
+    def _set_rows(self, data: bytes, y: int, rows: int) -> None:
+        assert self.im is not None
+
+        # Each pixel is stored as 4 bytes, of which the last are kept
+        bytes_per_pixel = self.args[0] // 8
+        if bytes_per_pixel == 1:
+            data = data[3::4]
+        elif bytes_per_pixel == 2:
+            pixels = bytearray(len(data) // 2)
+            pixels[0::2] = data[2::4]
+            pixels[1::2] = data[3::4]
+            data = bytes(pixels)
+
+        # The rows are stored bottom to top
+        x0, y0 = self.state.xoff, self.state.yoff
+        y1 = y0 + self.state.ysize - y
+        d = Image._getdecoder(self.mode, "raw", self.mode, (0, -1))
+        d.setimage(self.im, (x0, y1 - rows, x0 + self.state.xsize, y1))
+        s = d.decode(data)
+
+        if s[0] >= 0:
+            msg = "not enough image data"
+            raise ValueError(msg)
+        if s[1] != 0:
+            msg = "cannot decode image data"
+            raise ValueError(msg)
+
 
 # --------------------------------------------------------------------
 # Registry
@@ -869,6 +869,9 @@ class Image:
         d = _getdecoder(self.mode, decoder_name, decoder_args)
         d.setimage(self.im)
         s = d.decode(data)
+        if getattr(d, "im", self.im) is not self.im:
+            # A Python decoder handed its buffer over as the image
+            self.im = d.im
 
         if s[0] >= 0:
             msg = "not enough image data"
@@ -1338,7 +1341,7 @@ class Image:
         effect.
 
         Note: This method is not implemented for most images. It is
-        currently implemented only for JPEG and MPO images.
+        currently implemented only for JPEG, MPO and JPEG 2000 images.
 
         :param mode: The requested mode.
         :param size: The requested size in pixels, as a 2-tuple:
@@ -2723,7 +2726,7 @@ class Image:
         :param reducing_gap: Apply optimization by resizing the image
            in two steps. First, reducing the image by integer times
            using :py:meth:`~PIL.Image.Image.reduce` or
-           :py:meth:`~PIL.Image.Image.draft` for JPEG images.
+           :py:meth:`~PIL.Image.Image.draft` for JPEG and JPEG 2000 images.
            Second, resizing using regular resampling. The last step
            changes size no less than by ``reducing_gap`` times.
            ``reducing_gap`` may be None (no first step is performed)
@@ -34,6 +34,10 @@ import itertools
 import logging
 import os
 import struct
+import threading
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
 from typing import IO, Any, NamedTuple, cast
 
 from . import ExifTags, Image
@@ -66,6 +70,20 @@ Dict of known error codes returned from :meth:`.PyDecoder.decode`,
 :meth:`.PyEncoder.encode_to_file`.
 """
 
+# (mode, rawmode) pairs where raw data is laid out like the image memory, with
+# the number of bytes per pixel. Such data can be mapped instead of unpacked
+_BUFFER_RAWMODES = {
+    ("L", "L"): 1,
+    ("P", "P"): 1,
+    ("I;16", "I;16"): 2,
+    ("I", "I"): 4,
+    ("F", "F"): 4,
+    ("RGB", "RGBX"): 4,
+    ("RGBX", "RGBX"): 4,
+    ("RGBA", "RGBA"): 4,
+    ("CMYK", "CMYK"): 4,
+}
+
 
 #
 # --------------------------------------------------------------------
@@ -105,6 +123,120 @@ class _Tile(NamedTuple):
     args: tuple[Any, ...] | str | None = None
 
 
+#
+# --------------------------------------------------------------------
+# Profiling hooks
+
+
+class TileProfile(NamedTuple):
+    """
+    Statistics for one tile decoded by :py:meth:`ImageFile.load` or encoded
+    by :py:func:`_save`, passed to hooks registered with
+    :py:func:`register_profile_hook`.
+
+    ``io_time`` is the time spent reading from or writing to the file object,
+    ``codec_time`` the time spent in the decoder or encoder, both in seconds.
+    For codecs that access the file themselves, ``io_time`` is included in
+    ``codec_time``. ``bytes`` is the amount of compressed data moved, or -1
+    if it cannot be determined, and ``calls`` the number of calls made to
+    ``decode()`` or ``encode()``. ``format`` is the format of the file being
+    loaded, or None when saving.
+    """
+
+    operation: str
+    format: str | None
+    codec_name: str
+    extents: tuple[int, int, int, int] | None
+    io_time: float
+    codec_time: float
+    bytes: int
+    calls: int
+
+
+# Replaced rather than modified, under the lock, so tiles decoded in other
+# threads can call the hooks without locking while hooks are (un)registered
+_profile_hooks: tuple[Callable[[TileProfile], None], ...] = ()
+_profile_hooks_lock = threading.Lock()
+
+
+def register_profile_hook(hook: Callable[[TileProfile], None]) -> None:
+    """
+    Registers a function to be called with a :py:class:`TileProfile` after
+    each tile is decoded or encoded.
+
+    :param hook: A function taking a :py:class:`TileProfile`.
+    """
+    global _profile_hooks
+    with _profile_hooks_lock:
+        _profile_hooks += (hook,)
+
+
+def unregister_profile_hook(hook: Callable[[TileProfile], None]) -> None:
+    """
+    Removes a function registered with :py:func:`register_profile_hook`.
+
+    :param hook: The function to remove.
+    """
+    global _profile_hooks
+    with _profile_hooks_lock:
+        hooks = list(_profile_hooks)
+        hooks.remove(hook)
+        _profile_hooks = tuple(hooks)
+
+
+@contextmanager
+def profile() -> Iterator[list[TileProfile]]:
+    """
+    Collects a :py:class:`TileProfile` for each tile decoded or encoded
+    within the block::
+
+        with ImageFile.profile() as tiles:
+            im.load()
+        print(sum(tile.codec_time for tile in tiles))
+    """
+    tiles: list[TileProfile] = []
+    register_profile_hook(tiles.append)
+    try:
+        yield tiles
+    finally:
+        unregister_profile_hook(tiles.append)
+
+
+def _report_profile(
+    operation: str,
+    im: Image.Image,
+    codec_name: str,
+    extents: tuple[int, int, int, int] | None,
+    io_time: float,
+    codec_time: float,
+    nbytes: int,
+    calls: int,
+) -> None:
+    tile_profile = TileProfile(
+        operation,
+        im.format if operation == "decode" else None,
+        codec_name,
+        extents,
+        io_time,
+        codec_time,
+        nbytes,
+        calls,
+    )
+    for hook in _profile_hooks:
+        hook(tile_profile)
+
+
+def _tell(fp: IO[bytes] | int | None) -> int:
+    # position used to count the bytes moved by codecs that access the file
+    try:
+        if isinstance(fp, int):
+            return os.lseek(fp, 0, os.SEEK_CUR)
+        assert fp is not None
+        return fp.tell()
+    except (AttributeError, OSError, ValueError):
+        return -1
+
+
 #
 # --------------------------------------------------------------------
 # ImageFile base class
@@ -280,8 +412,8 @@ class ImageFile(Image.Image):
         if not self.tile:
             return pixel
 
-        self.map: mmap.mmap | None = None
-        use_mmap = self.filename and len(self.tile) == 1
+        self.map: mmap.mmap | bytes | None = None
+        use_mmap = len(self.tile) == 1
 
         readonly = 0
 
@@ -313,22 +445,20 @@ class ImageFile(Image.Image):
             ):
                 try:
                     # use mmap, if possible
-                    import mmap
-
-                    with open(self.filename) as fp:
-                        self.map = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
-                    if offset + self.size[1] * args[1] > self.map.size():
-                        msg = "buffer is not large enough"
-                        raise OSError(msg)
-                    self.im = Image.core.map_buffer(
-                        self.map, self.size, decoder_name, offset, args
-                    )
-                    readonly = 1
-                    # After trashing self.im,
-                    # we might need to reload the palette data.
-                    if self.palette:
-                        self.palette.dirty = 1
-                except (AttributeError, OSError, ImportError):
+                    self.map = self._map_file()
+                    if self.map is not None:
+                        if offset + self.size[1] * args[1] > len(self.map):
+                            msg = "buffer is not large enough"
+                            raise OSError(msg)
+                        self.im = Image.core.map_buffer(
+                            self.map, self.size, decoder_name, offset, args
+                        )
+                        readonly = 1
+                        # After trashing self.im,
+                        # we might need to reload the palette data.
+                        if self.palette:
+                            self.palette.dirty = 1
+                except (AttributeError, OSError, ImportError, ValueError):
                     self.map = None
 
         self.load_prepare()
@@ -352,11 +482,19 @@ class ImageFile(Image.Image):
                 decoder = Image._getdecoder(
                     self.mode, decoder_name, args, self.decoderconfig
                 )
+                io_time = codec_time = 0.0
+                nbytes = calls = 0
                 try:
                     decoder.setimage(self.im, extents)
                     if decoder.pulls_fd:
                         decoder.setfd(self.fp)
+                        start = _tell(self.fp)
+                        t0 = time.perf_counter()
                         err_code = decoder.decode(b"")[1]
+                        codec_time = time.perf_counter() - t0
+                        end = _tell(self.fp)
+                        nbytes = end - start if start >= 0 and end >= 0 else -1
+                        calls = 1
                     else:
                         b = prefix
                         while True:
@@ -365,6 +503,7 @@ class ImageFile(Image.Image):
                                 next_offset = self.tile[i + 1].offset
                                 if next_offset > offset:
                                     read_bytes = next_offset - offset
+                            t0 = time.perf_counter()
                             try:
                                 s = read(read_bytes)
                             except (IndexError, struct.error) as e:
@@ -385,14 +524,34 @@ class ImageFile(Image.Image):
                                     )
                                     raise OSError(msg)
 
+                            t1 = time.perf_counter()
                             b = b + s
                             n, err_code = decoder.decode(b)
+                            codec_time += time.perf_counter() - t1
+                            io_time += t1 - t0
+                            nbytes += len(s)
+                            calls += 1
                             if n < 0:
                                 break
                             b = b[n:]
+                    if isinstance(decoder, PyDecoder) and decoder.im is not self.im:
+                        # The decoder handed its buffer over as the image
+                        assert decoder.im is not None
+                        self._adopt_decoded_image(decoder.im)
                 finally:
                     # Need to cleanup here to prevent leaks
                     decoder.cleanup()
+                    if _profile_hooks:
+                        _report_profile(
+                            "decode",
+                            self,
+                            decoder_name,
+                            extents,
+                            io_time,
+                            codec_time,
+                            nbytes,
+                            calls,
+                        )
 
         self.tile = []
         self.readonly = readonly
@@ -409,6 +568,28 @@ class ImageFile(Image.Image):
 
         return Image.Image.load(self)
 
+    def _map_file(self) -> mmap.mmap | bytes | None:
+        # Returns the whole file as a buffer without reading it, if possible
+        import mmap
+
+        if self.filename:
+            with open(self.filename) as fp:
+                return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        if isinstance(self.fp, io.BytesIO):
+            # getvalue() returns the bytes object held by the BytesIO, while
+            # getbuffer() would copy it if it is shared with the caller
+            return self.fp.getvalue()
+        if isinstance(self.fp, (io.BufferedReader, io.FileIO)):
+            # e.g. a spill file in /tmp opened by the caller
+            return mmap.mmap(self.fp.fileno(), 0, access=mmap.ACCESS_READ)
+        return None
+
+    def _adopt_decoded_image(self, im: Image.core.ImagingCore) -> None:
+        self.im = im
+        # After replacing self.im, the palette data needs to be set again
+        if self.palette:
+            self.palette.dirty = 1
+
     def load_prepare(self) -> None:
         # create image memory if necessary
         if self._im is None:
@@ -661,27 +842,54 @@ def _encode_tile(
         if offset > 0:
             fp.seek(offset)
         encoder = Image._getencoder(im.mode, encoder_name, args, im.encoderconfig)
+        io_time = codec_time = 0.0
+        nbytes = calls = 0
         try:
             encoder.setimage(im.im, extents)
-            if encoder.pushes_fd:
-                encoder.setfd(fp)
-                errcode = encoder.encode_to_pyfd()[1]
-            else:
-                if exc:
-                    # compress to Python file-compatible object
-                    while True:
-                        errcode, data = encoder.encode(bufsize)[1:]
-                        fp.write(data)
-                        if errcode:
-                            break
+            if encoder.pushes_fd or not exc:
+                # the encoder writes to the file itself
+                target = fp if encoder.pushes_fd else fh
+                start = _tell(target)
+                t0 = time.perf_counter()
+                if encoder.pushes_fd:
+                    encoder.setfd(fp)
+                    errcode = encoder.encode_to_pyfd()[1]
                 else:
                     # slight speedup: compress to real file object
                     assert fh is not None
                     errcode = encoder.encode_to_file(fh, bufsize)
+                codec_time = time.perf_counter() - t0
+                end = _tell(target)
+                nbytes = end - start if start >= 0 and end >= 0 else -1
+                calls = 1
+            else:
+                # compress to Python file-compatible object
+                while True:
+                    t0 = time.perf_counter()
+                    errcode, data = encoder.encode(bufsize)[1:]
+                    t1 = time.perf_counter()
+                    fp.write(data)
+                    io_time += time.perf_counter() - t1
+                    codec_time += t1 - t0
+                    nbytes += len(data)
+                    calls += 1
+                    if errcode:
+                        break
             if errcode < 0:
                 raise _get_oserror(errcode, encoder=True) from exc
         finally:
             encoder.cleanup()
+            if _profile_hooks:
+                _report_profile(
+                    "encode",
+                    im,
+                    encoder_name,
+                    extents,
+                    io_time,
+                    codec_time,
+                    nbytes,
+                    calls,
+                )
 
 
 def _safe_read(fp: IO[bytes], size: int) -> bytes:
@@ -861,6 +1069,43 @@ class PyDecoder(PyCodec):
             msg = "cannot decode image data"
             raise ValueError(msg)
 
+    def set_as_buffer(
+        self, data: bytearray, rawmode: str | None = None, orientation: int = 1
+    ) -> None:
+        """
+        Convenience method to set the internal image from a buffer of raw data,
+        like :meth:`set_as_raw`. If the buffer holds the whole image laid out
+        like the image memory, the image is mapped onto it instead of copying
+        it, so the buffer must not be changed afterwards.
+
+        :param data: Buffer to be set
+        :param rawmode: The rawmode of the data.
+            If not specified, it will default to the mode of the image
+        :param orientation: 1 if the data starts with the top row, -1 if it
+            starts with the bottom row
+        :returns: None
+        """
+
+        if not rawmode:
+            rawmode = self.mode
+        assert self.im is not None
+        pixel_size = _BUFFER_RAWMODES.get((self.mode, rawmode))
+        xsize, ysize = self.im.size
+        if (
+            pixel_size is None
+            or self.state.extents() != (0, 0, xsize, ysize)
+            or len(data) != xsize * ysize * pixel_size
+        ):
+            self.set_as_raw(data, rawmode, (0, orientation))
+            return
+
+        im = Image.core.map_buffer(
+            data, (xsize, ysize), "raw", 0, (rawmode, 0, orientation)
+        )
+        if rawmode != self.mode:
+            im.setmode(self.mode)
+        self.im = im
+
 
 class PyEncoder(PyCodec):
     """
@@ -248,11 +248,14 @@ class Jpeg2KImageFile(ImageFile.ImageFile):
     format_description = "JPEG 2000 (ISO 15444)"
 
     def _open(self) -> None:
+        self._levels: int | None = None
+
         sig = self.fp.read(4)
         if sig == b"\xff\x4f\xff\x51":
             self.codec = "j2k"
             self._size, self._mode = _parse_codestream(self.fp)
-            self._parse_comment()
+            # _parse_codestream() only accepts images of 1 to 4 components
+            self._parse_comment(Image.getmodebands(self.mode))
         else:
             sig = sig + self.fp.read(8)
 
@@ -265,14 +268,17 @@ class Jpeg2KImageFile(ImageFile.ImageFile):
                 if self.fp.read(12).endswith(b"jp2c\xff\x4f\xff\x51"):
                     hdr = self.fp.read(2)
                     length = _binary.i16be(hdr)
-                    self.fp.seek(length - 2, os.SEEK_CUR)
-                    self._parse_comment()
+                    siz = hdr + self.fp.read(length - 2)
+                    if len(siz) >= 38:
+                        self._parse_comment(_binary.i16be(siz, 36))  # Csiz
             else:
                 msg = "not a JPEG 2000 file"
                 raise SyntaxError(msg)
 
         self._reduce = 0
         self.layers = 0
+        # Size at full resolution, which draft() and reduce scale down from
+        self._full_size = self.size
 
         fd = -1
         length = -1
@@ -299,7 +305,8 @@ class Jpeg2KImageFile(ImageFile.ImageFile):
             )
         ]
 
-    def _parse_comment(self) -> None:
+    def _parse_comment(self, components: int) -> None:
+        # components is the number of image components (Csiz) from SIZ
         while True:
             marker = self.fp.read(2)
             if not marker:
@@ -310,10 +317,22 @@ class Jpeg2KImageFile(ImageFile.ImageFile):
                 break
             hdr = self.fp.read(2)
             length = _binary.i16be(hdr)
-            if typ == 0x64:
+            if typ == 0x64 and "comment" not in self.info:
                 # Comment
                 self.info["comment"] = self.fp.read(length - 2)[2:]
-                break
+            elif typ in (0x52, 0x53):
+                # Coding style default or component, recording the number
+                # of decomposition levels available for draft()
+                segment = self.fp.read(length - 2)
+                if typ == 0x52:
+                    offset = 5
+                else:
+                    # After the component index, 2 bytes if there are over 256
+                    offset = 3 if components > 256 else 2
+                if len(segment) > offset:
+                    levels = segment[offset]
+                    if self._levels is None or levels < self._levels:
+                        self._levels = levels
             else:
                 self.fp.seek(length - 2, os.SEEK_CUR)
 
@@ -333,20 +352,54 @@ class Jpeg2KImageFile(ImageFile.ImageFile):
     def reduce(self, value: int) -> None:
         self._reduce = value
 
-    def load(self) -> Image.core.PixelAccess | None:
-        if self.tile and self._reduce:
-            power = 1 << self._reduce
-            adjust = power >> 1
-            self._size = (
-                int((self.size[0] + adjust) / power),
-                int((self.size[1] + adjust) / power),
-            )
+    def draft(
+        self, mode: str | None, size: tuple[int, int] | None
+    ) -> tuple[str, tuple[int, int, float, float]] | None:
+        if len(self.tile) != 1 or not size or self._levels is None:
+            return None
+
+        # Protect from second call
+        if self._reduce:
+            return None
+
+        scale = min(self.size[0] // size[0], self.size[1] // size[1])
+        if scale < 2:
+            return None
+
+        # Each resolution level halves the dimensions, and the codestream
+        # cannot be reduced further than its number of decomposition levels
+        self._reduce = min(scale.bit_length() - 1, self._levels)
+        if not self._reduce:
+            return None
+        self._apply_reduce()
+
+        power = 1 << self._reduce
+        box = (0, 0, self._full_size[0] / power, self._full_size[1] / power)
+        return self.mode, box
+
+    def _apply_reduce(self) -> None:
+        # Always from the full size, as reduce may be changed after draft()
+        power = 1 << self._reduce
+        adjust = power >> 1
+        self._size = (
+            int((self._full_size[0] + adjust) / power),
+            int((self._full_size[1] + adjust) / power),
+        )
+
+        # Update the reduce and layers settings
+        t = self.tile[0]
+        assert isinstance(t[3], tuple)
+        t3 = (t[3][0], self._reduce, self.layers, t[3][3], t[3][4])
+        self.tile = [ImageFile._Tile(t[0], (0, 0) + self.size, t[2], t3)]
 
-            # Update the reduce and layers settings
+    def load(self) -> Image.core.PixelAccess | None:
+        if self.tile:
             t = self.tile[0]
             assert isinstance(t[3], tuple)
-            t3 = (t[3][0], self._reduce, self.layers, t[3][3], t[3][4])
-            self.tile = [ImageFile._Tile(t[0], (0, 0) + self.size, t[2], t3)]
+            # draft() may already have applied a reduction, which reduce can
+            # have changed since
+            if t[3][1] != self._reduce:
+                self._apply_reduce()
 
         return ImageFile.ImageFile.load(self)
 
@@ -16,6 +16,8 @@
 from __future__ import annotations
 
 import math
+import re
+import struct
 from typing import IO
 
 from . import Image, ImageFile
@@ -28,6 +30,9 @@ from ._binary import o32le as o32
 
 b_whitespace = b"\x20\x09\x0a\x0b\x0c\x0d"
 
+# A comment in plain data, up to and including the end of its line
+_comment = re.compile(rb"#[^\r\n]*[\r\n]")
+
 MODES = {
     # standard
     b"P1": "1",
@@ -189,23 +194,15 @@ class PpmPlainDecoder(ImageFile.PyDecoder):
                     # So read the next block, looking for the end
                     block = self._read_block()
 
-        # Search for any further comments
+        # Delete any further comments that end in this block
         self._comment_spans = False
-        while True:
+        if b"#" in block:
+            block = _comment.sub(b"", block)
             comment_start = block.find(b"#")
-            if comment_start == -1:
-                # No comment found
-                break
-            comment_end = self._find_comment_end(block, comment_start)
-            if comment_end != -1:
-                # Comment ends in this block
-                # Delete comment
-                block = block[:comment_start] + block[comment_end + 1 :]
-            else:
+            if comment_start != -1:
                 # Comment continues to next block(s)
                 block = block[:comment_start]
                 self._comment_spans = True
-                break
         return block
 
     def _decode_bitonal(self) -> bytearray:
@@ -213,10 +210,10 @@ class PpmPlainDecoder(ImageFile.PyDecoder):
         This is a separate method because in the plain PBM format, all data tokens are
         exactly one byte, so the inter-token whitespace is optional.
         """
-        data = bytearray()
-        total_bytes = self.state.xsize * self.state.ysize
+        chunks = []
+        remaining = self.state.xsize * self.state.ysize
 
-        while len(data) != total_bytes:
+        while remaining:
             block = self._read_block()  # read next block
             if not block:
                 # eof
@@ -224,25 +221,32 @@ class PpmPlainDecoder(ImageFile.PyDecoder):
 
             block = self._ignore_comments(block)
 
+            # The whole block is validated, including any tokens past the image data
             tokens = b"".join(block.split())
-            for token in tokens:
-                if token not in (48, 49):
-                    msg = b"Invalid token for this mode: %s" % bytes([token])
-                    raise ValueError(msg)
-            data = (data + tokens)[:total_bytes]
+            invalid = tokens.translate(None, b"01")
+            if invalid:
+                msg = b"Invalid token for this mode: %s" % invalid[:1]
+                raise ValueError(msg)
+            tokens = tokens[:remaining]
+            chunks.append(tokens)
+            remaining -= len(tokens)
         invert = bytes.maketrans(b"01", b"\xff\x00")
-        return data.translate(invert)
+        return bytearray(b"".join(chunks).translate(invert))
 
     def _decode_blocks(self, maxval: int) -> bytearray:
         data = bytearray()
         max_len = 10
-        out_byte_count = 4 if self.mode == "I" else 1
         out_max = 65535 if self.mode == "I" else 255
         bands = Image.getmodebands(self.mode)
-        total_bytes = self.state.xsize * self.state.ysize * bands * out_byte_count
+        remaining = self.state.xsize * self.state.ysize * bands
+        # Output value for each canonical token, so that a block is converted
+        # with one lookup per token. Anything else (leading zeros, signs,
+        # invalid tokens) takes the slower path through int()
+        scale = [round(value / maxval * out_max) for value in range(maxval + 1)]
+        lookup = {b"%d" % value: scale[value] for value in range(maxval + 1)}
 
         half_token = b""
-        while len(data) != total_bytes:
+        while remaining:
             block = self._read_block()  # read next block
             if not block:
                 if half_token:
@@ -267,23 +271,37 @@ class PpmPlainDecoder(ImageFile.PyDecoder):
                     )
                     raise ValueError(msg)
 
-            for token in tokens:
-                if len(token) > max_len:
-                    msg = b"Token too long found in data: %s" % token[: max_len + 1]
-                    raise ValueError(msg)
-                value = int(token)
-                if value < 0:
-                    msg_str = f"Channel value is negative: {value}"
-                    raise ValueError(msg_str)
-                if value > maxval:
-                    msg_str = f"Channel value too large for this mode: {value}"
-                    raise ValueError(msg_str)
-                value = round(value / maxval * out_max)
-                data += o32(value) if self.mode == "I" else o8(value)
-                if len(data) == total_bytes:  # finished!
-                    break
+            del tokens[remaining:]
+            if not tokens:
+                continue
+            values = list(map(lookup.get, tokens))
+            if None in values:
+                values = self._convert_tokens(tokens, maxval, max_len, scale)
+            if self.mode == "I":
+                data += struct.pack(f"<{len(values)}I", *values)
+            else:
+                data += bytes(values)
+            remaining -= len(values)
         return data
 
+    def _convert_tokens(
+        self, tokens: list[bytes], maxval: int, max_len: int, scale: list[int]
+    ) -> list[int]:
+        values = []
+        for token in tokens:
+            if len(token) > max_len:
+                msg = b"Token too long found in data: %s" % token[: max_len + 1]
+                raise ValueError(msg)
+            value = int(token)
+            if value < 0:
+                msg_str = f"Channel value is negative: {value}"
+                raise ValueError(msg_str)
+            if value > maxval:
+                msg_str = f"Channel value too large for this mode: {value}"
+                raise ValueError(msg_str)
+            values.append(scale[value])
+        return values
+
     def decode(self, buffer: bytes | Image.SupportsArrayInterface) -> tuple[int, int]:
         self._comment_spans = False
         if self.mode == "1":
@@ -293,7 +311,7 @@ class PpmPlainDecoder(ImageFile.PyDecoder):
             maxval = self.args[-1]
             data = self._decode_blocks(maxval)
             rawmode = "I;32" if self.mode == "I" else self.mode
-        self.set_as_raw(bytes(data), rawmode)
+        self.set_as_buffer(data, rawmode)
         return -1, 0
 
 
@@ -322,7 +340,7 @@ class PpmDecoder(ImageFile.PyDecoder):
                 value = min(out_max, round(value / maxval * out_max))
                 data += o32(value) if self.mode == "I" else o8(value)
         rawmode = "I;32" if self.mode == "I" else self.mode
-        self.set_as_raw(bytes(data), rawmode)
+        self.set_as_buffer(data, rawmode)
         return -1, 0
 
 
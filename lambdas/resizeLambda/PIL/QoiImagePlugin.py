@@ -8,9 +8,13 @@
 from __future__ import annotations
 
 import os
+from typing import IO
 
 from . import Image, ImageFile
 from ._binary import i32be as i32
+from ._binary import o32be as o32
+
+_READ_SIZE = 1 << 16
 
 
 def _accept(prefix: bytes) -> bool:
@@ -37,79 +41,272 @@ class QoiImageFile(ImageFile.ImageFile):
 
 class QoiDecoder(ImageFile.PyDecoder):
     _pulls_fd = True
-    _previous_pixel: bytes | bytearray | None = None
-    _previously_seen_pixels: dict[int, bytes | bytearray] = {}
-
-    def _add_to_previous_pixels(self, value: bytes | bytearray) -> None:
-        self._previous_pixel = value
-
-        r, g, b, a = value
-        hash_value = (r * 3 + g * 5 + b * 7 + a * 11) % 64
-        self._previously_seen_pixels[hash_value] = value
 
     def decode(self, buffer: bytes | Image.SupportsArrayInterface) -> tuple[int, int]:
         assert self.fd is not None
 
-        self._previously_seen_pixels = {}
-        self._add_to_previous_pixels(bytearray((0, 0, 0, 255)))
-
-        data = bytearray()
-        bands = Image.getmodebands(self.mode)
-        dest_length = self.state.xsize * self.state.ysize * bands
-        while len(data) < dest_length:
-            byte = self.fd.read(1)[0]
-            value: bytes | bytearray
-            if byte == 0b11111110 and self._previous_pixel:  # QOI_OP_RGB
-                value = bytearray(self.fd.read(3)) + self._previous_pixel[3:]
-            elif byte == 0b11111111:  # QOI_OP_RGBA
-                value = self.fd.read(4)
-            else:
-                op = byte >> 6
-                if op == 0:  # QOI_OP_INDEX
-                    op_index = byte & 0b00111111
-                    value = self._previously_seen_pixels.get(
-                        op_index, bytearray((0, 0, 0, 0))
-                    )
-                elif op == 1 and self._previous_pixel:  # QOI_OP_DIFF
-                    value = bytearray(
-                        (
-                            (self._previous_pixel[0] + ((byte & 0b00110000) >> 4) - 2)
-                            % 256,
-                            (self._previous_pixel[1] + ((byte & 0b00001100) >> 2) - 2)
-                            % 256,
-                            (self._previous_pixel[2] + (byte & 0b00000011) - 2) % 256,
-                            self._previous_pixel[3],
-                        )
-                    )
-                elif op == 2 and self._previous_pixel:  # QOI_OP_LUMA
-                    second_byte = self.fd.read(1)[0]
-                    diff_green = (byte & 0b00111111) - 32
-                    diff_red = ((second_byte & 0b11110000) >> 4) - 8
-                    diff_blue = (second_byte & 0b00001111) - 8
-
-                    value = bytearray(
-                        tuple(
-                            (self._previous_pixel[i] + diff_green + diff) % 256
-                            for i, diff in enumerate((diff_red, 0, diff_blue))
-                        )
-                    )
-                    value += self._previous_pixel[3:]
-                elif op == 3 and self._previous_pixel:  # QOI_OP_RUN
-                    run_length = (byte & 0b00111111) + 1
-                    value = self._previous_pixel
-                    if bands == 3:
-                        value = value[:3]
-                    data += value * run_length
-                    continue
-            self._add_to_previous_pixels(value)
-
-            if bands == 3:
-                value = value[:3]
-            data += value
-        self.set_as_raw(data)
+        # Decoded pixels are collected as 4 byte RGBA values (RGBX for RGB images)
+        # and joined once at the end, which is faster in Python than writing
+        # each pixel into a preallocated bytearray. The joined buffer is laid
+        # out like the image memory, so it becomes the image
+        pixels: list[bytes] = []
+        count = self.state.xsize * self.state.ysize
+        decoded = 0
+        index = [b"\x00\x00\x00\x00"] * 64  # Previously seen pixels, by hash
+        pixel = b"\x00\x00\x00\xff"
+
+        data = b""
+        pos = 0
+        truncated = False
+        while decoded < count:
+            chunk = self.fd.read(_READ_SIZE)
+            data = data[pos:] + chunk
+            pos = 0
+            # Leave ops that may be cut off by the end of the chunk for the next one
+            limit = len(data) - 4 if chunk else len(data)
+            decoded, pos, pixel = _decode_ops(
+                data, pos, limit, pixels, decoded, count, index, pixel
+            )
+            if not chunk:
+                # End of the file, possibly within an op
+                truncated = decoded < count
+                break
+        raw_data = bytearray().join(pixels)
+        if truncated:
+            if not ImageFile.LOAD_TRUNCATED_IMAGES:
+                msg = "image file is truncated"
+                raise OSError(msg)
+            raw_data += bytes(count * 4 - len(raw_data))
+
+        self.set_as_buffer(raw_data, "RGBA" if self.mode == "RGBA" else "RGBX")
         return -1, 0
 
 
+def _decode_ops(
+    data: bytes,
+    pos: int,
+    limit: int,
+    pixels: list[bytes],
+    decoded: int,
+    count: int,
+    index: list[bytes],
+    pixel: bytes,
+) -> tuple[int, int, bytes]:
+    # Decodes ops from data[pos] up to data[limit], or until count pixels are
+    # decoded. Stops before an op that is cut off by the end of data.
+    # Returns the new pixel count, position and previous pixel
+    append = pixels.append
+    end = len(data)
+    while pos < limit and decoded < count:
+        byte = data[pos]
+        pos += 1
+        if byte < 0b01000000:  # QOI_OP_INDEX
+            pixel = index[byte]
+            append(pixel)
+            decoded += 1
+            continue
+        elif byte < 0b10000000:  # QOI_OP_DIFF
+            r, g, b, a = pixel
+            pixel = bytes(
+                (
+                    (r + (byte >> 4 & 0b11) - 2) & 0xFF,
+                    (g + (byte >> 2 & 0b11) - 2) & 0xFF,
+                    (b + (byte & 0b11) - 2) & 0xFF,
+                    a,
+                )
+            )
+        elif byte < 0b11000000:  # QOI_OP_LUMA
+            if pos >= end:
+                pos -= 1
+                break
+            second_byte = data[pos]
+            pos += 1
+            r, g, b, a = pixel
+            diff_green = (byte & 0b00111111) - 32
+            pixel = bytes(
+                (
+                    (r + diff_green - 8 + (second_byte >> 4)) & 0xFF,
+                    (g + diff_green) & 0xFF,
+                    (b + diff_green - 8 + (second_byte & 0b00001111)) & 0xFF,
+                    a,
+                )
+            )
+        elif byte < 0b11111110:  # QOI_OP_RUN
+            run_length = min((byte & 0b00111111) + 1, count - decoded)
+            append(pixel * run_length)
+            decoded += run_length
+            # Only matters for the initial pixel, which is not in the index yet
+            r, g, b, a = pixel
+            index[(r * 3 + g * 5 + b * 7 + a * 11) % 64] = pixel
+            continue
+        elif byte == 0b11111110:  # QOI_OP_RGB
+            if pos + 3 > end:
+                pos -= 1
+                break
+            pixel = data[pos : pos + 3] + pixel[3:]
+            pos += 3
+        else:  # QOI_OP_RGBA
+            if pos + 4 > end:
+                pos -= 1
+                break
+            pixel = data[pos : pos + 4]
+            pos += 4
+
+        r, g, b, a = pixel
+        index[(r * 3 + g * 5 + b * 7 + a * 11) % 64] = pixel
+        append(pixel)
+        decoded += 1
+    return decoded, pos, pixel
+
+
+class QoiEncoder(ImageFile.PyEncoder):
+    _pushes_fd = True
+
+    def _get_pixels(self) -> bytes:
+        # RGBA, or RGBX for RGB images, using the C raw encoder
+        assert self.im is not None
+        rawmode = "RGBA" if self.mode == "RGBA" else "RGBX"
+        encoder = Image._getencoder(self.mode, "raw", rawmode)
+        encoder.setimage(self.im)
+        bufsize = max(65536, self.im.size[0] * 4)
+        output = []
+        errcode = 0
+        while not errcode:
+            _, errcode, data = encoder.encode(bufsize)
+            output.append(data)
+        if errcode < 0:
+            msg = f"encoder error {errcode} when reading image data"
+            raise RuntimeError(msg)
+        return b"".join(output)
+
+    def encode(self, bufsize: int) -> tuple[int, int, bytes]:
+        data = _encode_ops(self._get_pixels(), self.mode == "RGB")
+        data += b"\x00" * 7 + b"\x01"  # End marker
+        return len(data), 0, data
+
+
+def _encode_ops(pixels: bytes, opaque: bool) -> bytes:
+    # Encodes RGBA pixels with numpy, op by op as the reference encoder does,
+    # but with whole arrays instead of a loop over the pixels. RGB images
+    # are fully opaque, whatever the padding byte is
+    import numpy
+
+    rgba = numpy.frombuffer(pixels, numpy.uint8).reshape(-1, 4)
+    if opaque:
+        rgba = rgba.copy()
+        rgba[:, 3] = 0xFF
+    values = rgba.view(numpy.uint32).ravel()
+    count = len(values)
+    if not count:
+        return b""
+    initial = numpy.array([0, 0, 0, 0xFF], numpy.uint8)
+
+    # Pixels that differ from the previous one get an op, the others are runs
+    previous = numpy.empty_like(values)
+    previous[0] = initial.view(numpy.uint32)[0]
+    previous[1:] = values[:-1]
+    starts = numpy.flatnonzero(values != previous)
+    # Pixels in the run of each op, after a first "op" for any initial run
+    runs = numpy.diff(starts, prepend=0, append=count)
+    runs[1:] -= 1
+
+    pixel = rgba[starts].astype(numpy.int16)
+    # Before each op pixel is the previous op pixel, or its run
+    previous_pixel = numpy.concatenate((initial[None], pixel[:-1]))
+    r, g, b, a = pixel.T
+
+    # QOI_OP_INDEX, if the last op pixel with the same hash is the same pixel
+    hashes = (r * 3 + g * 5 + b * 7 + a * 11) % 64
+    order = numpy.argsort(hashes, kind="stable")
+    sorted_hashes = hashes[order]
+    sorted_values = values[starts][order]
+    indexed = numpy.empty(len(starts), bool)
+    indexed[order] = numpy.concatenate(
+        (
+            [False],
+            (sorted_hashes[1:] == sorted_hashes[:-1])
+            & (sorted_values[1:] == sorted_values[:-1]),
+        )
+    )
+
+    diff_red, diff_green, diff_blue = ((pixel[:, :3] - previous_pixel[:, :3] + 128) % 256 - 128).T
+    diff_red_green = diff_red - diff_green
+    diff_blue_green = diff_blue - diff_green
+    same_alpha = a == previous_pixel[:, 3]
+    small = (
+        same_alpha
+        & (-2 <= diff_red) & (diff_red < 2)
+        & (-2 <= diff_green) & (diff_green < 2)
+        & (-2 <= diff_blue) & (diff_blue < 2)
+    )
+    luma = (
+        same_alpha
+        & (-32 <= diff_green) & (diff_green < 32)
+        & (-8 <= diff_red_green) & (diff_red_green < 8)
+        & (-8 <= diff_blue_green) & (diff_blue_green < 8)
+    )
+
+    # Ops as up to 5 bytes each, assigned from the least to the most preferred
+    ops = numpy.zeros((len(starts) + 1, 5), numpy.int16)
+    lengths = numpy.zeros(len(starts) + 1, numpy.int64)
+    op, length = ops[1:], lengths[1:]
+    op[:] = numpy.stack((numpy.full_like(r, 0b11111111), r, g, b, a), 1)  # QOI_OP_RGBA
+    length[:] = 5
+    op[same_alpha, 0] = 0b11111110  # QOI_OP_RGB
+    length[same_alpha] = 4
+    op[luma, 0] = 0b10000000 | (diff_green[luma] + 32)  # QOI_OP_LUMA
+    op[luma, 1] = (diff_red_green[luma] + 8) << 4 | (diff_blue_green[luma] + 8)
+    length[luma] = 2
+    op[small, 0] = (  # QOI_OP_DIFF
+        0b01000000
+        | (diff_red[small] + 2) << 4
+        | (diff_green[small] + 2) << 2
+        | (diff_blue[small] + 2)
+    )
+    length[small] = 1
+    op[indexed, 0] = hashes[indexed]  # QOI_OP_INDEX
+    length[indexed] = 1
+
+    # Each op is followed by its run, in QOI_OP_RUN ops of up to 62 pixels
+    run_ops = (runs + 61) // 62
+    run_bytes = numpy.full(run_ops.sum(), 0b11000000 | 61, numpy.uint8)
+    has_run = run_ops > 0
+    run_bytes[numpy.cumsum(run_ops)[has_run] - 1] = (
+        0b11000000 | runs[has_run] - 62 * (run_ops[has_run] - 1) - 1
+    )
+    op_bytes = ops.astype(numpy.uint8)[numpy.arange(5) < lengths[:, None]]
+    data = numpy.insert(op_bytes, numpy.repeat(numpy.cumsum(lengths), run_ops), run_bytes)
+    return data.tobytes()
+
+
+def _save(im: Image.Image, fp: IO[bytes], filename: str | bytes) -> None:
+    if im.mode == "RGB":
+        channels = 3
+    elif im.mode == "RGBA":
+        channels = 4
+    else:
+        msg = "Unsupported QOI image mode"
+        raise ValueError(msg)
+
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        msg = "Saving QOI images requires numpy"
+        raise OSError(msg) from None
+
+    colorspace = 0 if im.encoderinfo.get("colorspace") == "sRGB" else 1
+
+    fp.write(b"qoif")
+    fp.write(o32(im.size[0]))
+    fp.write(o32(im.size[1]))
+    fp.write(bytes((channels, colorspace)))
+
+    ImageFile._save(im, fp, [ImageFile._Tile("qoi", (0, 0) + im.size)])
+
+
 Image.register_open(QoiImageFile.format, QoiImageFile, _accept)
 Image.register_decoder("qoi", QoiDecoder)
 Image.register_extension(QoiImageFile.format, ".qoi")
+
+Image.register_save(QoiImageFile.format, _save)
+Image.register_encoder("qoi", QoiEncoder)
@@ -223,10 +223,17 @@ class SGI16Decoder(ImageFile.PyDecoder):
         zsize = len(self.mode)
         self.fd.seek(512)
 
+        # The bands are stored one after another, so read them at once and
+        # unpack each from a view of its part of the data
+        data = memoryview(self.fd.read(2 * pagesize * zsize))
         for band in range(zsize):
             channel = Image.new("L", (self.state.xsize, self.state.ysize))
             channel.frombytes(
-                self.fd.read(2 * pagesize), "raw", "L;16B", stride, orientation
+                data[2 * pagesize * band : 2 * pagesize * (band + 1)],
+                "raw",
+                "L;16B",
+                stride,
+                orientation,
             )
             self.im.putband(channel.im, band)
 
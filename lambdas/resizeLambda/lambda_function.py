@@ -1,9 +1,19 @@
 import boto3
 import os
 import io
-from PIL import Image
+import base64
+import fcntl
+import hashlib
+import json
+import math
+import shutil
+import tempfile
+import time
+from PIL import Image, ImageFile, ImageStat, ExifTags, features
 import urllib.parse
 import logging
+from collections import OrderedDict, namedtuple
+from metrics import RecordMetrics
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -16,12 +26,744 @@ DESTINATION_BUCKET = os.environ.get('DESTINATION_BUCKET_NAME', 'imageresizer-ima
 DEFAULT_MAX_SIZE = 256
 MIN_RESIZE_DIMENSION = 64
 MAX_RESIZE_DIMENSION = 4096
+JPEG_QUALITY = 90
+
+# Optional: store renditions under a key derived from the source content hash, the
+# output size and the settings that affect the output, so identical uploads share one
+# object and CDN cache entry.
+# The completion record maps the upload key to the rendition key.
+CONTENT_ADDRESSED_KEYS = os.environ.get('CONTENT_ADDRESSED_KEYS', 'false').lower() == 'true'
+CONTENT_KEY_PREFIX = os.environ.get('CONTENT_KEY_PREFIX', 'renditions/')
+
+# Opt-in: resize from the thumbnail embedded in camera JPEGs (EXIF IFD1 or
+# MPO large thumbnail) instead of decoding the full image, when it is big enough
+USE_EMBEDDED_THUMBNAIL = os.environ.get('USE_EMBEDDED_THUMBNAIL', 'false').lower() == 'true'
+EMBEDDED_THUMBNAIL_ASPECT_TOLERANCE = 0.01 # Relative difference allowed between aspect ratios
+MPO_THUMBNAIL_TYPES = ('Large Thumbnail (VGA Equivalent)', 'Large Thumbnail (Full HD Equivalent)')
+
+# Completion records, read by getUrlLambda's /processing-status endpoint so the
+# frontend doesn't have to poll for the processed object itself
+STATUS_BUCKET = os.environ.get('STATUS_BUCKET_NAME', DESTINATION_BUCKET)
+STATUS_PREFIX = os.environ.get('STATUS_PREFIX', 'status/')
+
+# On-demand renditions: HTTP requests for /{key}?w=320[&h=240][&fmt=webp] are resized
+# from the original on first request and then served from the destination bucket.
+# fmt=auto picks PNG or JPEG from the statistics of the original.
+SOURCE_BUCKET = os.environ.get('SOURCE_BUCKET_NAME', 'imageresizer-imageuploads')
+ON_DEMAND_PREFIX = os.environ.get('ON_DEMAND_PREFIX', 'on-demand/')
+ON_DEMAND_FORMATS = {'jpeg': 'JPEG', 'jpg': 'JPEG', 'png': 'PNG', 'webp': 'WEBP', 'auto': 'AUTO'}
+ON_DEMAND_CACHE_CONTROL = os.environ.get('ON_DEMAND_CACHE_CONTROL', 'public, max-age=86400')
+MAX_INLINE_RESPONSE_BYTES = 4 * 1024 * 1024 # Base64 bodies must stay below the 6MB response limit
+ON_DEMAND_URL_EXPIRATION_SECONDS = 300 # Larger renditions are redirected to a presigned GET URL
+
+# Recently decoded originals, kept in module memory for warm invocations and bounded
+# by the memory they hold (default: a quarter of the function's memory)
+LAMBDA_MEMORY_MB = int(os.environ.get('AWS_LAMBDA_FUNCTION_MEMORY_SIZE', 1024))
+SOURCE_CACHE_MAX_BYTES = int(os.environ.get('SOURCE_CACHE_MAX_BYTES', LAMBDA_MEMORY_MB * 1024 * 1024 // 4))
+source_cache = OrderedDict() # (bucket, key, etag) -> (img, full_size, draft_box, nbytes), least recently used first
+source_cache_bytes = 0
+
+# Opt-in: store PNG renditions with few colors (icons, logos, screenshots) as palette
+# images. Renditions with at most 256 colors keep them exactly; up to the threshold
+# they are quantized to 256, and the palette is reused for other renditions of the source.
+# PNG renditions also lose an alpha band no pixel uses.
+QUANTIZE_PNG = os.environ.get('QUANTIZE_PNG', 'false').lower() == 'true'
+QUANTIZE_COLOR_THRESHOLD = int(os.environ.get('QUANTIZE_COLOR_THRESHOLD', 4096)) # Photos have far more
+QUANTIZE_METHOD = Image.Quantize.LIBIMAGEQUANT if features.check_feature('libimagequant') else Image.Quantize.FASTOCTREE
+PALETTE_CACHE_MAX_ENTRIES = 256
+palette_cache = OrderedDict() # (bucket, key, etag) -> palette image, least recently used first
+
+# Source statistics behind encoding decisions are computed on a copy no larger than this,
+# once per decoded source. Sampled statistics are hints, confirmed on the rendition.
+ANALYSIS_MAX_SIZE = 1024
+ImageStats = namedtuple('ImageStats', [
+    'extrema', # (min, max) per band
+    'solid', # All pixels have the same value
+    'transparent', # Has pixels that are not fully opaque
+    'colors', # getcolors() list, None if more than QUANTIZE_COLOR_THRESHOLD
+    'sampled', # Computed on a downscaled copy, so rare colors or pixels may be missed
+])
+
+# Downloaded originals, kept in /tmp for the lifetime of the execution environment
+# (default: half of its free ephemeral storage), so retries, new renditions and on-demand
+# requests skip the download. Images opened from a file can also be memory mapped.
+ORIGINALS_CACHE_DIR = os.environ.get('ORIGINALS_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'originals'))
+ORIGINALS_CACHE_PREFIX = 'runtime-'
+ORIGINALS_CACHE_LOCK = '.lock'
+
+
+def claim_originals_cache_dir():
+    """
+    Creates this runtime's directory under ORIGINALS_CACHE_DIR and returns it with the
+    lock file that marks it as in use. Directories created here by runtimes that have
+    exited are removed first, as their files are not in this runtime's index; anything
+    else in ORIGINALS_CACHE_DIR is left alone.
+    """
+    os.makedirs(ORIGINALS_CACHE_DIR, exist_ok=True)
+    for name in os.listdir(ORIGINALS_CACHE_DIR):
+        path = os.path.join(ORIGINALS_CACHE_DIR, name)
+        if not name.startswith(ORIGINALS_CACHE_PREFIX) or not os.path.isfile(os.path.join(path, ORIGINALS_CACHE_LOCK)):
+            continue
+        try:
+            with open(os.path.join(path, ORIGINALS_CACHE_LOCK), 'rb') as lock:
+                # Held by a live runtime, e.g. another local process, until it exits
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            pass
+    path = tempfile.mkdtemp(prefix=ORIGINALS_CACHE_PREFIX, dir=ORIGINALS_CACHE_DIR)
+    lock = open(os.path.join(path, ORIGINALS_CACHE_LOCK), 'wb')
+    fcntl.flock(lock, fcntl.LOCK_EX)
+    return path, lock
+
+
+originals_cache_dir, originals_cache_lock = claim_originals_cache_dir()
+ORIGINALS_CACHE_MAX_BYTES = int(os.environ.get('ORIGINALS_CACHE_MAX_BYTES', shutil.disk_usage(originals_cache_dir).free // 2))
+originals_cache = OrderedDict() # (bucket, key, etag) -> (path, nbytes, content_type, metadata), least recently used first
+originals_cache_bytes = 0
+
+
+class InvalidRenditionRequest(Exception):
+    """Raised for malformed on-demand requests, answered with a 400."""
+
+
+def output_settings(img_format, embedded_thumbnail=False):
+    """
+    Key parts for the settings other than size that change the bytes of a resized
+    rendition, so renditions stored under other settings are not served for it.
+    """
+    parts = []
+    if img_format in ('JPEG', 'AUTO'):
+        parts.append(f"q{JPEG_QUALITY}")
+    if img_format in ('PNG', 'AUTO') and QUANTIZE_PNG:
+        parts.append(f"p{QUANTIZE_COLOR_THRESHOLD}")
+    if embedded_thumbnail:
+        parts.append('t')
+    return parts
+
+
+def content_addressed_key(digest, output_size, img_format, resized, embedded_thumbnail=False):
+    """
+    Destination key for a rendition of the source with the given SHA-256 digest, e.g.
+    renditions/<digest>/256x171-q90.jpeg. An original stored as is has no settings in
+    its key, so uploads of it at any max-dimension it fits share one object.
+    """
+    img_format = img_format or 'PNG'
+    parts = [f"{output_size[0]}x{output_size[1]}"]
+    if resized:
+        parts += output_settings(img_format, embedded_thumbnail)
+    return f"{CONTENT_KEY_PREFIX}{digest}/{'-'.join(parts)}.{img_format.lower()}"
+
+
+def find_existing_rendition(destination_key):
+    """Returns the rendition entry of an already stored object, or None if it doesn't exist."""
+    try:
+        response = s3_client.head_object(Bucket=DESTINATION_BUCKET, Key=destination_key)
+    except Exception as e:
+        # A missing key is a 404 ClientError; anything else just means we process again
+        logger.info(f"No existing rendition {destination_key}: {e}")
+        return None
+    metadata = response.get('Metadata', {})
+    return {
+        'bucket': DESTINATION_BUCKET,
+        'key': destination_key,
+        'width': int(metadata.get('width', 0)),
+        'height': int(metadata.get('height', 0)),
+        'bytes': response.get('ContentLength'),
+        'contentType': response.get('ContentType'),
+    }
+
+
+def publish_status(source_key, status, renditions=None, error=None):
+    """
+    Writes the completion record for an uploaded key to the status store.
+    Failures are only logged: the renditions themselves are already stored.
+    """
+    record = {
+        'key': source_key,
+        'status': status,
+        'renditions': renditions or [],
+        'completedAt': int(time.time()),
+    }
+    if error is not None:
+        record['error'] = error
+    try:
+        s3_client.put_object(
+            Bucket=STATUS_BUCKET,
+            Key=f"{STATUS_PREFIX}{source_key}.json",
+            Body=json.dumps(record).encode('utf-8'),
+            ContentType='application/json'
+        )
+        logger.info(f"Published {status} status for {source_key}")
+    except Exception as e:
+        logger.error(f"Error publishing status for {source_key}: {e}", exc_info=True)
+
+
+def find_embedded_thumbnail(img, max_size):
+    """
+    Returns the smallest embedded thumbnail of a JPEG/MPO image that can stand in
+    for the full image when resizing to max_size, or None if there isn't one.
+    A thumbnail qualifies if it is at least the target size and has the same
+    orientation and aspect ratio as the full image.
+    """
+    if img.format not in ('JPEG', 'MPO'):
+        return None
+
+    width, height = img.size
+    scale = max_size / max(width, height)
+    target_width, target_height = round(width * scale), round(height * scale)
+    exif = img.getexif()
+    orientation = exif.get(ExifTags.Base.Orientation, 1)
+
+    candidates = []
+
+    # EXIF thumbnail, stored in IFD1 as an offset into the TIFF data
+    ifd1 = exif.get_ifd(ExifTags.IFD.IFD1)
+    thumb_offset = ifd1.get(ExifTags.Base.JpegIFOffset)
+    thumb_length = ifd1.get(ExifTags.Base.JpegIFByteCount)
+    if thumb_offset and thumb_length and ifd1.get(ExifTags.Base.Orientation, orientation) == orientation:
+        tiff_data = img.info.get('exif', b'')[6:] # Strip the "Exif\0\0" header
+        candidates.append(tiff_data[thumb_offset:thumb_offset + thumb_length])
+
+    # MPO large thumbnails, stored as additional JPEG frames
+    if img.format == 'MPO':
+        for frame, mpentry in enumerate(img.mpinfo[0xB002]):
+            if frame and mpentry['Attribute']['MPType'] in MPO_THUMBNAIL_TYPES:
+                img.seek(frame)
+                img.fp.seek(img.offset)
+                candidates.append(img.fp.read(mpentry['Size']))
+        img.seek(0)
+
+    best = None
+    for data in candidates:
+        try:
+            thumb = Image.open(io.BytesIO(data))
+            if thumb.format != 'JPEG':
+                continue
+        except Exception as e:
+            logger.warning(f"Unreadable embedded thumbnail: {e}")
+            continue
+        if thumb.width < target_width or thumb.height < target_height:
+            continue
+        if abs(thumb.width / thumb.height - width / height) > EMBEDDED_THUMBNAIL_ASPECT_TOLERANCE * width / height:
+            continue
+        if best is None or thumb.width < best.width:
+            best = thumb
+    return best
+
+
+def parse_rendition_request(event):
+    """
+    Returns (source_key, width, height, img_format) of an on-demand request.
+    Either bound may be None; without fmt the format follows the key's extension.
+    """
+    source_key = urllib.parse.unquote(event.get('rawPath', '')).lstrip('/')
+    if not source_key:
+        raise InvalidRenditionRequest("Missing image key in path")
+
+    query_params = event.get('queryStringParameters') or {}
+    bounds = []
+    for name in ('w', 'h'):
+        value = query_params.get(name)
+        if value is None:
+            bounds.append(None)
+            continue
+        try:
+            size = int(value)
+        except ValueError:
+            raise InvalidRenditionRequest(f"'{name}' must be an integer")
+        if not MIN_RESIZE_DIMENSION <= size <= MAX_RESIZE_DIMENSION:
+            raise InvalidRenditionRequest(f"'{name}' must be between {MIN_RESIZE_DIMENSION} and {MAX_RESIZE_DIMENSION}")
+        bounds.append(size)
+    width, height = bounds
+    if width is None and height is None:
+        raise InvalidRenditionRequest("At least one of 'w' and 'h' is required")
+
+    fmt = query_params.get('fmt')
+    if fmt is None:
+        # Decided from the key alone, so the cached rendition can be looked up before downloading
+        img_format = Image.registered_extensions().get(os.path.splitext(source_key)[1].lower())
+        if img_format not in ON_DEMAND_FORMATS.values():
+            img_format = 'PNG'
+    elif fmt.lower() in ON_DEMAND_FORMATS:
+        img_format = ON_DEMAND_FORMATS[fmt.lower()]
+    else:
+        raise InvalidRenditionRequest(f"'fmt' must be one of {', '.join(sorted(set(ON_DEMAND_FORMATS) - {'jpg'}))}")
+    return source_key, width, height, img_format
+
+
+def rendition_key(source_key, width, height, img_format):
+    """Destination key of an on-demand rendition, e.g. on-demand/<key>/w320-q90.jpeg."""
+    parts = []
+    if width is not None:
+        parts.append(f"w{width}")
+    if height is not None:
+        parts.append(f"h{height}")
+    parts += output_settings(img_format)
+    return f"{ON_DEMAND_PREFIX}{source_key}/{'-'.join(parts)}.{img_format.lower()}"
+
+
+def normalize_etag(etag):
+    # S3 event notifications omit the quotes that head_object and get_object include
+    return etag.strip('"') if etag else None
+
+
+def cache_original(cache_key, image_data, content_type, metadata):
+    """
+    Writes downloaded original bytes to the disk cache, evicting the least recently
+    used files over budget. Returns the file path, or None if they weren't cached.
+    """
+    global originals_cache_bytes
+    nbytes = len(image_data)
+    if nbytes > ORIGINALS_CACHE_MAX_BYTES:
+        return None
+    previous = originals_cache.pop(cache_key, None)
+    if previous is not None:
+        originals_cache_bytes -= previous[1]
+    while originals_cache and originals_cache_bytes + nbytes > ORIGINALS_CACHE_MAX_BYTES:
+        _, (evicted_path, evicted_bytes, _, _) = originals_cache.popitem(last=False)
+        originals_cache_bytes -= evicted_bytes
+        try:
+            os.remove(evicted_path)
+        except FileNotFoundError:
+            pass
+
+    path = os.path.join(originals_cache_dir, hashlib.sha256('\0'.join(cache_key).encode('utf-8')).hexdigest())
+    try:
+        # Write under a temporary name, so a partial file is never in the index
+        with open(path + '.part', 'wb') as f:
+            f.write(image_data)
+        os.replace(path + '.part', path)
+    except OSError as e:
+        logger.warning(f"Could not cache original {cache_key[1]} in {originals_cache_dir}: {e}")
+        return None
+    originals_cache[cache_key] = (path, nbytes, content_type, metadata)
+    originals_cache_bytes += nbytes
+    return path
+
+
+def original_digest(path, image_data):
+    """SHA-256 hex digest of an original, read from its cached file if image_data is None."""
+    if image_data is not None:
+        return hashlib.sha256(image_data).hexdigest()
+    with open(path, 'rb') as f:
+        return hashlib.file_digest(f, 'sha256').hexdigest()
+
+
+def fetch_original(bucket, key, metrics, etag=None):
+    """
+    Returns (path, image_data, content_type, metadata) of an original. If its ETag
+    is known and it is in the disk cache, only the path is returned and image_data
+    is None. Otherwise it is downloaded and cached; path is None if it didn't fit.
+    """
+    etag = normalize_etag(etag)
+    entry = originals_cache.get((bucket, key, etag)) if etag else None
+    if entry is not None and os.path.exists(entry[0]):
+        originals_cache.move_to_end((bucket, key, etag))
+        path, nbytes, content_type, metadata = entry
+        metrics.put_metric('OriginalCacheHit', 1)
+        metrics.put_metric('BytesIn', nbytes, 'Bytes')
+        return path, None, content_type, metadata
+    metrics.put_metric('OriginalCacheHit', 0)
+
+    with metrics.stage('Download'):
+        response = s3_client.get_object(Bucket=bucket, Key=key)
+        image_data = response['Body'].read()
+    metrics.put_metric('BytesIn', len(image_data), 'Bytes')
+    content_type = response.get('ContentType')
+    metadata = response.get('Metadata', {})
+    cache_key = (bucket, key, normalize_etag(response.get('ETag')) or etag or '')
+    path = cache_original(cache_key, image_data, content_type, metadata)
+    return path, image_data, content_type, metadata
+
+
+def rendition_size(full_size, width, height):
+    """Size of a rendition of a full_size original fitting within width x height, without upscaling."""
+    full_width, full_height = full_size
+    scale = min((width or MAX_RESIZE_DIMENSION) / full_width, (height or MAX_RESIZE_DIMENSION) / full_height, 1)
+    return max(1, round(full_width * scale)), max(1, round(full_height * scale))
+
+
+def thumbnail_size(size, max_size):
+    """
+    Size Image.thumbnail((max_size, max_size)) gives an image of the given size,
+    keeping the aspect ratio with the same rounding.
+    """
+    width, height = size
+    if width <= max_size and height <= max_size:
+        return size
+    aspect = width / height
+    # Rounded down or up, whichever keeps the aspect ratio closest
+    if aspect <= 1:
+        candidates = (math.floor(max_size * aspect), math.ceil(max_size * aspect))
+        return max(min(candidates, key=lambda n: abs(aspect - n / max_size)), 1), max_size
+    candidates = (math.floor(max_size / aspect), math.ceil(max_size / aspect))
+    return max_size, max(min(candidates, key=lambda n: 0 if n == 0 else abs(aspect - max_size / n)), 1)
+
+
+def decoded_size(img):
+    """Approximate memory held by the pixel data of a loaded image, in bytes."""
+    if img.mode in ('1', 'L', 'P'):
+        pixel_size = 1
+    elif img.mode.startswith('I;16'):
+        pixel_size = 2
+    else:
+        pixel_size = 4 # Including RGB, which is stored with a padding byte
+    return img.width * img.height * pixel_size
+
+
+def cache_source_image(cache_key, img, full_size, draft_box, nbytes):
+    """Adds a decoded original to the LRU, evicting the least recently used ones over budget."""
+    global source_cache_bytes
+    previous = source_cache.pop(cache_key, None) # Same source decoded at a lower resolution
+    if previous is not None:
+        source_cache_bytes -= previous[3]
+        previous[0].close()
+    if nbytes > SOURCE_CACHE_MAX_BYTES:
+        return
+    source_cache[cache_key] = (img, full_size, draft_box, nbytes)
+    source_cache_bytes += nbytes
+    while source_cache_bytes > SOURCE_CACHE_MAX_BYTES:
+        _, (evicted, _, _, evicted_bytes) = source_cache.popitem(last=False)
+        source_cache_bytes -= evicted_bytes
+        evicted.close()
+
+
+def get_source_image(bucket, key, width, height, metrics):
+    """
+    Returns (img, full_size, draft_box, cache_key) of an original, decoded at no less than
+    twice the size of a rendition fitting width x height, draft-reduced where the format
+    allows. draft_box is the region of img covering the full original, for resize(box=...).
+    Decoded images are kept in a module-level LRU keyed by bucket, key and ETag,
+    so a warm container serving a burst of requests for one source decodes it once.
+    The returned image must not be modified.
+    """
+    with metrics.stage('Head'):
+        etag = normalize_etag(s3_client.head_object(Bucket=bucket, Key=key)['ETag'])
+    entry = source_cache.get((bucket, key, etag))
+    if entry is not None:
+        img, full_size, draft_box, _ = entry
+        output_width, output_height = rendition_size(full_size, width, height)
+        # A lower-resolution decode is only good for renditions up to half its size
+        if img.width >= min(full_size[0], output_width * 2) and img.height >= min(full_size[1], output_height * 2):
+            source_cache.move_to_end((bucket, key, etag))
+            metrics.put_metric('SourceCacheHit', 1)
+            return img, full_size, draft_box, (bucket, key, etag)
+    metrics.put_metric('SourceCacheHit', 0)
+
+    path, image_data, _, _ = fetch_original(bucket, key, metrics, etag)
+    with metrics.stage('Open'):
+        # From a file, load() can map uncompressed pixel data instead of copying it
+        img = Image.open(path or io.BytesIO(image_data))
+    full_size = img.size
+    output_width, output_height = rendition_size(full_size, width, height)
+    # Reduced-resolution decoding (JPEG, JPEG 2000), as for upload-time renditions
+    drafted = img.draft(None, (output_width * 2, output_height * 2))
+    draft_box = drafted[1] if drafted else None
+    metrics.put_metric('DraftScale', full_size[0] / img.width, 'None')
+    with metrics.stage('Decode'), ImageFile.profile() as tiles:
+        img.load()
+    metrics.put_tile_profiles('Decoder', tiles)
+
+    nbytes = decoded_size(img)
+    if path is None:
+        nbytes += len(image_data) # Opened from memory, the image keeps the encoded bytes
+    cache_source_image((bucket, key, etag), img, full_size, draft_box, nbytes)
+    metrics.put_metric('SourceCacheBytes', source_cache_bytes, 'Bytes')
+    return img, full_size, draft_box, (bucket, key, etag)
+
+
+def image_stats(img):
+    """
+    Returns ImageStats for a loaded source image, computed from one histogram()
+    of a nearest-neighbour copy no larger than ANALYSIS_MAX_SIZE. The histogram
+    counts each band on its own, so the colors are counted on the same copy,
+    unless it is solid. They are cached on the image until its pixels are
+    replaced, so a cached source is analyzed once for all of its renditions.
+    """
+    cached = getattr(img, '_image_stats', None)
+    if cached is not None and cached[0] is img.im:
+        return cached[1]
+    sample = img
+    sampled = max(img.size) > ANALYSIS_MAX_SIZE
+    if sampled:
+        sample = img.resize(rendition_size(img.size, ANALYSIS_MAX_SIZE, ANALYSIS_MAX_SIZE), Image.Resampling.NEAREST)
+    if sample.mode not in ('1', 'L', 'LA', 'RGB', 'RGBA', 'CMYK'):
+        # Colors are counted as values, not palette indices or high bit depth samples
+        sample = sample.convert('RGBA' if sample.has_transparency_data else 'RGB')
+    if sample.mode == 'LA':
+        # histogram() has the L band in place of alpha for LA images
+        histogram = [count for band in sample.split() for count in band.histogram()]
+    else:
+        histogram = sample.histogram()
+    extrema = ImageStat.Stat(histogram).extrema
+    bands = sample.getbands()
+    solid = all(low == high for low, high in extrema)
+    if solid:
+        color = tuple(low for low, _ in extrema)
+        colors = [(sample.width * sample.height, color if len(color) > 1 else color[0])]
+    else:
+        colors = sample.getcolors(QUANTIZE_COLOR_THRESHOLD)
+    stats = ImageStats(
+        extrema=extrema,
+        solid=solid,
+        transparent='A' in bands and extrema[bands.index('A')][0] < 255,
+        colors=colors,
+        sampled=sampled,
+    )
+    img._image_stats = (img.im, stats)
+    return stats
+
+
+def drop_unused_alpha(source, rendition):
+    """
+    Returns an RGBA or LA rendition without its alpha band if no pixel of the
+    source is transparent. Sampled statistics can miss transparent pixels, so
+    then the rendition's own alpha band is checked.
+    """
+    stats = image_stats(source)
+    if stats.transparent:
+        return rendition
+    if stats.sampled and rendition.getchannel('A').getextrema()[0] < 255:
+        return rendition
+    return rendition.convert(rendition.mode[:-1])
+
+
+def quantize_rendition(img, stats, metrics, cache_key=None, resized=True):
+    """
+    Returns an RGB or RGBA rendition as a palette image if its source's stats
+    found at most QUANTIZE_COLOR_THRESHOLD colors, otherwise None. An RGB
+    rendition of a solid source, or of one with at most 256 colors counted on
+    all of its pixels and not resized, keeps the source's colors exactly; others
+    are quantized to 256. Palettes computed for an RGB rendition are kept per
+    source (bucket, key, etag) and reused for its other renditions, which only
+    need mapping to the nearest palette entry.
+    """
+    if img.mode not in ('RGB', 'RGBA'):
+        return None
+    with metrics.stage('Quantize'):
+        metrics.put_metric('Quantized', 0 if stats.colors is None else 1)
+        if stats.colors is None:
+            return None
+        metrics.put_metric('ColorsIn', len(stats.colors))
+        metrics.put_metric('SolidColor', int(stats.solid))
+        if img.mode == 'RGB' and (stats.solid or (not stats.sampled and not resized and len(stats.colors) <= 256)):
+            # Exact, with a palette of the source's colors (without alpha, if it was dropped)
+            palette = Image.new('P', (1, 1))
+            palette.putpalette([channel for _, color in stats.colors for channel in color[:3]])
+            return img.quantize(palette=palette, dither=Image.Dither.NONE)
+        # Only RGB images can be mapped to a given palette
+        palette = palette_cache.get(cache_key) if img.mode == 'RGB' else None
+        if palette is not None:
+            palette_cache.move_to_end(cache_key)
+            metrics.put_metric('PaletteCacheHit', 1)
+            return img.quantize(palette=palette, dither=Image.Dither.NONE)
+        quantized = img.quantize(256, method=QUANTIZE_METHOD)
+        if img.mode == 'RGB' and cache_key is not None:
+            metrics.put_metric('PaletteCacheHit', 0)
+            palette = Image.new('P', (1, 1))
+            palette.putpalette(quantized.getpalette())
+            palette_cache[cache_key] = palette
+            while len(palette_cache) > PALETTE_CACHE_MAX_ENTRIES:
+                palette_cache.popitem(last=False)
+        return quantized
+
+
+def finish_rendition(source, rendition, img_format, metrics, cache_key=None):
+    """
+    Applies the decisions taken from the source's statistics to a PNG rendition
+    of it when QUANTIZE_PNG is on: an unused alpha band is dropped, and few-color
+    renditions become palette images. Other renditions are returned as is.
+    """
+    if img_format != 'PNG' or not QUANTIZE_PNG:
+        return rendition
+    if rendition.mode in ('RGBA', 'LA'):
+        rendition = drop_unused_alpha(source, rendition)
+    resized = rendition.size != source.size
+    return quantize_rendition(rendition, image_stats(source), metrics, cache_key, resized) or rendition
+
+
+def auto_format(img):
+    """
+    Output format for fmt=auto, from the statistics of the source: PNG for
+    transparent, solid and few-color images such as logos and screenshots, JPEG
+    for photos. An alpha band a sample shows as unused could still hide
+    transparent pixels JPEG would lose, so such sources also get PNG.
+    """
+    stats = image_stats(img)
+    if stats.transparent or stats.colors is not None:
+        return 'PNG'
+    if stats.sampled and 'A' in img.getbands():
+        return 'PNG'
+    return 'JPEG'
+
+
+def encode_rendition(img, size, box, img_format, metrics, cache_key=None):
+    """Resizes the box region of img (None for all of it) to size and returns the encoded rendition."""
+    # resize() returns a new image, so the cached source is left untouched
+    rendition = img.resize(size, Image.Resampling.BICUBIC, box=box, reducing_gap=2.0)
+
+    buffer = io.BytesIO()
+    if img_format == 'JPEG':
+        if rendition.mode not in ('RGB', 'L', 'CMYK'):
+            rendition = rendition.convert('RGB')
+        rendition.save(buffer, format='JPEG', quality=JPEG_QUALITY)
+    else:
+        rendition = finish_rendition(img, rendition, img_format, metrics, cache_key)
+        if rendition.mode == 'CMYK':
+            rendition = rendition.convert('RGB')
+        rendition.save(buffer, format=img_format)
+    return buffer.getvalue()
+
+
+def redirect_response(destination_key):
+    """Redirects to a presigned GET URL of a stored rendition."""
+    url = s3_client.generate_presigned_url(
+        ClientMethod='get_object',
+        Params={'Bucket': DESTINATION_BUCKET, 'Key': destination_key},
+        ExpiresIn=ON_DEMAND_URL_EXPIRATION_SECONDS,
+        HttpMethod='GET'
+    )
+    return {
+        'statusCode': 302,
+        'headers': {'Location': url, 'Cache-Control': 'no-store', 'Access-Control-Allow-Origin': '*'},
+        'body': ''
+    }
+
+
+def rendition_response(destination_key, data, content_type):
+    """Returns a rendition inline, or redirects to it if it is too large for a Lambda response."""
+    if len(data) > MAX_INLINE_RESPONSE_BYTES:
+        return redirect_response(destination_key)
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': content_type,
+            'Cache-Control': ON_DEMAND_CACHE_CONTROL,
+            'Access-Control-Allow-Origin': '*' # Restrict in production
+        },
+        'body': base64.b64encode(data).decode('ascii'),
+        'isBase64Encoded': True
+    }
+
+
+def on_demand_handler(event, context):
+    """
+    Handles HTTP requests for /{key}?w=&h=&fmt=. A rendition already stored in the
+    destination bucket is returned as is; otherwise it is resized from the original
+    in the source bucket, stored for later requests and returned.
+    """
+    metrics = RecordMetrics()
+    metrics.set_dimension('Format', 'Unknown')
+    metrics.set_property('Status', 'Failed')
+    metrics.set_property('Trigger', 'OnDemand')
+    start_time = time.perf_counter()
+
+    try:
+        try:
+            source_key, width, height, img_format = parse_rendition_request(event)
+        except InvalidRenditionRequest as e:
+            logger.warning(f"Invalid on-demand request {event.get('rawPath')}: {e}")
+            metrics.set_property('Status', 'Rejected')
+            return {
+                'statusCode': 400,
+                'headers': {'Access-Control-Allow-Origin': '*'}, # Include CORS
+                'body': json.dumps({'message': str(e)})
+            }
+        destination_key = rendition_key(source_key, width, height, img_format)
+        content_type = Image.MIME.get(img_format) # Not known yet for fmt=auto
+        metrics.set_dimension('Format', img_format)
+        metrics.set_property('SourceKey', source_key)
+        metrics.set_property('DestinationKey', destination_key)
+
+        # 1. Serve the stored rendition if an earlier request produced it
+        try:
+            with metrics.stage('CacheLookup'):
+                response = s3_client.get_object(Bucket=DESTINATION_BUCKET, Key=destination_key)
+                if response.get('ContentLength', 0) > MAX_INLINE_RESPONSE_BYTES:
+                    response['Body'].close()
+                    data = None
+                else:
+                    data = response['Body'].read()
+            logger.info(f"Serving stored rendition {destination_key}")
+            metrics.set_property('Status', 'CacheHit')
+            if data is None:
+                return redirect_response(destination_key)
+            return rendition_response(destination_key, data, response.get('ContentType', content_type))
+        except s3_client.exceptions.NoSuchKey:
+            logger.info(f"No stored rendition {destination_key}, resizing from the original")
+
+        # 2. Resize from the (possibly already decoded) original
+        try:
+            img, full_size, draft_box, cache_key = get_source_image(SOURCE_BUCKET, source_key, width, height, metrics)
+        except s3_client.exceptions.ClientError as e:
+            # head_object has no body, so a missing key is reported as a bare 404
+            if e.response['Error']['Code'] not in ('404', 'NoSuchKey', 'NotFound'):
+                raise
+            metrics.set_property('Status', 'NotFound')
+            return {
+                'statusCode': 404,
+                'headers': {'Access-Control-Allow-Origin': '*'}, # Include CORS
+                'body': json.dumps({'message': f'Image not found: {source_key}'})
+            }
+        metrics.put_metric('PixelsIn', img.width * img.height)
+        if img_format == 'AUTO':
+            with metrics.stage('Analyze'):
+                img_format = auto_format(img)
+            content_type = Image.MIME[img_format]
+            metrics.set_property('ChosenFormat', img_format)
+        # Sized from the full original, so a draft-reduced decode gives the same rendition
+        output_width, output_height = rendition_size(full_size, width, height)
+        with metrics.stage('Resize'), ImageFile.profile() as tiles:
+            data = encode_rendition(img, (output_width, output_height), draft_box, img_format, metrics, cache_key)
+        metrics.put_tile_profiles('Encoder', tiles)
+        metrics.put_metric('PixelsOut', output_width * output_height)
+        metrics.put_metric('BytesOut', len(data), 'Bytes')
+
+        # 3. Store it, so the next request (or CDN miss) is a plain S3 read
+        with metrics.stage('Upload'):
+            s3_client.put_object(
+                Bucket=DESTINATION_BUCKET,
+                Key=destination_key,
+                Body=data,
+                ContentType=content_type,
+                CacheControl=ON_DEMAND_CACHE_CONTROL,
+                Metadata={'width': str(output_width), 'height': str(output_height)}
+            )
+        logger.info(f"Stored rendition {destination_key} ({output_width}x{output_height})")
+
+        metrics.set_property('Status', 'Succeeded')
+        return rendition_response(destination_key, data, content_type)
+
+    except Exception as e:
+        logger.error(f"Error serving on-demand rendition {event.get('rawPath')}: {e}", exc_info=True)
+        return {
+            'statusCode': 500,
+            'headers': {'Access-Control-Allow-Origin': '*'}, # Include CORS
+            'body': json.dumps({'message': 'Error resizing image', 'error': str(e)})
+        }
+    finally:
+        metrics.put_metric('TotalTime', (time.perf_counter() - start_time) * 1000, 'Milliseconds')
+        metrics.emit()
+
+
 def lambda_handler(event, context):
     """
     Handles S3 put events, downloads image, resizes if needed, uploads to destination.
+    HTTP requests (Function URL / API Gateway) are on-demand renditions.
     """
+    if 'Records' not in event and 'rawPath' in event:
+        return on_demand_handler(event, context)
+
     print("Received event:", event) # Log the incoming event for debugging
 
+    # Per-stage timings, sizes and format, emitted as one EMF line per record
+    metrics = RecordMetrics()
+    metrics.set_dimension('Format', 'Unknown')
+    metrics.set_property('Status', 'Failed')
+    start_time = time.perf_counter()
+    source_bucket = source_key = None
+
     try:
         # 1. Get Bucket and Key from the event
         record = event['Records'][0]
@@ -31,20 +773,22 @@ def lambda_handler(event, context):
 
         print(f"Source Bucket: {source_bucket}")
         print(f"Source Key: {source_key}")
+        metrics.set_property('SourceBucket', source_bucket)
+        metrics.set_property('SourceKey', source_key)
 
         # Prevent infinite loops: check if source and destination are the same
         # or if the event is from the destination bucket (if using prefixes)
         # This simple check assumes different bucket names. Adjust if using prefixes.
         if source_bucket == DESTINATION_BUCKET:
              print("Source and destination buckets are the same, skipping processing.")
+             metrics.set_property('Status', 'Skipped')
              return {'statusCode': 200, 'body': 'Skipped (source == destination)'}
 
-        # 2. Download the image from Source S3
+        # 2. Download the image from Source S3, unless this environment has it on disk already
         try:
-            response = s3_client.get_object(Bucket=source_bucket, Key=source_key)
-            image_data = response['Body'].read()
-            content_type = response.get('ContentType', 'image/jpeg') # Default to jpeg if not specified
-            metadata = response.get('Metadata', {}) # Get object metadata
+            original_path, image_data, content_type, metadata = fetch_original(
+                source_bucket, source_key, metrics, etag=record['s3']['object'].get('eTag'))
+            content_type = content_type or 'image/jpeg' # Default to jpeg if not specified
             print(f"Downloaded {source_key} from {source_bucket}. ContentType: {content_type}")
         except Exception as e:
             print(f"Error downloading from S3: {e}")
@@ -70,61 +814,137 @@ def lambda_handler(event, context):
         # --------------------------
 
         # 3. Image Resizing Logic
-        with Image.open(io.BytesIO(image_data)) as img:
+        with metrics.stage('Open'):
              # handle potential image loading errors
             try:
-                img.verify() # Verify image data integrity if possible
-                # Re-open after verify
-                img = Image.open(io.BytesIO(image_data))
+                with Image.open(original_path or io.BytesIO(image_data)) as verify_img:
+                    verify_img.verify() # Verify image data integrity if possible
+                # Re-open after verify, from the cached file if there is one
+                img = Image.open(original_path or io.BytesIO(image_data))
             except Exception as img_err:
                 logger.error(f"Invalid image format or error opening image {source_key}: {img_err}", exc_info=True)
                 # Optional: You could try to put the original object in destination or just fail
                 raise ValueError(f"Could not process image file: {source_key}") from img_err
 
+        resized = img.width > max_size or img.height > max_size
+        thumb = None
+        if resized and USE_EMBEDDED_THUMBNAIL:
+            thumb = find_embedded_thumbnail(img, max_size)
+
+        # Use the same key name in the destination bucket, unless content addressed
+        destination_key = source_key
+        if CONTENT_ADDRESSED_KEYS:
+            with metrics.stage('Hash'):
+                digest = original_digest(original_path, image_data)
+            # Sized and typed as written, from the embedded thumbnail if it is resized instead
+            written = thumb or img
+            destination_key = content_addressed_key(
+                digest, thumbnail_size(written.size, max_size), written.format, resized, thumb is not None)
+            existing = find_existing_rendition(destination_key)
+            if existing is not None:
+                # Same content at the same parameters was processed before
+                img.close()
+                print(f"Reusing existing rendition {destination_key}")
+                publish_status(source_key, 'succeeded', renditions=[existing])
+                metrics.set_property('Status', 'Deduplicated')
+                return {
+                    'statusCode': 200,
+                    'body': f'Reused existing rendition {destination_key} for {source_key}'
+                }
+
+        with img:
             original_width, original_height = img.size
             print(f"Original dimensions: {original_width}x{original_height}")
+            metrics.set_dimension('Format', img.format or 'Unknown')
+            metrics.put_metric('PixelsIn', original_width * original_height)
 
             if original_width <= max_size and original_height <= max_size:
                 logger.info(f"Image dimensions ({original_width}x{original_height}) are within target max size ({max_size}px). No resizing needed.")
-                output_data = io.BytesIO(image_data) # Use original data
+                # Use original data, uploaded from the cached file if it wasn't downloaded
+                if image_data is None:
+                    output_data = open(original_path, 'rb')
+                    output_bytes = os.fstat(output_data.fileno()).st_size
+                else:
+                    output_data = io.BytesIO(image_data)
+                    output_bytes = len(image_data)
+                output_width, output_height = original_width, original_height
+                metrics.put_metric('PixelsOut', original_width * original_height)
             else:
                 logger.info(f"Resizing required to fit max dimension {max_size}px.")
-                # Use thumbnail to resize inplace maintaining aspect ratio
-                img.thumbnail((max_size, max_size))
+                if thumb is not None:
+                    logger.info(f"Using embedded {thumb.width}x{thumb.height} thumbnail instead of full image.")
+                    img = thumb
+                # Reduced-resolution decoding (JPEG, JPEG 2000) and resizing as
+                # thumbnail() would do them, with decode timed on its own
+                source_width = img.width
+                thumb_size = thumbnail_size(img.size, max_size)
+                drafted = img.draft(None, (max_size * 2, max_size * 2))
+                metrics.put_metric('DraftScale', source_width / img.width, 'None')
+                with metrics.stage('Decode'), ImageFile.profile() as tiles:
+                    img.load()
+                metrics.put_tile_profiles('Decoder', tiles)
+
+                # Preserve original format if possible, else default (e.g., PNG for transparency)
+                img_format = img.format if img.format else 'PNG'
+                # The draft box leaves out the partial pixels reduced decoding rounds up to
+                source = img
+                with metrics.stage('Resize'):
+                    img = img.resize(thumb_size, Image.Resampling.BICUBIC, box=drafted[1] if drafted else None, reducing_gap=2.0)
                 resized_width, resized_height = img.size
+                output_width, output_height = resized_width, resized_height
                 print(f"Resized dimensions: {resized_width}x{resized_height}")
+                metrics.put_metric('PixelsOut', resized_width * resized_height)
 
                 # Save resized image to a buffer
                 buffer = io.BytesIO()
-                # Preserve original format if possible, else default (e.g., PNG for transparency)
-                img_format = img.format if img.format else 'PNG'
-                if img_format == 'JPEG':
-                   # Handle potential lack of transparency in JPEG
-                   if img.mode in ("RGBA", "P"):
-                       img = img.convert("RGB")
-                   img.save(buffer, format='JPEG', quality=90) # Control JPEG quality
-                else:
-                   img.save(buffer, format=img_format)
+                with metrics.stage('Encode'), ImageFile.profile() as tiles:
+                    if img_format == 'JPEG':
+                       # Handle potential lack of transparency in JPEG
+                       if img.mode in ("RGBA", "P"):
+                           img = img.convert("RGB")
+                       img.save(buffer, format='JPEG', quality=JPEG_QUALITY) # Control JPEG quality
+                    else:
+                       # Keyed like the on-demand renditions of the same upload
+                       etag = record['s3']['object'].get('eTag')
+                       cache_key = (source_bucket, source_key, normalize_etag(etag)) if etag else None
+                       img = finish_rendition(source, img, img_format, metrics, cache_key)
+                       img.save(buffer, format=img_format)
+                metrics.put_tile_profiles('Encoder', tiles)
 
                 buffer.seek(0)
                 output_data = buffer
+                output_bytes = buffer.getbuffer().nbytes
                 print(f"Image resized and saved to buffer in {img_format} format.")
 
         # 4. Upload the resulting file back to Destination S3
-        # Use the same key name in the destination bucket
-        destination_key = source_key
+        metrics.put_metric('BytesOut', output_bytes, 'Bytes')
         try:
-            s3_client.put_object(
-                Bucket=DESTINATION_BUCKET,
-                Key=destination_key,
-                Body=output_data,
-                ContentType=content_type # Use the original or determined content type
-            )
+            with metrics.stage('Upload'):
+                s3_client.put_object(
+                    Bucket=DESTINATION_BUCKET,
+                    Key=destination_key,
+                    Body=output_data,
+                    ContentType=content_type, # Use the original or determined content type
+                    Metadata={'width': str(output_width), 'height': str(output_height)}
+                )
             print(f"Successfully uploaded {destination_key} to {DESTINATION_BUCKET}")
         except Exception as e:
             print(f"Error uploading to Destination S3: {e}")
             raise e # Fail the function execution
+        finally:
+            output_data.close()
 
+        publish_status(source_key, 'succeeded', renditions=[{
+            'bucket': DESTINATION_BUCKET,
+            'key': destination_key,
+            'width': output_width,
+            'height': output_height,
+            'bytes': output_bytes,
+            'contentType': content_type,
+        }])
+
+        metrics.set_property('DestinationKey', destination_key)
+        metrics.set_property('Status', 'Succeeded')
         return {
             'statusCode': 200,
             'body': f'Successfully processed {source_key} from {source_bucket}'
@@ -135,7 +955,12 @@ def lambda_handler(event, context):
         # Log the full traceback for debugging
         import traceback
         traceback.print_exc()
+        if source_key is not None and source_bucket != DESTINATION_BUCKET:
+            publish_status(source_key, 'failed', error=str(e))
         return {
             'statusCode': 500,
             'body': f'Error processing file: {e}'
-        }
\ No newline at end of file
+        }
+    finally:
+        metrics.put_metric('TotalTime', (time.perf_counter() - start_time) * 1000, 'Milliseconds')
+        metrics.emit()
\ No newline at end of file
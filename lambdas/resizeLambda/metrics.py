@@ -0,0 +1,65 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+
+# CloudWatch namespace the Embedded Metric Format (EMF) records are published under
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'ImageResizer')
+
+
+class RecordMetrics:
+    """
+    Collects per-stage timings and counters for one processed record and
+    emits them as a single CloudWatch Embedded Metric Format JSON line.
+    Lambda forwards stdout to CloudWatch Logs, which extracts the metrics;
+    locally the line is just printed.
+    """
+
+    def __init__(self, namespace=METRICS_NAMESPACE):
+        self.namespace = namespace
+        self.dimensions = {}
+        self.metrics = {} # name -> (value, unit)
+        self.properties = {}
+
+    @contextmanager
+    def stage(self, name):
+        """Times the wrapped block and records it as '<name>Time' in milliseconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.put_metric(f"{name}Time", (time.perf_counter() - start) * 1000, 'Milliseconds')
+
+    def put_metric(self, name, value, unit='Count'):
+        self.metrics[name] = (value, unit)
+
+    def put_tile_profiles(self, name, tiles):
+        """Records decoder/encoder totals from a list of PIL.ImageFile.TileProfile."""
+        self.put_metric(f"{name}IoTime", sum(tile.io_time for tile in tiles) * 1000, 'Milliseconds')
+        self.put_metric(f"{name}CodecTime", sum(tile.codec_time for tile in tiles) * 1000, 'Milliseconds')
+        self.put_metric(f"{name}Calls", sum(tile.calls for tile in tiles))
+
+    def set_dimension(self, name, value):
+        self.dimensions[name] = str(value) # Dimension values must be strings
+
+    def set_property(self, name, value):
+        self.properties[name] = value
+
+    def to_emf(self):
+        record = {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [list(self.dimensions)],
+                    'Metrics': [{'Name': name, 'Unit': unit} for name, (_, unit) in self.metrics.items()],
+                }],
+            },
+        }
+        record.update(self.properties)
+        record.update(self.dimensions)
+        record.update({name: value for name, (value, _) in self.metrics.items()})
+        return record
+
+    def emit(self):
+        print(json.dumps(self.to_emf(), default=str))
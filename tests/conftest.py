@@ -0,0 +1,119 @@
+import hashlib
+import importlib.util
+import io
+import os
+import sys
+import types
+
+import pytest
+from botocore.exceptions import ClientError
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESIZE_LAMBDA_DIR = os.path.join(REPO_ROOT, 'lambdas', 'resizeLambda')
+
+# Test the Pillow vendored with the resize Lambda, not an installed one
+sys.path.insert(0, RESIZE_LAMBDA_DIR)
+
+
+def gradient(mode, size):
+    """Deterministic test content of the given mode and size."""
+    from PIL import Image
+
+    bands = [
+        Image.linear_gradient('L').resize(size),
+        Image.radial_gradient('L').resize(size),
+        Image.linear_gradient('L').rotate(90).resize(size),
+    ]
+    return Image.merge('RGB', bands).convert(mode)
+
+
+def encode(im, image_format, **params):
+    out = io.BytesIO()
+    im.save(out, format=image_format, **params)
+    return out.getvalue()
+
+
+class NoSuchKey(ClientError):
+    pass
+
+
+class FakeS3Client:
+    """In-memory stand-in for the boto3 S3 client calls the Lambdas make."""
+
+    exceptions = types.SimpleNamespace(ClientError=ClientError, NoSuchKey=NoSuchKey)
+
+    def __init__(self):
+        self.objects = {} # (bucket, key) -> dict of the stored object
+
+    def _object(self, bucket, key, operation):
+        try:
+            return self.objects[(bucket, key)]
+        except KeyError:
+            if operation == 'HeadObject':
+                # head_object has no body, so the error carries only the status code
+                raise ClientError({'Error': {'Code': '404', 'Message': 'Not Found'}}, operation) from None
+            raise NoSuchKey({'Error': {'Code': 'NoSuchKey', 'Message': key}}, operation) from None
+
+    def put_object(self, Bucket, Key, Body, ContentType=None, Metadata=None, **kwargs):
+        data = Body.read() if hasattr(Body, 'read') else Body
+        etag = f'"{hashlib.md5(data).hexdigest()}"'
+        self.objects[(Bucket, Key)] = {
+            'Body': bytes(data),
+            'ContentType': ContentType,
+            'Metadata': Metadata or {},
+            'ETag': etag,
+            **kwargs,
+        }
+        return {'ETag': etag}
+
+    @staticmethod
+    def _head(obj):
+        return {
+            'ContentLength': len(obj['Body']),
+            'ContentType': obj['ContentType'],
+            'Metadata': obj['Metadata'],
+            'ETag': obj['ETag'],
+        }
+
+    def head_object(self, Bucket, Key):
+        return self._head(self._object(Bucket, Key, 'HeadObject'))
+
+    def get_object(self, Bucket, Key):
+        obj = self._object(Bucket, Key, 'GetObject')
+        return {**self._head(obj), 'Body': io.BytesIO(obj['Body'])}
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn, HttpMethod=None):
+        return f"https://{Params['Bucket']}.s3.example.com/{Params['Key']}?method={ClientMethod}&expires={ExpiresIn}"
+
+
+def load_lambda(name):
+    """
+    Imports lambdas/<name>/lambda_function.py as <name>_function, so the Lambdas'
+    modules of the same name don't collide, with a fresh module state each time.
+    """
+    path = os.path.join(REPO_ROOT, 'lambdas', name, 'lambda_function.py')
+    spec = importlib.util.spec_from_file_location(f'{name}_function', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(autouse=True)
+def aws_environment(monkeypatch, tmp_path):
+    # boto3 clients are created at import time; nothing here talks to AWS
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setenv('ORIGINALS_CACHE_DIR', str(tmp_path / 'originals'))
+
+
+@pytest.fixture
+def s3():
+    return FakeS3Client()
+
+
+@pytest.fixture
+def resize_lambda(s3):
+    module = load_lambda('resizeLambda')
+    module.s3_client = s3
+    return module
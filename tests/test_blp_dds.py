@@ -0,0 +1,140 @@
+import functools
+import io
+import random
+import struct
+import sys
+
+import pytest
+from PIL import BlpImagePlugin, Image, ImageChops, ImageFile
+
+from conftest import encode, gradient
+
+DDS_HEADER_SIZE = 128
+
+
+def blp2_dxt(size, alpha_encoding, alpha_depth, blocks):
+    """A BLP2 file with one mipmap of DXT compressed blocks."""
+    header = b'BLP2' + struct.pack('<i4bII', 1, BlpImagePlugin.Encoding.DXT, alpha_depth, alpha_encoding, 0, *size)
+    offset = len(header) + 128 + 256 * 4
+    offsets = struct.pack('<16I', offset, *[0] * 15)
+    lengths = struct.pack('<16I', len(blocks), *[0] * 15)
+    return header + offsets + lengths + bytes(256 * 4) + blocks
+
+
+def dds_masked(size, bitcount, masks, data):
+    """An uncompressed DDS file with the given channel masks."""
+    pixel_flags = 0x40 | (0x1 if len(masks) == 4 else 0) # DDPF.RGB, DDPF.ALPHAPIXELS
+    header = struct.pack('<7I', 124, 0x1007, size[1], size[0], 0, 0, 0) + bytes(44)
+    header += struct.pack('<4I', 32, pixel_flags, 0, bitcount)
+    header += struct.pack('<4I', *masks, *[0] * (4 - len(masks)))
+    header += struct.pack('<5I', 0x1000, 0, 0, 0, 0)
+    return b'DDS ' + header + data
+
+
+def masked_reference(data, bytecount, masks):
+    # Output of the previous per-pixel decoder
+    out = bytearray()
+    for i in range(0, len(data), bytecount):
+        value = int.from_bytes(data[i : i + bytecount], 'little')
+        for mask in masks:
+            offset = 0
+            while mask >> (offset + 1) << (offset + 1) == mask:
+                offset += 1
+            out.append(int((((value & mask) >> offset) / (mask >> offset)) * 255))
+    return bytes(out)
+
+
+@pytest.fixture(params=['numpy', 'no-numpy'])
+def numpy_available(request, monkeypatch):
+    if request.param == 'no-numpy':
+        monkeypatch.setitem(sys.modules, 'numpy', None)
+    return request.param
+
+
+@pytest.mark.parametrize('pixel_format, alpha_encoding, alpha_depth', [('DXT1', 0, 0), ('DXT1', 0, 1), ('DXT3', 1, 8), ('DXT5', 7, 8)])
+@pytest.mark.parametrize('size', [(64, 32), (37, 21)])
+def test_blp_dxt_matches_dds(pixel_format, alpha_encoding, alpha_depth, size):
+    im = gradient('RGBA', size)
+    im.putalpha(Image.linear_gradient('L').resize(size))
+    dds = encode(im, 'DDS', pixel_format=pixel_format)
+    with Image.open(io.BytesIO(blp2_dxt(size, alpha_encoding, alpha_depth, dds[DDS_HEADER_SIZE:]))) as blp:
+        with Image.open(io.BytesIO(dds)) as expected:
+            expected.load()
+            if not alpha_depth:
+                expected = expected.convert('RGB')
+            assert blp.mode == expected.mode
+            assert blp.tobytes() == expected.tobytes()
+
+
+@pytest.mark.parametrize('pixel_format, alpha_encoding, decode_dxt', [
+    ('DXT1', 0, functools.partial(BlpImagePlugin.decode_dxt1, alpha=True)),
+    ('DXT3', 1, BlpImagePlugin.decode_dxt3),
+    ('DXT5', 7, BlpImagePlugin.decode_dxt5),
+])
+def test_blp_dxt_close_to_python_decoder(pixel_format, alpha_encoding, decode_dxt):
+    # The Python decoder expands 565 colors differently, by up to 7 levels
+    size = (32, 16)
+    blocks = encode(gradient('RGBA', size), 'DDS', pixel_format=pixel_format)[DDS_HEADER_SIZE:]
+    linesize = len(blocks) // (size[1] // 4)
+    rows = [row for y in range(0, len(blocks), linesize) for row in decode_dxt(blocks[y : y + linesize])]
+    previous = Image.frombytes('RGBA', size, b''.join(rows))
+    with Image.open(io.BytesIO(blp2_dxt(size, alpha_encoding, 8, blocks))) as blp:
+        assert max(high for _, high in ImageChops.difference(blp, previous).getextrema()) <= 7
+
+
+def test_blp_dxt_truncated():
+    blocks = encode(gradient('RGBA', (32, 16)), 'DDS', pixel_format='DXT5')[DDS_HEADER_SIZE:]
+    with Image.open(io.BytesIO(blp2_dxt((32, 16), 7, 8, blocks[:-1]))) as im:
+        with pytest.raises(OSError):
+            im.load()
+
+
+@pytest.mark.parametrize('blp_version', ['BLP1', 'BLP2'])
+def test_blp_palette_round_trip(blp_version):
+    im = gradient('RGB', (37, 21)).quantize(64)
+    with Image.open(io.BytesIO(encode(im, 'BLP', blp_version=blp_version))) as reloaded:
+        assert reloaded.convert('RGB').tobytes() == im.convert('RGB').tobytes()
+
+
+@pytest.mark.parametrize('bitcount, masks', [
+    (16, (0xF800, 0x07E0, 0x001F)), # 565
+    (16, (0x0F00, 0x00F0, 0x000F, 0xF000)), # 4444
+    (16, (0x7C00, 0x03E0, 0x001F, 0x8000)), # 1555
+    (24, (0xFFF000, 0x000FC0, 0x00003F)),
+    (24, (0xFF0000, 0x00FF00, 0x0000FF)), # BGR
+    (32, (0x000003FF, 0x000FFC00, 0x3FF00000, 0xC0000000)), # 10:10:10:2
+    (32, (0x000000FF, 0x0000FF00, 0x00FF0000, 0xFF000000)), # RGBA
+    (32, (0x00FF0000, 0x0000FF00, 0x000000FF)), # BGRX
+])
+def test_dds_masked_matches_previous_decoder(bitcount, masks, numpy_available):
+    bytecount = bitcount // 8
+    size = (256, 256) if bitcount == 16 else (97, 61)
+    if bitcount == 16:
+        data = struct.pack('<65536H', *range(65536)) # Every value
+    else:
+        data = random.Random(bitcount).randbytes(size[0] * size[1] * bytecount)
+    with Image.open(io.BytesIO(dds_masked(size, bitcount, masks, data))) as im:
+        assert im.mode == ('RGBA' if len(masks) == 4 else 'RGB')
+        assert im.tobytes() == masked_reference(data, bytecount, masks)
+
+
+@pytest.mark.parametrize('bitcount, masks', [
+    (16, (0xF800, 0x07E0, 0x001F)), # 565
+    (16, (0x0F00, 0x00F0, 0x000F, 0xF000)), # 4444
+    (32, (0x000000FF, 0x0000FF00, 0x00FF0000, 0xFF000000)), # RGBA
+])
+def test_dds_masked_truncated(bitcount, masks, monkeypatch):
+    size = (100, 100)
+    bytecount = bitcount // 8
+    data = random.Random(bitcount).randbytes(size[0] * size[1] * bytecount)
+    cut = dds_masked(size, bitcount, masks, data)[: -1000 * bytecount - 1]
+    with Image.open(io.BytesIO(cut)) as im:
+        with pytest.raises(OSError, match='truncated'):
+            im.load()
+
+    monkeypatch.setattr(ImageFile, 'LOAD_TRUNCATED_IMAGES', True)
+    with Image.open(io.BytesIO(cut)) as im:
+        im.load()
+        # Read as far as the data goes, the rest left 0 as before
+        padded = data[: -1000 * bytecount - 1] + bytes(1000 * bytecount + 1)
+        assert im.tobytes() == masked_reference(padded, bytecount, masks)
@@ -0,0 +1,127 @@
+import io
+import random
+import struct
+
+import pytest
+from PIL import BmpImagePlugin, Image, ImageFile
+
+EOL = b'\0\0'
+EOB = b'\0\1'
+
+
+def bmp_rle(size, bits, data):
+    """An RLE8 (bits=8) or RLE4 (bits=4) BMP with the given bitmap data."""
+    colors = 1 << bits
+    # Not greyscale, so the image is P and tobytes() gives the indices
+    bgrx = b''.join(bytes((i % 256, 255 - i % 256, i // 2, 0)) for i in range(colors))
+    offset = 14 + 40 + len(bgrx)
+    compression = 2 if bits == 4 else 1
+    header = struct.pack('<2sIHHI', b'BM', offset + len(data), 0, 0, offset)
+    info = struct.pack('<IiiHHIIiiII', 40, *size, 1, bits, compression, len(data), 2835, 2835, colors, 0)
+    return header + info + bgrx + data
+
+
+def rle_encode(rows, rle4):
+    # Encoded runs for 3 or more equal pixels, absolute runs for the rest
+    out = bytearray()
+    for row in rows:
+        x = 0
+        while x < len(row):
+            run = 1
+            while x + run < len(row) and run < 255 and row[x + run] == row[x]:
+                run += 1
+            if run >= 3 or len(row) - x < 3:
+                out += bytes((run, row[x] * 17 if rle4 else row[x]))
+                x += run
+                continue
+            end = x + 3
+            while end < len(row) and end - x < 255 and not (end + 2 < len(row) and row[end] == row[end + 1] == row[end + 2]):
+                end += 1
+            literal = row[x:end]
+            if rle4:
+                literal += b'\0' * (len(literal) & 1)
+                packed = bytes(literal[i] << 4 | literal[i + 1] for i in range(0, len(literal), 2))
+            else:
+                packed = literal
+            out += bytes((0, end - x)) + packed + b'\0' * (len(packed) & 1)
+            x = end
+        out += EOL
+    return bytes(out + EOB)
+
+
+def indices(size, bits, seed):
+    # Flat areas with noisy stretches, like a quantized screenshot
+    rng = random.Random(seed)
+    rows = []
+    for _ in range(size[1]):
+        row = bytearray()
+        while len(row) < size[0]:
+            value = rng.randrange(1 << bits)
+            row += bytes((value,)) * rng.choice([1, 1, 2, 5, 40, 300])
+        rows.append(bytes(row[: size[0]]))
+    return rows
+
+
+def load(data):
+    with Image.open(io.BytesIO(data)) as im:
+        im.load()
+        return im.tobytes()
+
+
+@pytest.fixture(params=[1 << 16, 7], ids=['one-read', 'small-reads'])
+def read_size(request, monkeypatch):
+    # Small reads split ops across chunks
+    monkeypatch.setattr(BmpImagePlugin, '_READ_SIZE', request.param)
+    return request.param
+
+
+@pytest.mark.parametrize('bits', [4, 8])
+@pytest.mark.parametrize('size', [(1, 1), (97, 61), (640, 50)])
+def test_round_trip(bits, size, read_size):
+    rows = indices(size, bits, seed=size[0])
+    data = bmp_rle(size, bits, rle_encode(rows, bits == 4))
+    assert load(data) == b''.join(reversed(rows)) # Bottom-up
+
+
+@pytest.mark.parametrize('bits', [4, 8])
+def test_delta_and_end_of_line(bits, read_size):
+    value = 0x33 if bits == 4 else 3
+    # Two pixels, delta 3 right and 1 up, one pixel, end of line, a full row
+    data = bytes((2, value)) + b'\0\2\3\1' + bytes((1, value)) + EOL + bytes((8, value)) + EOB
+    file_rows = [
+        bytes((3, 3, 0, 0, 0, 0, 0, 0)),
+        bytes((0, 0, 0, 0, 0, 3, 0, 0)),
+        bytes((3,)) * 8,
+    ]
+    assert load(bmp_rle((8, 3), bits, data)) == b''.join(reversed(file_rows))
+
+
+@pytest.mark.parametrize('bits', [4, 8])
+def test_early_end_of_bitmap(bits):
+    data = bytes((3, 0x33 if bits == 4 else 3)) + EOB
+    assert load(bmp_rle((4, 2), bits, data)) == bytes((0, 0, 0, 0, 3, 3, 3, 0))
+
+
+def test_rle4_odd_absolute_run():
+    # Five pixels in three bytes, plus one byte of padding to a word boundary
+    data = b'\0\5\x12\x34\x50\0' + b'\1\x66' + EOL + EOB
+    assert load(bmp_rle((6, 1), 4, data)) == bytes((1, 2, 3, 4, 5, 6))
+
+
+def test_runs_are_clipped_to_the_row():
+    data = bytes((6, 5)) + EOL + b'\0\5\1\2\3\4\5\0' + EOL + EOB
+    assert load(bmp_rle((4, 2), 8, data)) == bytes((1, 2, 3, 4, 5, 5, 5, 5))
+
+
+def test_truncated(monkeypatch):
+    rows = indices((50, 20), 8, seed=1)
+    data = bmp_rle((50, 20), 8, rle_encode(rows, False))
+    with Image.open(io.BytesIO(data[:-40])) as im:
+        with pytest.raises(OSError, match='truncated'):
+            im.load()
+
+    monkeypatch.setattr(ImageFile, 'LOAD_TRUNCATED_IMAGES', True)
+    decoded = load(data[:-40])
+    expected = b''.join(reversed(rows))
+    assert len(decoded) == len(expected)
+    assert decoded.endswith(expected[-50 * 10 :])
@@ -0,0 +1,108 @@
+import gzip
+import io
+import random
+import struct
+
+import pytest
+from PIL import FitsImagePlugin, Image, ImageFile
+
+
+def fits_cards(*cards):
+    header = b''.join(f'{keyword:<8}= {value:>20}'.encode().ljust(80) for keyword, value in cards)
+    header += b'END'.ljust(80)
+    return header.ljust(-(-len(header) // 2880) * 2880)
+
+
+def fits_gzip(size, bits, values, rows_per_tile=1, padding=b''):
+    """A tile compressed (GZIP_1) FITS image of 4 byte big endian values."""
+    width, height = size
+    tiles = []
+    for y in range(0, height, rows_per_tile):
+        tile = values[y * width : (y + rows_per_tile) * width]
+        tiles.append(gzip.compress(struct.pack(f'>{len(tile)}i', *tile)) + padding)
+    primary = fits_cards(('SIMPLE', 'T'), ('BITPIX', 8), ('NAXIS', 0))
+    table = fits_cards(
+        ('XTENSION', "'BINTABLE'"), ('BITPIX', 8), ('NAXIS', 2), ('NAXIS1', 8), ('NAXIS2', len(tiles)),
+        ('ZIMAGE', 'T'), ('ZBITPIX', bits), ('ZNAXIS', 2), ('ZNAXIS1', width), ('ZNAXIS2', height),
+        ('ZCMPTYPE', "'GZIP_1  '"),
+    )
+    descriptors = b''
+    heap_offset = 0
+    for tile in tiles:
+        descriptors += struct.pack('>2i', len(tile), heap_offset)
+        heap_offset += len(tile)
+    data = descriptors + b''.join(tiles)
+    return primary + table + data.ljust(-(-len(data) // 2880) * 2880, b'\0')
+
+
+def previous_decoder(size, bits, values):
+    # Output of the previous decoder: the low bytes of each value, bottom row first
+    width, height = size
+    raw = struct.pack(f'>{len(values)}i', *values)
+    keep = bits // 8
+    rows = [
+        b''.join(raw[(y * width + x) * 4 + 4 - keep : (y * width + x + 1) * 4] for x in range(width))
+        for y in range(height)
+    ]
+    mode = {8: 'L', 16: 'I;16', 32: 'I'}[bits]
+    return Image.frombytes(mode, size, b''.join(reversed(rows))).tobytes()
+
+
+def random_values(size, bits, seed=0):
+    rng = random.Random(seed)
+    low, high = (0, 255) if bits == 8 else (-(1 << (bits - 1)), (1 << (bits - 1)) - 1)
+    return [rng.randint(low, high) for _ in range(size[0] * size[1])]
+
+
+@pytest.fixture(params=['default', 'small'])
+def block_sizes(request, monkeypatch):
+    # Small reads and bands split gzip members and rows across calls
+    if request.param == 'small':
+        monkeypatch.setattr(FitsImagePlugin, '_READ_SIZE', 100)
+        monkeypatch.setattr(ImageFile, 'SAFEBLOCK', 1000)
+    return request.param
+
+
+@pytest.mark.parametrize('bits', [8, 16, 32])
+@pytest.mark.parametrize('rows_per_tile, padding', [(1, b''), (7, b''), (1000, b''), (3, bytes(5))])
+def test_matches_previous_decoder(bits, rows_per_tile, padding, block_sizes):
+    size = (53, 41)
+    values = random_values(size, bits)
+    data = fits_gzip(size, bits, values, rows_per_tile, padding)
+    with Image.open(io.BytesIO(data)) as im:
+        assert im.size == size
+        assert im.tobytes() == previous_decoder(size, bits, values)
+
+
+def test_rows_are_bottom_up():
+    values = [1] * 4 + [2] * 4 + [3] * 4
+    with Image.open(io.BytesIO(fits_gzip((4, 3), 8, values))) as im:
+        assert im.mode == 'L'
+        assert list(im.getdata()) == [3] * 4 + [2] * 4 + [1] * 4
+
+
+def test_truncated(monkeypatch):
+    size = (53, 41)
+    values = random_values(size, 8)
+    data = fits_gzip(size, 8, values)
+    # Cut within the tiles, past the header units and the descriptors
+    cut = data[: 2880 * 2 + 41 * 8 + 20 * 240]
+    with Image.open(io.BytesIO(cut)) as im:
+        with pytest.raises(OSError, match='truncated'):
+            im.load()
+
+    monkeypatch.setattr(ImageFile, 'LOAD_TRUNCATED_IMAGES', True)
+    with Image.open(io.BytesIO(cut)) as im:
+        im.load()
+        decoded = im.tobytes()
+    expected = previous_decoder(size, 8, values)
+    # Bottom rows decoded, top rows left 0
+    assert decoded[:53] == bytes(53)
+    assert decoded[-53 * 5 :] == expected[-53 * 5 :]
+
+
+def test_unsupported_bitpix():
+    data = fits_gzip((4, 3), -32, [0] * 12)
+    with Image.open(io.BytesIO(data)) as im:
+        with pytest.raises(ValueError, match='Unsupported BITPIX'):
+            im.load()
@@ -0,0 +1,176 @@
+import base64
+import json
+import urllib.parse
+
+import pytest
+from botocore.stub import ANY, Stubber
+
+from conftest import load_lambda
+
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def generate_url_lambda():
+    return load_lambda('generateUrlLambda')
+
+
+@pytest.fixture
+def stubber(generate_url_lambda):
+    # Presigning is local; only calls that reach S3 go through the stubber
+    with Stubber(generate_url_lambda.s3_client) as stubber:
+        yield stubber
+        stubber.assert_no_pending_responses()
+
+
+def post(generate_url_lambda, body, path='/generate-upload-url'):
+    event = {
+        'rawPath': path,
+        'requestContext': {'http': {'method': 'POST'}},
+        'body': json.dumps(body),
+    }
+    response = generate_url_lambda.lambda_handler(event, None)
+    return response['statusCode'], json.loads(response['body'])
+
+
+def expect_create_multipart_upload(generate_url_lambda, stubber, upload_id):
+    stubber.add_response(
+        'create_multipart_upload',
+        {'Bucket': generate_url_lambda.UPLOAD_BUCKET, 'Key': 'key', 'UploadId': upload_id},
+    )
+
+
+def test_batch_failure_aborts_started_multipart_uploads(generate_url_lambda, stubber):
+    expect_create_multipart_upload(generate_url_lambda, stubber, 'upload-1')
+    expect_create_multipart_upload(generate_url_lambda, stubber, 'upload-2')
+    for upload_id in ('upload-1', 'upload-2'):
+        stubber.add_response('abort_multipart_upload', {}, {
+            'Bucket': generate_url_lambda.UPLOAD_BUCKET,
+            'Key': ANY,
+            'UploadId': upload_id,
+        })
+    status, body = post(generate_url_lambda, {'files': [
+        {'filename': 'a.png', 'contentType': 'image/png', 'fileSize': 150 * MB},
+        {'filename': 'b.png', 'contentType': 'image/png', 'fileSize': 120 * MB},
+        {'filename': 'c.txt', 'contentType': 'text/plain'},
+    ]})
+    assert status == 400
+    assert 'text/plain' in body['message']
+
+
+def test_batch_abort_errors_keep_original_failure(generate_url_lambda, stubber):
+    expect_create_multipart_upload(generate_url_lambda, stubber, 'upload-1')
+    stubber.add_client_error('abort_multipart_upload', 'NoSuchUpload')
+    status, body = post(generate_url_lambda, {'files': [
+        {'contentType': 'image/png', 'fileSize': 150 * MB},
+        {'contentType': 'text/plain'},
+    ]})
+    assert status == 400
+
+
+def test_batch_signs_every_entry(generate_url_lambda, stubber):
+    expect_create_multipart_upload(generate_url_lambda, stubber, 'upload-1')
+    status, body = post(generate_url_lambda, {'files': [
+        {'filename': 'a.png', 'contentType': 'image/png', 'fileSize': 150 * MB},
+        {'filename': 'b.jpg', 'contentType': 'image/jpeg', 'uploadMethod': 'POST'},
+    ]})
+    assert status == 200
+    multipart, form = body['uploads']
+    assert multipart['uploadId'] == 'upload-1'
+    assert [part['partNumber'] for part in multipart['parts']] == list(range(1, len(multipart['parts']) + 1))
+    assert form['key'].endswith('-b.jpg') and 'fields' in form
+
+
+def test_complete_upload_sorts_parts(generate_url_lambda, stubber):
+    stubber.add_response('complete_multipart_upload', {}, {
+        'Bucket': generate_url_lambda.UPLOAD_BUCKET,
+        'Key': 'key',
+        'UploadId': 'upload-1',
+        'MultipartUpload': {'Parts': [{'PartNumber': 1, 'ETag': '"a"'}, {'PartNumber': 2, 'ETag': '"b"'}]},
+    })
+    status, body = post(generate_url_lambda, {
+        'key': 'key',
+        'uploadId': 'upload-1',
+        'parts': [{'partNumber': 2, 'eTag': '"b"'}, {'partNumber': '1', 'eTag': '"a"'}],
+    }, path='/complete-upload')
+    assert (status, body) == (200, {'key': 'key'})
+
+
+@pytest.mark.parametrize('parts', [
+    [],
+    ['1'],
+    [{'eTag': '"a"'}],
+    [{'partNumber': 1}],
+    [{'partNumber': 1, 'eTag': ''}],
+    [{'partNumber': 0, 'eTag': '"a"'}],
+    [{'partNumber': 10001, 'eTag': '"a"'}],
+    [{'partNumber': 1.5, 'eTag': '"a"'}],
+    [{'partNumber': True, 'eTag': '"a"'}],
+    [{'partNumber': 1, 'eTag': '"a"'}, {'partNumber': 1, 'eTag': '"b"'}],
+])
+def test_complete_upload_rejects_malformed_parts(generate_url_lambda, stubber, parts):
+    status, body = post(generate_url_lambda, {'key': 'key', 'uploadId': 'upload-1', 'parts': parts}, path='/complete-upload')
+    assert status == 400
+    assert 'error' not in body
+
+
+def signed_params(generate_url_lambda, monkeypatch):
+    """Records the Params of every URL the Lambda presigns."""
+    calls = []
+    sign = generate_url_lambda.s3_client.generate_presigned_url
+
+    def record(ClientMethod, Params, **kwargs):
+        calls.append((ClientMethod, Params))
+        return sign(ClientMethod=ClientMethod, Params=Params, **kwargs)
+
+    monkeypatch.setattr(generate_url_lambda.s3_client, 'generate_presigned_url', record)
+    return calls
+
+
+def test_upload_defaults_to_size_limited_post(generate_url_lambda):
+    status, body = post(generate_url_lambda, {'filename': 'a.png', 'contentType': 'image/png'})
+    assert status == 200
+    assert body['fields']['Content-Type'] == 'image/png'
+    policy = json.loads(base64.b64decode(body['fields']['policy']))
+    assert ['content-length-range', 1, generate_url_lambda.MAX_UPLOAD_BYTES] in policy['conditions']
+
+
+def test_put_url_is_signed_for_file_size(generate_url_lambda, monkeypatch):
+    calls = signed_params(generate_url_lambda, monkeypatch)
+    status, body = post(generate_url_lambda, {'contentType': 'image/png', 'fileSize': 12345, 'uploadMethod': 'PUT'})
+    assert status == 200
+    assert calls[0][1]['ContentLength'] == 12345
+    query = urllib.parse.parse_qs(urllib.parse.urlsplit(body['uploadUrl']).query)
+    assert 'content-length' in query['X-Amz-SignedHeaders'][0].split(';')
+    # A fileSize alone also selects PUT
+    assert 'fields' not in post(generate_url_lambda, {'contentType': 'image/png', 'fileSize': 12345})[1]
+
+
+def test_put_requires_file_size(generate_url_lambda):
+    status, body = post(generate_url_lambda, {'contentType': 'image/png', 'uploadMethod': 'PUT'})
+    assert status == 400
+    assert 'fileSize' in body['message']
+
+
+@pytest.mark.parametrize('file_size', ['5e9', '1000', 1000.0, 5e9, -1, 0, True, 256 * MB + 1])
+def test_invalid_file_size_is_rejected(generate_url_lambda, file_size):
+    status, body = post(generate_url_lambda, {'contentType': 'image/png', 'fileSize': file_size})
+    assert status == 400
+    assert 'fileSize' in body['message']
+
+
+def test_unknown_upload_method_is_rejected(generate_url_lambda):
+    status, _ = post(generate_url_lambda, {'contentType': 'image/png', 'fileSize': 10, 'uploadMethod': 'PATCH'})
+    assert status == 400
+
+
+def test_multipart_part_urls_are_signed_for_part_lengths(generate_url_lambda, stubber, monkeypatch):
+    calls = signed_params(generate_url_lambda, monkeypatch)
+    expect_create_multipart_upload(generate_url_lambda, stubber, 'upload-1')
+    file_size = 150 * MB + 7
+    status, body = post(generate_url_lambda, {'contentType': 'image/png', 'fileSize': file_size})
+    assert status == 200
+    lengths = [params['ContentLength'] for _, params in calls]
+    assert len(lengths) == len(body['parts'])
+    assert sum(lengths) == file_size
+    assert all(length == body['partSize'] for length in lengths[:-1])
@@ -0,0 +1,225 @@
+import json
+
+import pytest
+
+from conftest import load_lambda
+
+
+@pytest.fixture
+def get_url_lambda(s3):
+    module = load_lambda('getUrlLambda')
+    module.s3_client = s3
+    return module
+
+
+class Context:
+    def __init__(self, remaining_ms):
+        self.remaining_ms = remaining_ms
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_ms
+
+
+def get(get_url_lambda, params, path='/get-processed-url', context=None):
+    response = get_url_lambda.lambda_handler({'rawPath': path, 'queryStringParameters': params}, context)
+    return response['statusCode'], json.loads(response['body'])
+
+
+def put_rendition(s3, get_url_lambda, key):
+    s3.put_object(Bucket=get_url_lambda.PROCESSED_BUCKET, Key=key, Body=b'rendition', ContentType='image/jpeg')
+
+
+def put_status(s3, get_url_lambda, key, record):
+    s3.put_object(
+        Bucket=get_url_lambda.STATUS_BUCKET,
+        Key=f'{get_url_lambda.STATUS_PREFIX}{key}.json',
+        Body=json.dumps(record).encode(),
+        ContentType='application/json',
+    )
+
+
+def succeeded(get_url_lambda, key, rendition_key):
+    return {'key': key, 'status': 'succeeded', 'renditions': [{'bucket': get_url_lambda.PROCESSED_BUCKET, 'key': rendition_key}]}
+
+
+def test_status_of_processed_upload(s3, get_url_lambda):
+    put_rendition(s3, get_url_lambda, 'photo.jpg')
+    put_status(s3, get_url_lambda, 'photo.jpg', succeeded(get_url_lambda, 'photo.jpg', 'photo.jpg'))
+    status, body = get(get_url_lambda, {'key': 'photo.jpg', 'wait': '0'}, '/processing-status')
+    assert status == 200
+    assert body['status'] == 'succeeded'
+    assert '/photo.jpg?' in body['processedUrl']
+
+
+def test_status_of_failed_upload(s3, get_url_lambda):
+    put_status(s3, get_url_lambda, 'bad.jpg', {'key': 'bad.jpg', 'status': 'failed', 'renditions': [], 'error': 'cannot identify image file'})
+    status, body = get(get_url_lambda, {'key': 'bad.jpg', 'wait': '0'}, '/processing-status')
+    assert status == 200
+    assert body['status'] == 'failed'
+    assert 'processedUrl' not in body
+
+
+def test_status_of_upload_with_missing_rendition(s3, get_url_lambda):
+    put_status(s3, get_url_lambda, 'photo.jpg', succeeded(get_url_lambda, 'photo.jpg', 'photo.jpg'))
+    status, body = get(get_url_lambda, {'key': 'photo.jpg', 'wait': '0'}, '/processing-status')
+    assert status == 202
+    assert body == {'key': 'photo.jpg', 'status': 'pending'}
+
+
+def test_status_pending(get_url_lambda, monkeypatch):
+    monkeypatch.setattr(get_url_lambda.time, 'sleep', lambda seconds: pytest.fail('waited with wait=0'))
+    status, body = get(get_url_lambda, {'key': 'photo.jpg', 'wait': '0'}, '/processing-status')
+    assert status == 202
+    assert body == {'key': 'photo.jpg', 'status': 'pending'}
+
+
+def test_status_long_polls_until_the_record_appears(s3, get_url_lambda, monkeypatch):
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        if len(sleeps) == 2:
+            put_rendition(s3, get_url_lambda, 'photo.jpg')
+            put_status(s3, get_url_lambda, 'photo.jpg', succeeded(get_url_lambda, 'photo.jpg', 'photo.jpg'))
+
+    monkeypatch.setattr(get_url_lambda.time, 'sleep', sleep)
+    status, body = get(get_url_lambda, {'key': 'photo.jpg', 'wait': '10'}, '/processing-status')
+    assert status == 200
+    assert body['status'] == 'succeeded'
+    assert sleeps == [get_url_lambda.STATUS_POLL_INTERVAL_SECONDS] * 2
+
+
+def test_status_wait_is_bounded_by_the_lambda_timeout(get_url_lambda, monkeypatch):
+    # A second is left to respond, so with a second remaining there is no polling
+    monkeypatch.setattr(get_url_lambda.time, 'sleep', lambda seconds: pytest.fail('waited past the timeout'))
+    status, _ = get(get_url_lambda, {'key': 'photo.jpg', 'wait': '10'}, '/processing-status', Context(1000))
+    assert status == 202
+
+
+def test_missing_key_is_rejected(get_url_lambda):
+    for path in ('/get-processed-url', '/processing-status'):
+        status, body = get(get_url_lambda, {}, path)
+        assert status == 400
+        assert 'key' in body['message']
+
+
+def count_head_object(s3, monkeypatch):
+    calls = []
+    head_object = s3.head_object
+    monkeypatch.setattr(s3, 'head_object', lambda **kwargs: calls.append(kwargs['Key']) or head_object(**kwargs))
+    return calls
+
+
+def test_processed_url(s3, get_url_lambda):
+    status, body = get(get_url_lambda, {'key': 'photo.jpg'})
+    assert status == 404
+    put_rendition(s3, get_url_lambda, 'photo.jpg')
+    status, body = get(get_url_lambda, {'key': 'photo.jpg'})
+    assert status == 200
+    assert '/photo.jpg?' in body['processedUrl']
+
+
+def test_processed_url_is_reused(s3, get_url_lambda, monkeypatch):
+    put_rendition(s3, get_url_lambda, 'photo.jpg')
+    calls = count_head_object(s3, monkeypatch)
+    first = get(get_url_lambda, {'key': 'photo.jpg'})
+    second = get(get_url_lambda, {'key': 'photo.jpg'})
+    assert first == second
+    assert calls == ['photo.jpg']
+
+
+def test_missing_object_is_not_cached(s3, get_url_lambda, monkeypatch):
+    calls = count_head_object(s3, monkeypatch)
+    assert get(get_url_lambda, {'key': 'photo.jpg'})[0] == 404
+    put_rendition(s3, get_url_lambda, 'photo.jpg')
+    assert get(get_url_lambda, {'key': 'photo.jpg'})[0] == 200
+    assert calls == ['photo.jpg', 'photo.jpg']
+
+
+def test_url_close_to_expiry_is_checked_again(s3, get_url_lambda, monkeypatch):
+    monkeypatch.setattr(get_url_lambda, 'URL_CACHE_MARGIN_SECONDS', get_url_lambda.URL_EXPIRATION_SECONDS)
+    put_rendition(s3, get_url_lambda, 'photo.jpg')
+    calls = count_head_object(s3, monkeypatch)
+    get(get_url_lambda, {'key': 'photo.jpg'})
+    s3.objects.clear() # Deleted since
+    assert get(get_url_lambda, {'key': 'photo.jpg'})[0] == 404
+    assert calls == ['photo.jpg', 'photo.jpg']
+
+
+def test_url_cache_is_bounded(s3, get_url_lambda, monkeypatch):
+    monkeypatch.setattr(get_url_lambda, 'URL_CACHE_MAX_ENTRIES', 2)
+    for key in ('a.jpg', 'b.jpg', 'c.jpg'):
+        put_rendition(s3, get_url_lambda, key)
+        get(get_url_lambda, {'key': key})
+    assert list(get_url_lambda.url_cache) == [(get_url_lambda.PROCESSED_BUCKET, 'b.jpg'), (get_url_lambda.PROCESSED_BUCKET, 'c.jpg')]
+
+
+def test_head_object_errors_are_reported(s3, get_url_lambda, monkeypatch):
+    def head_object(**kwargs):
+        raise s3.exceptions.ClientError({'Error': {'Code': '403', 'Message': 'Forbidden'}}, 'HeadObject')
+
+    monkeypatch.setattr(s3, 'head_object', head_object)
+    status, body = get(get_url_lambda, {'key': 'photo.jpg'})
+    assert status == 500
+    assert body['message'] == 'Error generating processed URL'
+
+
+@pytest.mark.parametrize('request_keys', ['query', 'body'])
+def test_batch_lookup(s3, get_url_lambda, request_keys):
+    put_rendition(s3, get_url_lambda, 'a.jpg')
+    put_rendition(s3, get_url_lambda, 'c.jpg')
+    keys = ['c.jpg', 'b.jpg', 'a.jpg', 'c.jpg']
+    if request_keys == 'query':
+        event = {'rawPath': '/get-processed-url', 'queryStringParameters': {'keys': ','.join(keys)}}
+    else:
+        event = {'rawPath': '/get-processed-url', 'body': json.dumps({'keys': keys})}
+    response = get_url_lambda.lambda_handler(event, None)
+    assert response['statusCode'] == 200
+    results = json.loads(response['body'])['results']
+    assert [result['key'] for result in results] == keys
+    assert [result['status'] for result in results] == ['found', 'missing', 'found', 'found']
+    assert '/a.jpg?' in results[2]['processedUrl']
+
+
+def test_batch_reports_errors_per_key(s3, get_url_lambda, monkeypatch):
+    put_rendition(s3, get_url_lambda, 'a.jpg')
+    head_object = s3.head_object
+
+    def failing_head_object(**kwargs):
+        if kwargs['Key'] == 'b.jpg':
+            raise s3.exceptions.ClientError({'Error': {'Code': '403', 'Message': 'Forbidden'}}, 'HeadObject')
+        return head_object(**kwargs)
+
+    monkeypatch.setattr(s3, 'head_object', failing_head_object)
+    status, body = get(get_url_lambda, {'keys': 'a.jpg,b.jpg'})
+    assert status == 200
+    assert [result['status'] for result in body['results']] == ['found', 'error']
+
+
+@pytest.mark.parametrize('keys', [[], [''], [1], 'a.jpg', ['k'] * 101])
+def test_batch_rejects_invalid_keys(get_url_lambda, keys):
+    response = get_url_lambda.lambda_handler({'rawPath': '/get-processed-url', 'body': json.dumps({'keys': keys})}, None)
+    assert response['statusCode'] == 400
+
+
+def test_content_addressed_rendition_is_found_through_the_record(s3, get_url_lambda):
+    put_rendition(s3, get_url_lambda, 'renditions/abc/256x171-q90.jpeg')
+    put_status(s3, get_url_lambda, 'photo.jpg', succeeded(get_url_lambda, 'photo.jpg', 'renditions/abc/256x171-q90.jpeg'))
+    status, body = get(get_url_lambda, {'key': 'photo.jpg'})
+    assert status == 200
+    assert '/renditions/abc/256x171-q90.jpeg?' in body['processedUrl']
+
+
+def test_content_addressed_url_is_reused(s3, get_url_lambda, monkeypatch):
+    put_rendition(s3, get_url_lambda, 'renditions/abc/256x171-q90.jpeg')
+    put_status(s3, get_url_lambda, 'photo.jpg', succeeded(get_url_lambda, 'photo.jpg', 'renditions/abc/256x171-q90.jpeg'))
+    calls = count_head_object(s3, monkeypatch)
+    read_status = get_url_lambda.read_status
+    monkeypatch.setattr(get_url_lambda, 'read_status', lambda key: calls.append(f'status of {key}') or read_status(key))
+    first = get(get_url_lambda, {'key': 'photo.jpg'})
+    second = get(get_url_lambda, {'key': 'photo.jpg'})
+    assert first == second
+    assert calls == ['photo.jpg', 'status of photo.jpg', 'renditions/abc/256x171-q90.jpeg']
+    # Cached until the rendition's URL is no longer reused
+    assert get_url_lambda.url_cache[(get_url_lambda.PROCESSED_BUCKET, 'photo.jpg')] == \
+        get_url_lambda.url_cache[(get_url_lambda.PROCESSED_BUCKET, 'renditions/abc/256x171-q90.jpeg')]
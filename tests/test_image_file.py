@@ -0,0 +1,216 @@
+import io
+import mmap
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from PIL import Image, ImageFile
+
+from conftest import encode, gradient
+
+
+class BufferDecoder(ImageFile.PyDecoder):
+    """Hands the raw data it is given in args over with set_as_buffer()."""
+
+    _pulls_fd = True
+
+    def decode(self, buffer):
+        data, rawmode, orientation = self.args
+        self.set_as_buffer(bytearray(data), rawmode, orientation)
+        return -1, 0
+
+
+Image.register_decoder('test_buffer', BufferDecoder)
+
+
+class BufferImageFile(ImageFile.ImageFile):
+    format = 'TEST'
+
+    def _open(self):
+        self._mode, self._size, tile_args, extents = self.fp.image_args
+        self.tile = [ImageFile._Tile('test_buffer', extents or (0, 0) + self.size, 0, tile_args)]
+
+
+def open_buffer(mode, size, data, rawmode, orientation=1, extents=None):
+    fp = io.BytesIO()
+    fp.image_args = (mode, size, (data, rawmode, orientation), extents)
+    return BufferImageFile(fp)
+
+
+def flip(im):
+    return im.transpose(Image.Transpose.FLIP_TOP_BOTTOM)
+
+
+@pytest.mark.parametrize('mode, rawmode', [
+    ('L', 'L'), ('P', 'P'), ('I;16', 'I;16'), ('I', 'I'), ('F', 'F'),
+    ('RGB', 'RGBX'), ('RGBA', 'RGBA'), ('CMYK', 'CMYK'),
+    ('RGB', 'RGB'), ('RGB', 'BGR'), ('LA', 'LA'), # Unpacked, not mapped
+])
+@pytest.mark.parametrize('orientation', [1, -1])
+def test_set_as_buffer_matches_set_as_raw(mode, rawmode, orientation):
+    size = (37, 21)
+    source = gradient('RGBA' if mode in ('RGBA', 'CMYK') else 'RGB', size).convert(mode)
+    data = source.tobytes('raw', rawmode)
+    with open_buffer(mode, size, data, rawmode, orientation) as im:
+        im.load()
+        expected = Image.frombytes(mode, size, data, 'raw', rawmode)
+        if orientation == -1:
+            expected = flip(expected)
+        assert im.tobytes() == expected.tobytes()
+
+        # The image is writable, and independent of the decoder's buffer
+        im.putpixel((0, 0), expected.getpixel((1, 1)))
+        assert im.getpixel((0, 0)) == expected.getpixel((1, 1))
+
+
+def test_set_as_buffer_palette():
+    source = gradient('RGB', (16, 8)).quantize(16)
+    fp = io.BytesIO()
+    fp.image_args = ('P', source.size, (source.tobytes(), 'P', 1), None)
+    with BufferImageFile(fp) as im:
+        im.palette = source.palette.copy()
+        im.load()
+        assert im.convert('RGB').tobytes() == source.convert('RGB').tobytes()
+
+
+def test_set_as_buffer_partial_tile():
+    # A tile that doesn't cover the image is unpacked into its extents
+    data = bytes(range(8 * 4))
+    with open_buffer('L', (8, 8), data, 'L', extents=(0, 2, 8, 6)) as im:
+        im.load()
+        assert im.tobytes() == bytes(16) + data + bytes(16)
+
+
+def test_set_as_buffer_short_data():
+    with open_buffer('L', (8, 8), bytes(63), 'L') as im:
+        with pytest.raises(ValueError, match='not enough image data'):
+            im.load()
+
+
+def test_frombytes_adopts_buffer():
+    source = gradient('RGB', (37, 21))
+    data = source.tobytes('raw', 'RGBX')
+    im = Image.frombytes('RGB', source.size, b'', 'test_buffer', (data, 'RGBX', 1))
+    assert im.tobytes() == source.tobytes()
+
+
+@pytest.fixture
+def ppm_file(tmp_path):
+    im = gradient('L', (67, 41))
+    path = tmp_path / 'image.pgm'
+    path.write_bytes(encode(im, 'PPM'))
+    return im, path
+
+
+def test_map_file_from_filename(ppm_file):
+    im, path = ppm_file
+    with Image.open(path) as reloaded:
+        reloaded.load()
+        assert isinstance(reloaded.map, mmap.mmap)
+        assert reloaded.tobytes() == im.tobytes()
+
+
+def test_map_file_from_bytesio(ppm_file):
+    im, path = ppm_file
+    data = path.read_bytes()
+    with Image.open(io.BytesIO(data)) as reloaded:
+        reloaded.load()
+        assert reloaded.map is not None
+        assert reloaded.tobytes() == im.tobytes()
+
+
+@pytest.mark.parametrize('buffering', [-1, 0])
+def test_map_file_from_file_object(ppm_file, buffering):
+    im, path = ppm_file
+    with open(path, 'rb', buffering=buffering) as fp:
+        with Image.open(fp) as reloaded:
+            reloaded.load()
+            assert isinstance(reloaded.map, mmap.mmap)
+            assert reloaded.tobytes() == im.tobytes()
+
+
+class Unmappable(io.RawIOBase):
+    def __init__(self, data):
+        self._data = io.BytesIO(data)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        return self._data.readinto(b)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self._data.seek(offset, whence)
+
+    def tell(self):
+        return self._data.tell()
+
+
+def test_unmappable_file_is_read(ppm_file):
+    im, path = ppm_file
+    with Image.open(Unmappable(path.read_bytes())) as reloaded:
+        reloaded.load()
+        assert reloaded.map is None
+        assert reloaded.tobytes() == im.tobytes()
+
+
+@pytest.mark.parametrize('source', ['bytesio', 'file'])
+def test_map_file_truncated(ppm_file, tmp_path, source):
+    im, path = ppm_file
+    data = path.read_bytes()[:-100]
+    if source == 'bytesio':
+        fp = io.BytesIO(data)
+    else:
+        truncated = tmp_path / 'truncated.pgm'
+        truncated.write_bytes(data)
+        fp = open(truncated, 'rb')
+    with fp, Image.open(fp) as reloaded:
+        with pytest.raises(OSError, match='truncated'):
+            reloaded.load()
+
+
+def test_profile(ppm_file):
+    _, path = ppm_file
+    with ImageFile.profile() as tiles:
+        with Image.open(Unmappable(path.read_bytes())) as im:
+            im.load()
+    assert [(tile.operation, tile.format, tile.codec_name) for tile in tiles] == [('decode', 'PPM', 'raw')]
+    assert not ImageFile._profile_hooks
+
+
+def test_profile_hook_unregistered_while_called(ppm_file):
+    _, path = ppm_file
+    calls = []
+
+    def once(tile):
+        calls.append('once')
+        ImageFile.unregister_profile_hook(once)
+
+    ImageFile.register_profile_hook(once)
+    with ImageFile.profile() as tiles:
+        for _ in range(2):
+            with Image.open(Unmappable(path.read_bytes())) as im:
+                im.load()
+    # The hook after it still sees every tile
+    assert calls == ['once']
+    assert len(tiles) == 2
+
+
+def test_profile_in_threads(ppm_file):
+    im, path = ppm_file
+    data = path.read_bytes()
+
+    def load(_):
+        with ImageFile.profile() as tiles:
+            for _ in range(20):
+                with Image.open(Unmappable(data)) as reloaded:
+                    reloaded.load()
+        return len(tiles)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        counts = list(executor.map(load, range(32)))
+    # Hooks are global, so a profile also collects tiles of other threads
+    assert min(counts) >= 20
+    assert not ImageFile._profile_hooks
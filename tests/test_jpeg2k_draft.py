@@ -0,0 +1,68 @@
+import io
+import struct
+
+import pytest
+from PIL import Image, features
+
+from conftest import encode, gradient
+
+pytestmark = pytest.mark.skipif(not features.check('jpg_2000'), reason='Pillow built without OpenJPEG')
+
+
+@pytest.fixture(scope='module')
+def j2k_data():
+    return encode(gradient('RGB', (512, 384)), 'JPEG2000')
+
+
+def test_draft_picks_resolution_level(j2k_data):
+    with Image.open(io.BytesIO(j2k_data)) as im:
+        assert im.draft('RGB', (128, 96)) == ('RGB', (0, 0, 128.0, 96.0))
+        im.load()
+        assert im.size == (128, 96)
+
+
+def test_draft_needs_scale_of_two(j2k_data):
+    with Image.open(io.BytesIO(j2k_data)) as im:
+        assert im.draft('RGB', (300, 200)) is None
+        assert im.size == (512, 384)
+
+
+@pytest.mark.parametrize('reduce, size', [(0, (512, 384)), (1, (256, 192)), (2, (128, 96)), (3, (64, 48))])
+def test_reduce_after_draft(j2k_data, reduce, size):
+    # reduce replaces the draft reduction instead of adding to it
+    with Image.open(io.BytesIO(j2k_data)) as im:
+        im.draft('RGB', (128, 96))
+        im.reduce = reduce
+        im.load()
+        assert im.size == size
+        with Image.open(io.BytesIO(j2k_data)) as reference:
+            reference.reduce = reduce
+            reference.load()
+            assert im.tobytes() == reference.tobytes()
+
+
+def test_draft_after_reduce(j2k_data):
+    with Image.open(io.BytesIO(j2k_data)) as im:
+        im.reduce = 1
+        assert im.draft('RGB', (64, 48)) is None
+        im.load()
+        assert im.size == (256, 192)
+
+
+@pytest.mark.parametrize('no_jp2', [False, True])
+def test_draft_is_limited_by_decomposition_levels(no_jp2):
+    data = encode(gradient('RGB', (512, 384)), 'JPEG2000', num_resolutions=2, no_jp2=no_jp2)
+    with Image.open(io.BytesIO(data)) as im:
+        assert im.draft('RGB', (128, 96)) == ('RGB', (0, 0, 256.0, 192.0))
+
+
+@pytest.mark.parametrize('components, coc_index', [(3, b'\x01'), (300, b'\x01\x02')])
+def test_coc_levels_after_component_index(j2k_data, components, coc_index):
+    # COC: index of the component, its coding style, then the decomposition levels
+    spcoc = b'\x01\x04\x04\x00\x00'
+    coc = b'\xff\x53' + struct.pack('>H', 2 + len(coc_index) + 1 + len(spcoc)) + coc_index + b'\x00' + spcoc
+    with Image.open(io.BytesIO(j2k_data)) as im:
+        im._levels = None
+        im.fp = io.BytesIO(coc + b'\xff\x90')
+        im._parse_comment(components)
+        assert im._levels == 1
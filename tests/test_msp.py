@@ -0,0 +1,82 @@
+import io
+import struct
+
+import pytest
+from PIL import Image
+
+from conftest import encode, gradient
+
+
+def msp_v2(rows, size):
+    """A Windows Paint 2.0 (LinS) file with the given run-length encoded rows."""
+    header = [0] * 16
+    header[0], header[1] = struct.unpack('<2H', b'LinS')
+    header[2], header[3] = size
+    header[4:8] = 1, 1, 1, 1
+    header[8], header[9] = size
+    for word in header[:12]:
+        header[12] ^= word # Checksum
+    rowmap = struct.pack(f'<{size[1]}H', *(len(row) for row in rows))
+    return struct.pack('<16H', *header) + rowmap + b''.join(rows)
+
+
+def rle_row(row):
+    # Fill runs for repeated bytes, literal runs for the rest
+    out = bytearray()
+    x = 0
+    while x < len(row):
+        run = 1
+        while x + run < len(row) and run < 255 and row[x + run] == row[x]:
+            run += 1
+        if run > 1:
+            out += bytes((0, run, row[x]))
+        else:
+            out += bytes((1, row[x]))
+        x += run
+    return bytes(out)
+
+
+def test_round_trip_v1():
+    im = gradient('1', (101, 37))
+    with Image.open(io.BytesIO(encode(im, 'MSP'))) as reloaded:
+        assert reloaded.tobytes() == im.tobytes()
+
+
+def test_rle_v2():
+    im = gradient('1', (200, 47))
+    rowbytes = (im.width + 7) // 8
+    pixels = im.tobytes()
+    rows = [rle_row(pixels[y * rowbytes : (y + 1) * rowbytes]) for y in range(im.height)]
+    rows[5] = b'' # Blank row
+    with Image.open(io.BytesIO(msp_v2(rows, im.size))) as reloaded:
+        assert reloaded.mode == '1'
+        expected = bytearray(pixels)
+        expected[5 * rowbytes : 6 * rowbytes] = b'\xff' * rowbytes
+        assert reloaded.tobytes() == bytes(expected)
+
+
+def test_literal_and_fill_runs():
+    rows = [bytes((2, 0x0F, 0xF0, 0, 2, 0xAA)), bytes((0, 4, 0x00))]
+    with Image.open(io.BytesIO(msp_v2(rows, (32, 2)))) as im:
+        assert im.tobytes() == bytes((0x0F, 0xF0, 0xAA, 0xAA, 0, 0, 0, 0))
+
+
+@pytest.mark.parametrize(
+    'data, message',
+    [
+        (msp_v2([b'\x00\x04\xff', b'\x00\x04\xff'], (32, 2))[:-2], 'Truncated MSP file, expected 3 bytes on row 1'),
+        (msp_v2([b'\x00\x04\xff', b'\x00\x04'], (32, 2)), 'Corrupted MSP file in row 1'),
+        (msp_v2([b'\x00\x04\xff'] * 4, (32, 4))[:36], 'Truncated MSP file in row map'),
+    ],
+)
+def test_malformed_rle(data, message):
+    with Image.open(io.BytesIO(data)) as im:
+        with pytest.raises(OSError, match=message):
+            im.load()
+
+
+def test_bad_checksum():
+    data = bytearray(msp_v2([b'\x00\x04\xff'], (32, 1)))
+    data[24] ^= 1
+    with pytest.raises(Image.UnidentifiedImageError):
+        Image.open(io.BytesIO(data))
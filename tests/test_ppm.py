@@ -0,0 +1,88 @@
+import io
+
+import pytest
+from PIL import Image, ImageFile
+
+from conftest import encode, gradient
+
+
+def plain(im, maxval=255, comment=False):
+    """The image as plain (ASCII) PBM, PGM or PPM."""
+    magic = {'1': b'P1', 'L': b'P2', 'I': b'P2', 'RGB': b'P3'}[im.mode]
+    header = magic + b'\n%d %d\n' % im.size
+    if im.mode == '1':
+        tokens = [b'0' if value else b'1' for value in im.getdata()]
+        return header + b'\n'.join(b''.join(tokens[i : i + 70]) for i in range(0, len(tokens), 70))
+    header += b'%d\n' % maxval
+    values = list(im.getdata())
+    if im.mode == 'RGB':
+        values = [channel for pixel in values for channel in pixel]
+    lines = [b' '.join(b'%d' % value for value in values[i : i + 17]) for i in range(0, len(values), 17)]
+    if comment:
+        lines[1:1] = [b'# a comment in the data']
+    return header + b'\n'.join(lines) + b'\n'
+
+
+@pytest.fixture(params=[ImageFile.SAFEBLOCK, 7], ids=['one-block', 'small-blocks'])
+def block_size(request, monkeypatch):
+    # Small blocks split tokens and comments across reads
+    monkeypatch.setattr(ImageFile, 'SAFEBLOCK', request.param)
+    return request.param
+
+
+@pytest.mark.parametrize('mode', ['1', 'L', 'RGB'])
+def test_plain_matches_raw(mode, block_size):
+    im = gradient(mode, (67, 41))
+    with Image.open(io.BytesIO(plain(im, comment=True))) as plain_im:
+        with Image.open(io.BytesIO(encode(im, 'PPM'))) as raw_im:
+            assert plain_im.mode == raw_im.mode == mode
+            assert plain_im.tobytes() == raw_im.tobytes()
+
+
+@pytest.mark.parametrize('maxval', [1, 15, 1000, 65535])
+def test_plain_maxval_matches_raw(maxval, block_size):
+    im = gradient('L', (33, 29)).point(lambda value: value * maxval // 255)
+    raw_header = b'P5\n33 29\n%d\n' % maxval
+    if maxval < 256:
+        raw = raw_header + im.tobytes()
+    else:
+        raw = raw_header + b''.join(value.to_bytes(2, 'big') for value in im.getdata())
+    with Image.open(io.BytesIO(plain(im, maxval))) as plain_im:
+        with Image.open(io.BytesIO(raw)) as raw_im:
+            assert plain_im.mode == raw_im.mode
+            assert plain_im.tobytes() == raw_im.tobytes()
+
+
+def test_bitonal_without_whitespace():
+    with Image.open(io.BytesIO(b'P1\n3 2\n010\n1 1 0')) as im:
+        assert list(im.getdata()) == [255, 0, 255, 0, 0, 255]
+
+
+@pytest.mark.parametrize(
+    'data, message',
+    [
+        # Invalid tokens are reported even past the end of the image data
+        (b'P1\n2 1\n0 1 2', 'Invalid token for this mode: 2'),
+        (b'P1\n2 1\n0 x', 'Invalid token for this mode: x'),
+        (b'P2\n2 1\n255\n0 256', 'Channel value too large for this mode: 256'),
+        (b'P3\n1 1\n255\n1 2 -3', 'Channel value is negative: -3'),
+        (b'P2\n2 1\n255\n0 00000000001', 'Token too long found in data: 00000000001'),
+        (b'P2\n2 1\n255\n0 x', 'invalid literal'),
+    ],
+)
+def test_malformed(data, message):
+    with Image.open(io.BytesIO(data)) as im:
+        with pytest.raises(ValueError, match=message):
+            im.load()
+
+
+def test_blocks_ignore_data_past_the_image():
+    with Image.open(io.BytesIO(b'P2\n2 1\n255\n0 1 x')) as im:
+        assert list(im.getdata()) == [0, 1]
+
+
+@pytest.mark.parametrize('data', [b'P1\n3 1\n0 1', b'P2\n3 1\n255\n0 1', b'P3\n1 1\n255\n1 2'])
+def test_truncated(data):
+    with Image.open(io.BytesIO(data)) as im:
+        with pytest.raises(ValueError, match='not enough image data'):
+            im.load()
@@ -0,0 +1,168 @@
+import io
+import struct
+import sys
+
+import pytest
+from PIL import Image, ImageFile
+
+from conftest import encode, gradient
+
+END_MARKER = b'\x00' * 7 + b'\x01'
+
+
+def qoi_file(size, channels, ops):
+    return b'qoif' + struct.pack('>IIBB', *size, channels, 0) + ops + END_MARKER
+
+
+def noisy(mode, size):
+    # Mix of flat runs, small steps and random pixels, so every op is used
+    im = gradient(mode, size)
+    im.paste(Image.effect_noise((size[0] // 2, size[1] // 2), 64).convert(mode), (0, 0))
+    im.paste(im.getpixel((0, 0)), (size[0] // 2, size[1] // 2, size[0], size[1]))
+    return im
+
+
+def test_decodes_each_op():
+    ops = bytes((
+        0xFF, 16, 32, 48, 64,  # QOI_OP_RGBA
+        0x79,  # QOI_OP_DIFF +1, 0, -1
+        0xA2, 0x97,  # QOI_OP_LUMA green +2, red +3, blue +1
+        0x20,  # QOI_OP_INDEX of the first pixel
+        0xFE, 1, 2, 3,  # QOI_OP_RGB, keeping alpha
+        0xC1,  # QOI_OP_RUN of 2
+    ))
+    with Image.open(io.BytesIO(qoi_file((7, 1), 4, ops))) as im:
+        assert im.mode == 'RGBA'
+        assert list(im.getdata()) == [
+            (16, 32, 48, 64),
+            (17, 32, 47, 64),
+            (20, 34, 48, 64),
+            (16, 32, 48, 64),
+            (1, 2, 3, 64),
+            (1, 2, 3, 64),
+            (1, 2, 3, 64),
+        ]
+
+
+def previous_encoder(im):
+    # Ops of the previous encoder, which looped over the pixels in Python
+    opaque = 0xFF if im.mode == 'RGB' else 0
+    data = bytearray()
+    index = [0] * 64
+    previous = 0x000000FF
+    run_length = 0
+    for (pixel,) in struct.iter_unpack('>I', im.tobytes('raw', 'RGBX' if im.mode == 'RGB' else 'RGBA')):
+        pixel |= opaque
+        if pixel == previous:
+            run_length += 1
+            if run_length == 62:
+                data.append(0b11000000 | run_length - 1)
+                run_length = 0
+            continue
+        if run_length:
+            data.append(0b11000000 | run_length - 1)
+            run_length = 0
+        r, g, b, a = pixel >> 24, pixel >> 16 & 0xFF, pixel >> 8 & 0xFF, pixel & 0xFF
+        hash_value = (r * 3 + g * 5 + b * 7 + a * 11) % 64
+        if index[hash_value] == pixel:
+            data.append(hash_value)
+        else:
+            index[hash_value] = pixel
+            if a == previous & 0xFF:
+                diff_red = ((r - (previous >> 24) + 128) & 0xFF) - 128
+                diff_green = ((g - (previous >> 16 & 0xFF) + 128) & 0xFF) - 128
+                diff_blue = ((b - (previous >> 8 & 0xFF) + 128) & 0xFF) - 128
+                diff_red_green = diff_red - diff_green
+                diff_blue_green = diff_blue - diff_green
+                if -2 <= diff_red < 2 and -2 <= diff_green < 2 and -2 <= diff_blue < 2:
+                    data.append(0b01000000 | (diff_red + 2) << 4 | (diff_green + 2) << 2 | (diff_blue + 2))
+                elif -32 <= diff_green < 32 and -8 <= diff_red_green < 8 and -8 <= diff_blue_green < 8:
+                    data += bytes((0b10000000 | (diff_green + 32), (diff_red_green + 8) << 4 | (diff_blue_green + 8)))
+                else:
+                    data += bytes((0b11111110, r, g, b))
+            else:
+                data += bytes((0b11111111, r, g, b, a))
+        previous = pixel
+    if run_length:
+        data.append(0b11000000 | run_length - 1)
+    return bytes(data)
+
+
+def test_encodes_each_op():
+    im = Image.new('RGBA', (7, 1))
+    im.putdata([(16, 32, 48, 64), (17, 32, 47, 64), (20, 34, 48, 64), (16, 32, 48, 64), (1, 2, 3, 64), (1, 2, 3, 64), (1, 2, 3, 64)])
+    assert encode(im, 'QOI')[14:] == bytes((0xFF, 16, 32, 48, 64, 0x79, 0xA2, 0x97, 0x20, 0xFE, 1, 2, 3, 0xC1)) + END_MARKER
+
+
+@pytest.mark.parametrize('mode', ['RGB', 'RGBA'])
+@pytest.mark.parametrize('size', [(1, 1), (97, 61), (300, 400)])
+def test_matches_previous_encoder(mode, size):
+    im = noisy(mode, size)
+    assert encode(im, 'QOI')[14:-8] == previous_encoder(im)
+
+
+@pytest.mark.parametrize('mode', ['RGB', 'RGBA'])
+def test_encodes_runs(mode):
+    # Starting with the initial pixel, which is not in the index, and longer than 62 pixels
+    im = Image.new(mode, (200, 3), (0, 0, 0, 255))
+    im.paste((5, 6, 7, 255), (100, 1, 200, 3))
+    im.putpixel((10, 2), (0, 0, 0, 255))
+    data = encode(im, 'QOI')
+    assert data[14:-8] == previous_encoder(im)
+    with Image.open(io.BytesIO(data)) as reloaded:
+        assert reloaded.tobytes() == im.tobytes()
+
+
+def test_save_requires_numpy(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'numpy', None)
+    with pytest.raises(OSError, match='numpy'):
+        encode(gradient('RGB', (4, 4)), 'QOI')
+
+
+@pytest.mark.parametrize('mode', ['RGB', 'RGBA'])
+@pytest.mark.parametrize('size', [(1, 1), (97, 61), (300, 400)])
+def test_round_trip(mode, size):
+    im = noisy(mode, size)
+    with Image.open(io.BytesIO(encode(im, 'QOI'))) as reloaded:
+        assert reloaded.mode == mode
+        assert reloaded.tobytes() == im.tobytes()
+
+
+def test_long_runs_across_reads():
+    # Larger than one read, with runs crossing the read boundaries
+    im = Image.new('RGBA', (1000, 300), (10, 20, 30, 40))
+    im.paste(noisy('RGBA', (1000, 150)), (0, 0))
+    with Image.open(io.BytesIO(encode(im, 'QOI'))) as reloaded:
+        assert reloaded.tobytes() == im.tobytes()
+
+
+@pytest.mark.parametrize('channels', [3, 4])
+def test_truncated_in_every_op(channels):
+    ops = bytes((0xFF, 16, 32, 48, 64, 0xA2, 0x97, 0xFE, 1, 2, 3, 0x79))
+    data = qoi_file((5, 1), channels, ops)
+    header = 14
+    for end in range(header, header + len(ops)):
+        with Image.open(io.BytesIO(data[:end])) as im:
+            with pytest.raises(OSError, match='truncated'):
+                im.load()
+
+
+def test_load_truncated_image(monkeypatch):
+    monkeypatch.setattr(ImageFile, 'LOAD_TRUNCATED_IMAGES', True)
+    # Cut off within the second op, a QOI_OP_RGB
+    data = qoi_file((3, 1), 3, bytes((0xFE, 1, 2, 3, 0xFE, 4, 5, 6)))
+    with Image.open(io.BytesIO(data[:14 + 6])) as im:
+        im.load()
+        assert list(im.getdata()) == [(1, 2, 3), (0, 0, 0), (0, 0, 0)]
+
+
+def test_missing_end_marker():
+    # Pixel data complete, end marker cut off
+    data = qoi_file((2, 1), 3, bytes((0xFE, 1, 2, 3, 0xC0)))[:-8]
+    with Image.open(io.BytesIO(data)) as im:
+        assert list(im.getdata()) == [(1, 2, 3), (1, 2, 3)]
+
+
+def test_not_qoi():
+    with pytest.raises(Image.UnidentifiedImageError):
+        Image.open(io.BytesIO(b'qoix' + bytes(20)))
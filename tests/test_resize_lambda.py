@@ -0,0 +1,362 @@
+import base64
+import hashlib
+import io
+import json
+import os
+import shutil
+import struct
+
+import pytest
+from PIL import Image, ImageChops
+
+from conftest import encode, gradient
+
+SOURCE_BUCKET = 'uploads'
+
+
+def upload(s3, key, data, content_type='image/jpeg', metadata=None):
+    s3.put_object(Bucket=SOURCE_BUCKET, Key=key, Body=data, ContentType=content_type, Metadata=metadata or {})
+
+
+def s3_event(s3, key):
+    etag = s3.head_object(Bucket=SOURCE_BUCKET, Key=key)['ETag'].strip('"')
+    return {'Records': [{'s3': {'bucket': {'name': SOURCE_BUCKET}, 'object': {'key': key, 'eTag': etag}}}]}
+
+
+def rendition(s3, resize_lambda, key):
+    return s3.objects[(resize_lambda.DESTINATION_BUCKET, key)]
+
+
+@pytest.mark.parametrize('size', [(1000, 1000), (1000, 999), (999, 1000), (3000, 37), (37, 3000), (257, 256), (640, 427), (427, 640)])
+def test_thumbnail_size_matches_pillow(resize_lambda, size):
+    im = Image.new('1', size)
+    im.thumbnail((256, 256))
+    assert resize_lambda.thumbnail_size(size, 256) == im.size
+
+
+@pytest.mark.parametrize('size', [(2000, 1500), (1001, 757), (2003, 1501), (4099, 1027)])
+def test_upload_rendition_matches_thumbnail(s3, resize_lambda, size):
+    data = encode(gradient('RGB', size), 'JPEG', quality=95)
+    upload(s3, 'photo.jpg', data)
+    result = resize_lambda.lambda_handler(s3_event(s3, 'photo.jpg'), None)
+    assert result['statusCode'] == 200
+
+    # thumbnail() drafts, then resizes the draft box of the reduced image
+    with Image.open(io.BytesIO(data)) as expected:
+        expected.thumbnail((256, 256))
+        expected_data = encode(expected, 'JPEG', quality=resize_lambda.JPEG_QUALITY)
+    output = rendition(s3, resize_lambda, 'photo.jpg')
+    assert output['Body'] == expected_data
+    assert output['Metadata'] == {'width': str(expected.width), 'height': str(expected.height)}
+
+
+def test_upload_rendition_small_image_is_copied(s3, resize_lambda):
+    data = encode(gradient('RGB', (200, 100)), 'PNG')
+    upload(s3, 'small.png', data, 'image/png')
+    assert resize_lambda.lambda_handler(s3_event(s3, 'small.png'), None)['statusCode'] == 200
+    assert rendition(s3, resize_lambda, 'small.png')['Body'] == data
+
+
+def test_on_demand_rendition_resizes_draft_box(s3, resize_lambda):
+    data = encode(gradient('RGB', (2001, 1501)), 'JPEG', quality=95)
+    resize_lambda.SOURCE_BUCKET = SOURCE_BUCKET
+    upload(s3, 'photo.jpg', data)
+    event = {'rawPath': '/photo.jpg', 'queryStringParameters': {'w': '250'}}
+    result = resize_lambda.lambda_handler(event, None)
+    assert result['statusCode'] == 200, result['body']
+
+    size = resize_lambda.rendition_size((2001, 1501), 250, None)
+    with Image.open(io.BytesIO(data)) as source:
+        box = source.draft(None, (size[0] * 2, size[1] * 2))[1]
+        expected = source.resize(size, Image.Resampling.BICUBIC, box=box, reducing_gap=2.0)
+    assert base64.b64decode(result['body']) == encode(expected, 'JPEG', quality=resize_lambda.JPEG_QUALITY)
+
+
+def test_import_leaves_other_files_in_cache_dir(tmp_path, monkeypatch):
+    from conftest import load_lambda
+
+    cache_dir = tmp_path / 'shared'
+    cache_dir.mkdir()
+    (cache_dir / 'notes.txt').write_text('not ours')
+    (cache_dir / 'runtime-unmarked').mkdir() # No lock file, so not created by the Lambda
+    monkeypatch.setenv('ORIGINALS_CACHE_DIR', str(cache_dir))
+
+    first = load_lambda('resizeLambda')
+    open(os.path.join(first.originals_cache_dir, 'original'), 'wb').close()
+    second = load_lambda('resizeLambda')
+    # The first runtime still holds its lock, so its directory is kept
+    assert os.path.exists(os.path.join(first.originals_cache_dir, 'original'))
+    assert second.originals_cache_dir != first.originals_cache_dir
+
+    first.originals_cache_lock.close() # As when that runtime exits
+    third = load_lambda('resizeLambda')
+    assert not os.path.exists(first.originals_cache_dir)
+    assert os.path.exists(second.originals_cache_dir)
+    assert sorted(os.listdir(cache_dir)) == sorted([
+        'notes.txt', 'runtime-unmarked',
+        os.path.basename(second.originals_cache_dir), os.path.basename(third.originals_cache_dir),
+    ])
+
+
+def test_cache_budget_fits_free_space(resize_lambda):
+    assert 0 < resize_lambda.ORIGINALS_CACHE_MAX_BYTES <= shutil.disk_usage(resize_lambda.originals_cache_dir).free
+
+
+class CountingS3Client:
+    """Wraps an S3 stand-in, counting get_object calls."""
+
+    def __init__(self, s3):
+        self.s3 = s3
+        self.downloads = 0
+
+    def get_object(self, **kwargs):
+        self.downloads += 1
+        return self.s3.get_object(**kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.s3, name)
+
+
+@pytest.mark.parametrize('size', [(200, 100), (800, 600)])
+def test_cached_original_is_read_from_disk(s3, resize_lambda, monkeypatch, size):
+    data = encode(gradient('RGB', size), 'PNG')
+    upload(s3, 'image.png', data, 'image/png')
+    event = s3_event(s3, 'image.png')
+    counting = CountingS3Client(s3)
+    resize_lambda.s3_client = counting
+    resize_lambda.CONTENT_ADDRESSED_KEYS = True
+    monkeypatch.setattr(resize_lambda, 'find_existing_rendition', lambda key: None)
+
+    outputs = []
+    for _ in range(2):
+        assert resize_lambda.lambda_handler(event, None)['statusCode'] == 200
+        key = json.loads(s3.objects[(resize_lambda.STATUS_BUCKET, 'status/image.png.json')]['Body'])['renditions'][0]['key']
+        outputs.append((key, rendition(s3, resize_lambda, key)['Body']))
+    assert counting.downloads == 1
+    assert outputs[0] == outputs[1]
+    assert hashlib.sha256(data).hexdigest() in outputs[0][0]
+    if size == (200, 100):
+        assert outputs[0][1] == data
+
+
+def content_addressed_upload(s3, resize_lambda, key, data, content_type, max_size):
+    upload(s3, key, data, content_type, {'max-dimension': str(max_size)})
+    assert resize_lambda.lambda_handler(s3_event(s3, key), None)['statusCode'] == 200
+    status = json.loads(s3.objects[(resize_lambda.STATUS_BUCKET, f'status/{key}.json')]['Body'])
+    return status['renditions'][0]['key']
+
+
+def test_content_addressed_key_of_original_ignores_max_size(s3, resize_lambda):
+    resize_lambda.CONTENT_ADDRESSED_KEYS = True
+    data = encode(gradient('RGB', (200, 100)), 'PNG')
+    first = content_addressed_upload(s3, resize_lambda, 'a.png', data, 'image/png', 300)
+    second = content_addressed_upload(s3, resize_lambda, 'b.png', data, 'image/png', 400)
+    assert first == second == f'renditions/{hashlib.sha256(data).hexdigest()}/200x100.png'
+
+
+def test_content_addressed_key_has_output_size_and_settings(s3, resize_lambda, monkeypatch):
+    resize_lambda.CONTENT_ADDRESSED_KEYS = True
+    digest_prefix = 'renditions/'
+    data = encode(gradient('RGB', (800, 400)), 'PNG')
+    plain = content_addressed_upload(s3, resize_lambda, 'a.png', data, 'image/png', 256)
+    assert plain.startswith(digest_prefix) and plain.endswith('/256x128.png')
+
+    monkeypatch.setattr(resize_lambda, 'QUANTIZE_PNG', True)
+    quantized = content_addressed_upload(s3, resize_lambda, 'b.png', data, 'image/png', 256)
+    assert quantized != plain
+    assert quantized.endswith('/256x128-p4096.png')
+
+    jpeg = encode(gradient('RGB', (800, 400)), 'JPEG')
+    assert content_addressed_upload(s3, resize_lambda, 'c.jpg', jpeg, 'image/jpeg', 256).endswith('/256x128-q90.jpeg')
+    # Without an embedded thumbnail, the full image is resized as before
+    monkeypatch.setattr(resize_lambda, 'USE_EMBEDDED_THUMBNAIL', True)
+    assert content_addressed_upload(s3, resize_lambda, 'd.jpg', jpeg, 'image/jpeg', 256).endswith('/256x128-q90.jpeg')
+
+
+def with_exif_thumbnail(im, thumb):
+    """JPEG of im with thumb as its EXIF (IFD1) thumbnail."""
+    thumb_data = encode(thumb, 'JPEG')
+    # Little-endian TIFF header, an empty IFD0 and an IFD1 with the thumbnail's offset and length
+    ifd1_offset = 8 + 2 + 4
+    thumb_offset = ifd1_offset + 2 + 2 * 12 + 4
+    tiff = b'II*\0' + struct.pack('<I', 8) + struct.pack('<HI', 0, ifd1_offset)
+    tiff += struct.pack('<H', 2) + struct.pack('<HHII', 0x0201, 4, 1, thumb_offset) + struct.pack('<HHII', 0x0202, 4, 1, len(thumb_data))
+    tiff += struct.pack('<I', 0) + thumb_data
+    return encode(im, 'JPEG', exif=b'Exif\0\0' + tiff)
+
+
+def test_content_addressed_key_of_embedded_thumbnail_rendition(s3, resize_lambda, monkeypatch):
+    resize_lambda.CONTENT_ADDRESSED_KEYS = True
+    monkeypatch.setattr(resize_lambda, 'USE_EMBEDDED_THUMBNAIL', True)
+    # Within the aspect ratio tolerance, but resized to a different height than the full image
+    data = with_exif_thumbnail(gradient('RGB', (800, 400)), gradient('RGB', (300, 151)))
+    key = content_addressed_upload(s3, resize_lambda, 'e.jpg', data, 'image/jpeg', 256)
+    assert key.endswith('/256x129-q90-t.jpeg')
+    with Image.open(io.BytesIO(rendition(s3, resize_lambda, key)['Body'])) as im:
+        assert im.size == (256, 129)
+
+
+def test_on_demand_key_has_settings(resize_lambda, monkeypatch):
+    assert resize_lambda.rendition_key('a.png', 320, None, 'PNG') == 'on-demand/a.png/w320.png'
+    monkeypatch.setattr(resize_lambda, 'QUANTIZE_PNG', True)
+    assert resize_lambda.rendition_key('a.png', 320, None, 'PNG') == 'on-demand/a.png/w320-p4096.png'
+    assert resize_lambda.rendition_key('a.jpg', 320, 200, 'JPEG') == 'on-demand/a.jpg/w320-h200-q90.jpeg'
+
+
+def on_demand_rendition(s3, resize_lambda, key, data, width):
+    resize_lambda.SOURCE_BUCKET = SOURCE_BUCKET
+    upload(s3, key, data, 'image/png')
+    result = resize_lambda.lambda_handler({'rawPath': f'/{key}', 'queryStringParameters': {'w': str(width)}}, None)
+    assert result['statusCode'] == 200, result['body']
+    return Image.open(io.BytesIO(base64.b64decode(result['body'])))
+
+
+def two_colors(mode, size):
+    im = Image.new(mode, size, (200, 30, 60, 255))
+    im.paste((20, 120, 220, 255), (0, 0, size[0] // 2, size[1]))
+    return im
+
+
+def noise(mode, size):
+    # Too many colors to be quantized
+    bands = [Image.effect_noise(size, 100) for _ in range(3)]
+    return Image.merge(mode, bands + [Image.new('L', size, 255)] * (mode == 'RGBA'))
+
+
+def test_quantize_large_rendition(s3, resize_lambda, monkeypatch):
+    # Over ANALYSIS_MAX_SIZE, so the source statistics are sampled
+    monkeypatch.setattr(resize_lambda, 'QUANTIZE_PNG', True)
+    source = two_colors('RGBA', (4096, 2048))
+    with on_demand_rendition(s3, resize_lambda, 'logo.png', encode(source, 'PNG'), 2048) as im:
+        assert im.mode == 'P'
+        assert 'transparency' not in im.info
+        expected = source.resize((2048, 1024), Image.Resampling.BICUBIC, reducing_gap=2.0).convert('RGB')
+        assert max(high for _, high in ImageChops.difference(im.convert('RGB'), expected).getextrema()) <= 8
+
+
+def test_quantize_keeps_colors_of_unresized_rendition(s3, resize_lambda, monkeypatch):
+    monkeypatch.setattr(resize_lambda, 'QUANTIZE_PNG', True)
+    source = two_colors('RGB', (300, 200))
+    source.putpixel((10, 10), (1, 2, 3))
+    with on_demand_rendition(s3, resize_lambda, 'logo.png', encode(source, 'PNG'), 300) as im:
+        assert im.mode == 'P'
+        assert im.convert('RGB').tobytes() == source.tobytes()
+
+
+def test_quantize_solid_rendition(s3, resize_lambda, monkeypatch):
+    monkeypatch.setattr(resize_lambda, 'QUANTIZE_PNG', True)
+    source = Image.new('RGB', (4096, 2048), (12, 34, 56))
+    with on_demand_rendition(s3, resize_lambda, 'blank.png', encode(source, 'PNG'), 100) as im:
+        assert im.mode == 'P'
+        assert im.convert('RGB').getcolors() == [(100 * 50, (12, 34, 56))]
+
+
+def test_photo_is_not_quantized(s3, resize_lambda, monkeypatch):
+    monkeypatch.setattr(resize_lambda, 'QUANTIZE_PNG', True)
+    with on_demand_rendition(s3, resize_lambda, 'noise.png', encode(noise('RGB', (300, 200)), 'PNG'), 150) as im:
+        assert im.mode == 'RGB'
+
+
+def test_alpha_is_kept_by_default(s3, resize_lambda):
+    with on_demand_rendition(s3, resize_lambda, 'opaque.png', encode(two_colors('RGBA', (300, 200)), 'PNG'), 150) as im:
+        assert im.mode == 'RGBA'
+
+
+def test_unused_alpha_is_dropped(s3, resize_lambda, monkeypatch):
+    monkeypatch.setattr(resize_lambda, 'QUANTIZE_PNG', True)
+    with on_demand_rendition(s3, resize_lambda, 'opaque.png', encode(noise('RGBA', (300, 200)), 'PNG'), 150) as im:
+        assert im.mode == 'RGB'
+    with on_demand_rendition(s3, resize_lambda, 'opaque-la.png', encode(gradient('LA', (300, 200)), 'PNG'), 150) as im:
+        assert im.mode == 'L'
+    transparent = noise('RGBA', (300, 200))
+    transparent.putpixel((10, 10), (0, 0, 0, 0))
+    with on_demand_rendition(s3, resize_lambda, 'transparent.png', encode(transparent, 'PNG'), 150) as im:
+        assert im.mode == 'RGBA'
+
+
+def test_alpha_missed_by_sample_is_kept(s3, resize_lambda, monkeypatch):
+    monkeypatch.setattr(resize_lambda, 'QUANTIZE_PNG', True)
+    source = noise('RGBA', (3000, 2000))
+    source.paste((0, 0, 0, 0), (2, 0, 4, 2000))
+    source.load()
+    assert not resize_lambda.image_stats(source).transparent
+    with on_demand_rendition(s3, resize_lambda, 'edge.png', encode(source, 'PNG'), 300) as im:
+        assert im.mode == 'RGBA'
+        assert im.getchannel('A').getextrema()[0] < 255
+
+
+def test_source_is_analyzed_once(s3, resize_lambda, monkeypatch):
+    monkeypatch.setattr(resize_lambda, 'QUANTIZE_PNG', True)
+    calls = []
+    stats = resize_lambda.ImageStats
+    monkeypatch.setattr(resize_lambda, 'ImageStats', lambda **fields: calls.append(fields) or stats(**fields))
+    data = encode(two_colors('RGBA', (800, 600)), 'PNG')
+    for width in (100, 200, 300):
+        on_demand_rendition(s3, resize_lambda, 'logo.png', data, width).close()
+    assert len(calls) == 1
+
+
+def on_demand(resize_lambda, key, params):
+    return resize_lambda.lambda_handler({'rawPath': f'/{key}', 'queryStringParameters': params}, None)
+
+
+@pytest.mark.parametrize('params', [{}, {'w': 'abc'}, {'w': '0'}, {'h': '100000'}, {'w': '100', 'fmt': 'tiff'}])
+def test_on_demand_rejects_invalid_requests(s3, resize_lambda, params):
+    result = on_demand(resize_lambda, 'photo.jpg', params)
+    assert result['statusCode'] == 400
+    assert json.loads(result['body'])['message']
+
+
+def test_on_demand_missing_original(s3, resize_lambda):
+    resize_lambda.SOURCE_BUCKET = SOURCE_BUCKET
+    result = on_demand(resize_lambda, 'missing.png', {'w': '100'})
+    assert result['statusCode'] == 404
+
+
+def test_on_demand_rendition_is_stored_and_reused(s3, resize_lambda, monkeypatch):
+    on_demand_rendition(s3, resize_lambda, 'logo.png', encode(two_colors('RGB', (300, 200)), 'PNG'), 150).close()
+    key = resize_lambda.rendition_key('logo.png', 150, None, 'PNG')
+    stored = rendition(s3, resize_lambda, key)['Body']
+    monkeypatch.setattr(resize_lambda, 'get_source_image', lambda *args: pytest.fail('resized again'))
+    result = on_demand(resize_lambda, 'logo.png', {'w': '150'})
+    assert result['statusCode'] == 200
+    assert base64.b64decode(result['body']) == stored
+
+
+def test_on_demand_large_rendition_is_redirected(s3, resize_lambda, monkeypatch):
+    monkeypatch.setattr(resize_lambda, 'MAX_INLINE_RESPONSE_BYTES', 100)
+    resize_lambda.SOURCE_BUCKET = SOURCE_BUCKET
+    upload(s3, 'logo.png', encode(gradient('RGB', (300, 200)), 'PNG'), 'image/png')
+    key = resize_lambda.rendition_key('logo.png', 150, None, 'PNG')
+    for _ in range(2): # Resized, then stored
+        result = on_demand(resize_lambda, 'logo.png', {'w': '150'})
+        assert result['statusCode'] == 302
+        assert f'/{key}?' in result['headers']['Location']
+    assert (resize_lambda.DESTINATION_BUCKET, key) in s3.objects
+
+
+def test_image_stats(resize_lambda):
+    stats = resize_lambda.image_stats(gradient('LA', (300, 200)))
+    assert stats.extrema[1] == (255, 255) # Not the L band's
+    assert not stats.transparent and not stats.solid
+    stats = resize_lambda.image_stats(Image.new('LA', (3000, 2000), (40, 128)))
+    assert stats.solid and stats.transparent and stats.sampled
+    assert stats.colors == [(1024 * 683, (40, 128))]
+    assert resize_lambda.image_stats(noise('RGB', (300, 200))).colors is None
+
+
+@pytest.mark.parametrize('source, img_format', [
+    (noise('RGB', (300, 200)), 'JPEG'),
+    (two_colors('RGB', (300, 200)), 'PNG'),
+    (Image.new('RGBA', (300, 200), (0, 0, 0, 0)), 'PNG'),
+])
+def test_on_demand_auto_format(s3, resize_lambda, source, img_format):
+    resize_lambda.SOURCE_BUCKET = SOURCE_BUCKET
+    upload(s3, 'image.png', encode(source, 'PNG'), 'image/png')
+    for _ in range(2): # Resized, then stored
+        result = on_demand(resize_lambda, 'image.png', {'w': '150', 'fmt': 'auto'})
+        assert result['statusCode'] == 200
+        assert result['headers']['Content-Type'] == Image.MIME[img_format]
+    assert (resize_lambda.DESTINATION_BUCKET, 'on-demand/image.png/w150-q90.auto') in s3.objects
+    with Image.open(io.BytesIO(base64.b64decode(result['body']))) as im:
+        assert im.format == img_format
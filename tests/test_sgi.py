@@ -0,0 +1,32 @@
+import io
+
+import pytest
+from PIL import Image
+
+from conftest import encode, gradient
+
+
+@pytest.mark.parametrize('mode', ['L', 'RGB', 'RGBA'])
+@pytest.mark.parametrize('bpc', [1, 2])
+def test_round_trip(mode, bpc):
+    im = gradient(mode, (67, 41))
+    with Image.open(io.BytesIO(encode(im, 'SGI', bpc=bpc))) as reloaded:
+        assert reloaded.mode == mode
+        assert reloaded.tobytes() == im.tobytes()
+
+
+def test_16bit_keeps_high_bytes():
+    # The 16-bit decoder keeps the high byte of each sample
+    im = gradient('RGB', (16, 8))
+    data = bytearray(encode(im, 'SGI', bpc=2))
+    data[512 + 1] = 0x7F # Low byte of the first sample, bottom-up
+    with Image.open(io.BytesIO(data)) as reloaded:
+        assert reloaded.tobytes() == im.tobytes()
+
+
+@pytest.mark.parametrize('bpc', [1, 2])
+def test_truncated(bpc):
+    data = encode(gradient('RGB', (67, 41)), 'SGI', bpc=bpc)
+    with Image.open(io.BytesIO(data[:-100])) as im:
+        with pytest.raises(OSError if bpc == 1 else ValueError):
+            im.load()